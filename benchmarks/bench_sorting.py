@@ -0,0 +1,257 @@
+"""
+Benchmarks for building and sorting prerequisite graphs.
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.bench_sorting --sizes 1000 10000 --output bench.json
+    python -m benchmarks.bench_sorting --sizes 1000 10000 --compare bench.json
+
+Each case is a prerequisite generator from ``card_sorting`` or a synthetic collection, and each stage of
+the case is timed and, unless ``--no-memory`` is given, run a second time to measure its peak memory
+with ``tracemalloc``.
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import card_sorting
+from beyondki import sorting
+from beyondki.graph import CompactCardGraph
+from beyondki.pipeline import CardStream, build_note_prereqs_graph, build_tag_group_graph, expand_to_cards, \
+    sort_card_graph, sort_note_graph
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# The dense generator has O(n^2) edges, so it is skipped for larger sizes.
+MAX_DENSE_CARDS = 2_000
+# The transitive reduction keeps a bitset of ancestors per card, so it grows faster than linearly, and is
+# skipped for larger sizes.
+MAX_REDUCTION_CARDS = 100_000
+# A stage is reported as a regression if it takes this much longer than in the baseline.
+DEFAULT_TOLERANCE = 0.2
+# The number of cards that the lazy sort stage takes, e.g., a day of new cards.
+STREAM_CARDS = 200
+
+GENERATORS = {
+    "dense": card_sorting.dense_prereqs,
+    "sparse": card_sorting.sparse_prereqs,
+    "single": card_sorting.single_prereqs,
+    "none": card_sorting.no_prereqs,
+}
+
+
+def synthetic_collection(n_cards: int, seed: int = 0):
+    """
+    Generate the ``(nid, tags)`` rows and the cids of each note of a textbook-like collection with about
+    ``n_cards`` cards.
+
+    Notes are grouped in chapters of sections. Each note is tagged with its section, requires the
+    previous section of its chapter, and some notes also require an earlier chapter. Notes have one to
+    three cards.
+    """
+    rng = random.Random(seed)
+    tag_rows = []
+    cids_by_note = {}
+    nid = 1_000_000
+    cid = 1_000_000
+    n_chapter_cards = max(1, n_cards // 20)
+    n_section_cards = max(1, n_chapter_cards // 10)
+    while cid - 1_000_000 < n_cards:
+        n_so_far = cid - 1_000_000
+        chapter = n_so_far // n_chapter_cards
+        section = (n_so_far % n_chapter_cards) // n_section_cards
+        tags = [f"chapter_{chapter}::section_{section}"]
+        if section > 0:
+            tags.append(f"pre:chapter_{chapter}::section_{section - 1}")
+        if chapter > 0 and rng.random() < 0.1:
+            tags.append(f"pre:chapter_{rng.randrange(chapter)}")
+        tag_rows.append((nid, " " + " ".join(tags) + " "))
+
+        n_note_cards = rng.randint(1, 3)
+        cids_by_note[nid] = list(range(cid, cid + n_note_cards))
+        nid += 1
+        cid += n_note_cards
+    return tag_rows, cids_by_note
+
+
+def generator_stages(generator: Callable, n_cards: int) -> list[tuple[str, Callable[[], Any]]]:
+    """Get the stages for sorting ``n_cards`` with a prerequisite generator from ``card_sorting``."""
+    cids = list(range(1, n_cards + 1))
+    prerequisites = [generator(cid) for cid in cids]
+    positions = [card_sorting.cid_order(cid) for cid in cids]
+    state = {}
+
+    def generate():
+        state["graphs"] = sorting.generate_card_graphs(cids, generator, card_sorting.cid_order)
+
+    def sort():
+        return sorting.sort_graphs(*state["graphs"])
+
+    def reduce():
+        return sorting.transitive_reduction(state["graphs"][0])
+
+    def compact():
+        state["compact"] = CompactCardGraph.from_mappings(cids, prerequisites, positions)
+
+    def sort_compact():
+        return sorting.sort_compact_graph(state["compact"])
+
+    def stream():
+        return sorting.SortStream(state["compact"]).take(STREAM_CARDS)
+
+    def end_to_end():
+        return sorting.sort(cids, generator, card_sorting.cid_order)
+
+    stages = [("generate_card_graphs", generate), ("sort_graphs", sort), ("transitive_reduction", reduce),
+              ("compact_graph", compact), ("sort_compact_graph", sort_compact),
+              ("stream_take", stream), ("end_to_end", end_to_end)]
+    if n_cards > MAX_REDUCTION_CARDS:
+        stages.remove(("transitive_reduction", reduce))
+    return stages
+
+
+def collection_stages(n_cards: int) -> list[tuple[str, Callable[[], Any]]]:
+    """Get the stages for sorting a synthetic collection with about ``n_cards`` cards."""
+    tag_rows, cids_by_note = synthetic_collection(n_cards)
+    state = {}
+
+    def note_graph():
+        state["notes"] = build_note_prereqs_graph(tag_rows)
+
+    def card_graph():
+        state["cards"] = expand_to_cards(state["notes"], cids_by_note)
+
+    def sort():
+        return sort_card_graph(state["cards"])
+
+    def sort_notes():
+        return sort_note_graph(state["notes"], cids_by_note)
+
+    def tag_group_graph():
+        state["groups"] = build_tag_group_graph(tag_rows)
+
+    def sort_tag_groups():
+        return sort_note_graph(state["groups"], cids_by_note)
+
+    def stream():
+        return CardStream(state["groups"], cids_by_note).take(STREAM_CARDS)
+
+    def end_to_end():
+        return sort_note_graph(build_tag_group_graph(tag_rows), cids_by_note)
+
+    return [("note_graph", note_graph), ("card_graph", card_graph), ("sort", sort), ("sort_notes", sort_notes),
+            ("tag_group_graph", tag_group_graph), ("sort_tag_groups", sort_tag_groups), ("stream_take", stream),
+            ("end_to_end", end_to_end)]
+
+
+def measure(stages: list[tuple[str, Callable[[], Any]]], memory: bool) -> list[dict]:
+    """Run each stage in order, and return its wall time and, optionally, peak memory."""
+    results = []
+    for name, stage in stages:
+        gc.collect()
+        start = time.perf_counter()
+        stage()
+        seconds = time.perf_counter() - start
+        results.append({"stage": name, "seconds": seconds})
+
+    if memory:
+        # Run the stages again, because tracing allocations slows them down.
+        for result, (_, stage) in zip(results, stages):
+            gc.collect()
+            tracemalloc.start()
+            stage()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return results
+
+
+def run(sizes: list[int], cases: list[str], memory: bool) -> dict:
+    """Run the benchmarks and return the results in the JSON format."""
+    results = []
+    for case in cases:
+        for n_cards in sizes:
+            if case == "dense" and n_cards > MAX_DENSE_CARDS:
+                continue
+            if case == "collection":
+                stages = collection_stages(n_cards)
+            else:
+                stages = generator_stages(GENERATORS[case], n_cards)
+            for result in measure(stages, memory):
+                result = {"case": case, "n_cards": n_cards, **result}
+                results.append(result)
+                print(_format_result(result), flush=True)
+
+    return {"meta": {"timestamp": datetime.now(timezone.utc).isoformat(),
+                     "python": sys.version,
+                     "platform": platform.platform()},
+            "results": results}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare the timings in ``results`` to ``baseline``, print a table, and return descriptions of the
+    stages that got slower by more than ``tolerance``.
+    """
+    def key(result):
+        return result["case"], result["n_cards"], result["stage"]
+
+    baseline_seconds = {key(result): result["seconds"] for result in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':<12}{'n_cards':>10}  {'stage':<22}{'baseline':>10}{'current':>10}{'ratio':>8}")
+    for result in results["results"]:
+        old = baseline_seconds.get(key(result))
+        if old is None:
+            continue
+        ratio = result["seconds"] / old if old > 0 else float("inf")
+        case, n_cards, stage = key(result)
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  SLOWER"
+            regressions.append(f"{case}/{n_cards}/{stage}: {ratio:.2f}x")
+        print(f"{case:<12}{n_cards:>10}  {stage:<22}{old:>10.4f}{result['seconds']:>10.4f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of cards")
+    parser.add_argument("--cases", nargs="+", default=[*GENERATORS, "collection"],
+                        choices=[*GENERATORS, "collection"], help="prerequisite structures to benchmark")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurements")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare the timings to a saved JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative slowdown that counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.cases, memory=not args.no_memory)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):\n  " + "\n  ".join(regressions))
+            return 1
+    return 0
+
+
+def _format_result(result: dict) -> str:
+    line = f"{result['case']:<12}{result['n_cards']:>10}  {result['stage']:<22}{result['seconds']:>10.4f} s"
+    if "peak_bytes" in result:
+        line += f"{result['peak_bytes'] / 2 ** 20:>10.1f} MiB"
+    return line
+
+
+if __name__ == "__main__":
+    sys.exit(main())
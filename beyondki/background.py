@@ -0,0 +1,138 @@
+"""
+Reordering in the background, so that the caller, e.g., Anki's main thread, is only blocked while the
+notes and cards are read and while the changes are written.
+
+For example, in an add-on, where ``mw.col`` may only be used on the main thread::
+
+    job = start_reorder(mw.col)
+    # Then, on the main thread once ``job.done()``:
+    try:
+        job.finish(mw.col)
+    except CollectionChangedError:
+        job = start_reorder(mw.col)  # Try again with the new state of the collection.
+
+A job that is no longer needed, e.g., because notes were edited in the meantime, can be cancelled, and a
+new one started. A running computation stops soon, see ``compute_reorder``.
+"""
+import threading
+from concurrent.futures import CancelledError, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from anki.cards import CardId
+from anki.collection import Collection
+
+from beyondki.ordering import NoteOrder, needs_order_columns
+from beyondki.pipeline import sort_collection_data
+from beyondki.reader import CollectionData
+from beyondki.writeback import apply_due_changes, compute_changes
+
+
+class CollectionChangedError(Exception):
+    """Raised when a collection was modified after it was read for a ``ReorderJob``."""
+
+
+def compute_reorder(data: CollectionData,
+                    keep_slots: bool = False,
+                    break_loops: bool = False,
+                    minimal: bool = False,
+                    order: Optional[NoteOrder] = None,
+                    cancel_event: Optional[threading.Event] = None) -> list[tuple[CardId, int]]:
+    """
+    Sort the notes and cards in ``data`` with ``pipeline.sort_collection_data``, in the secondary
+    ``order`` (see ``ordering``), and compute the due position changes of the new cards, with
+    ``writeback.compute_changes``.
+
+    This only uses ``data``, so it can run in a thread or a process pool.
+
+    @raise CancelledError: if ``cancel_event`` is set. It is checked before and after the graph is built,
+        while the cards are sorted (see ``sort_collection_data``) and before the changes are computed.
+    """
+    def check_cancelled() -> None:
+        if cancel_event is not None and cancel_event.is_set():
+            raise CancelledError()
+
+    ordered_cids = sort_collection_data(data, break_loops, order=order, check_cancelled=check_cancelled)
+    return compute_changes(ordered_cids, data.new_card_dues(), keep_slots, minimal)
+
+
+class ReorderJob:
+    """
+    A reorder of a collection that runs in the background, from a snapshot of the notes and cards.
+
+    ``future`` gives the changes computed by ``compute_reorder``, e.g., to add a callback when it is done.
+    ``mod`` is the modification time of the collection when it was read. ``cancel_event`` is passed to
+    ``compute_reorder``, if it runs where it can see it.
+    """
+
+    def __init__(self, future: Future, mod: int, cancel_event: Optional[threading.Event] = None):
+        self.future = future
+        self.mod = mod
+        self.cancel_event = cancel_event
+        self._cancelled = False
+
+    def done(self) -> bool:
+        """Check whether the changes have been computed (or the computation failed or was cancelled)."""
+        return self.future.done()
+
+    def cancel(self) -> None:
+        """
+        Cancel the job, so that ``finish`` does not write anything. A computation that is already running
+        stops at its next stage, or, in a process pool, is left to complete, but its result is discarded.
+        """
+        self._cancelled = True
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        self.future.cancel()
+
+    def is_stale(self, col: Collection) -> bool:
+        """Check whether ``col`` was modified after it was read, so that the changes may be wrong."""
+        return col.mod != self.mod
+
+    def finish(self, col: Collection, timeout: Optional[float] = None) -> int:
+        """
+        Wait for the changes, for at most ``timeout`` seconds, and write them to ``col`` in one transaction.
+        Call it on the thread that owns ``col``.
+
+        @return: the number of cards that were repositioned.
+        @raise CollectionChangedError: if ``col`` was modified after it was read. Nothing is written.
+        @raise CancelledError: if the job was cancelled.
+        """
+        if self._cancelled:
+            raise CancelledError()
+        changes = self.future.result(timeout)
+        if self.is_stale(col):
+            raise CollectionChangedError(f'The collection was modified after it was read for sorting '
+                                         f'(modification time {self.mod}, now {col.mod})')
+        apply_due_changes(col, changes)
+        return len(changes)
+
+
+def start_reorder(col: Collection,
+                  search: Optional[str] = None,
+                  break_loops: bool = False,
+                  minimal: bool = False,
+                  executor: Optional[Executor] = None,
+                  order: Optional[NoteOrder] = None) -> ReorderJob:
+    """
+    Read the notes and cards of ``col`` (or those matching the Anki ``search``, as in
+    ``pipeline.reorder_collection``) with ``CollectionData``, and sort them in the background.
+
+    The snapshot is sorted in a new thread, or with ``executor``. Sorting is pure Python, so with a
+    thread it still competes for the GIL, but a ``ProcessPoolExecutor`` can be used instead, since the
+    snapshot and the changes are picklable, as is ``order`` unless it is a local function. The cancel
+    event cannot be sent to another process, so a job in a ``ProcessPoolExecutor`` runs to completion even
+    if it is cancelled.
+    """
+    mod = col.mod
+    data = CollectionData.read(col.db, None if search is None else col.find_cards(search),
+                               order is not None and needs_order_columns(order))
+    cancel_event = None if isinstance(executor, ProcessPoolExecutor) else threading.Event()
+    args = (compute_reorder, data, search is not None, break_loops, minimal, order, cancel_event)
+    if executor is not None:
+        return ReorderJob(executor.submit(*args), mod, cancel_event)
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="beyondki")
+    future = executor.submit(*args)
+    # Let the thread exit when it is done.
+    executor.shutdown(wait=False)
+    return ReorderJob(future, mod, cancel_event)
@@ -0,0 +1,135 @@
+"""
+Reordering many collection files at once, e.g., in a nightly job, with a bounded process pool::
+
+    records = reorder_files(paths, max_workers=4)
+    failed = [record for record in records if record.error is not None]
+
+Each collection is processed by ``pipeline.reorder_file`` in a worker process, which opens it once. A
+failure is recorded for its collection and does not stop the others, even if it kills the worker.
+"""
+import os
+import time
+import traceback
+from collections import deque
+from collections.abc import Callable, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from beyondki.pipeline import reorder_file
+
+
+@dataclass
+class BatchRecord:
+    """The outcome of reordering one collection of a batch."""
+    path: str
+    # Wall time in the worker, including opening and closing the collection.
+    seconds: float = 0.0
+    n_cards: int = 0
+    n_repositioned: int = 0
+    # Seconds per stage of ``pipeline.reorder_file``, if it finished.
+    timings: dict[str, float] = field(default_factory=dict)
+    # The type and message of the exception that stopped it, if any, and its traceback.
+    error: Optional[str] = None
+    traceback: Optional[str] = None
+
+    def to_json(self) -> dict:
+        return {"collection": self.path,
+                "seconds": self.seconds,
+                "n_cards": self.n_cards,
+                "n_repositioned": self.n_repositioned,
+                "timings": self.timings,
+                "error": self.error}
+
+
+def reorder_files(paths: Sequence[Union[str, Path]],
+                  max_workers: Optional[int] = None,
+                  callback: Optional[Callable[[BatchRecord], None]] = None,
+                  **options: Any) -> list[BatchRecord]:
+    """
+    Reorder each collection in ``paths`` with ``pipeline.reorder_file``, concurrently.
+
+    ``options`` are passed on to ``reorder_file``, e.g., ``search`` or ``dry_run``, and must be picklable.
+    ``callback`` is called in this process with the record of each collection as soon as it finishes,
+    e.g., to log progress.
+
+    If a worker process dies, e.g., because it ran out of memory, the pool is broken and every collection
+    that was still running fails with it. Those collections are retried one at a time, so that only the
+    ones that kill their worker again are recorded as failed, and the rest continue in a new pool.
+
+    @param max_workers: the number of processes, by default the number of CPUs, but at most one per path.
+    @return: a record for each path, in the order of ``paths``.
+    """
+    paths = [str(path) for path in paths]
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(paths)))
+    records: list[Optional[BatchRecord]] = [None] * len(paths)
+
+    def finish(i: int, record: BatchRecord) -> None:
+        records[i] = record
+        if callback is not None:
+            callback(record)
+
+    queue = deque(range(len(paths)))
+    while queue:
+        for i in _run_pool(paths, queue, max_workers, options, finish):
+            if _run_pool(paths, deque([i]), 1, options, finish):
+                finish(i, BatchRecord(paths[i], error="BrokenProcessPool: the worker process died"))
+    return records
+
+
+def _run_pool(paths: list[str],
+              queue: deque,
+              max_workers: int,
+              options: dict[str, Any],
+              finish: Callable[[int, BatchRecord], None]) -> list[int]:
+    """
+    Reorder the paths with the indices in ``queue`` in a new pool, removing them from ``queue``, and pass
+    each record to ``finish``.
+
+    At most ``max_workers`` paths are submitted at a time, so that all of them are running.
+
+    @return: the indices of the paths that were running when the pool broke, or ``[]`` if it did not.
+    """
+    with ProcessPoolExecutor(max_workers) as pool:
+        running: dict[Future, int] = {}
+        while queue or running:
+            while queue and len(running) < max_workers:
+                i = queue.popleft()
+                running[pool.submit(_reorder_file_record, paths[i], options)] = i
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                # The other running paths fail, too, once the pool notices that it is broken.
+                wait(running)
+                done = list(running)
+            broken = []
+            for future in done:
+                i = running.pop(future)
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    broken.append(i)
+                elif error is not None:
+                    # E.g., the record could not be sent back.
+                    finish(i, BatchRecord(paths[i], error=_describe(error)))
+                else:
+                    finish(i, future.result())
+            if broken:
+                return sorted(broken)
+    return []
+
+
+def _reorder_file_record(path: str, options: dict[str, Any]) -> BatchRecord:
+    """Reorder one collection in a worker, and record the outcome instead of raising."""
+    start = time.perf_counter()
+    try:
+        result = reorder_file(path, **options)
+    except Exception as error:  # pylint: disable=broad-except
+        return BatchRecord(path, time.perf_counter() - start, error=_describe(error),
+                           traceback=traceback.format_exc())
+    return BatchRecord(path, time.perf_counter() - start, len(result.ordered_cids), result.n_repositioned,
+                       result.timings)
+
+
+def _describe(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
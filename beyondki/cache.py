@@ -0,0 +1,118 @@
+"""
+On-disk cache of the prerequisite graph of the notes of a collection, from ``pipeline.build_tag_group_graph``.
+
+The file is only a serialization of the graph: it saves parsing the tags and finding the notes of the tag groups
+again, but the graph is still converted back to a dict with ``CachedGraph.to_mapping`` to be sorted.
+"""
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+from anki.notes import NoteId
+
+from beyondki.graph import INT64, CompactCardGraph
+
+# Suffix of the cache file, which is stored next to the collection file.
+CACHE_SUFFIX = ".beyondki.cache"
+MAGIC = b"BKGC"
+CACHE_VERSION = 2
+
+# Magic, version, digest of the tag rows, and the numbers of nodes and edges. The header is followed by
+# three arrays of native 64-bit integers: the nodes (nids and tag groups), the offsets and the targets.
+# The size of the header is a multiple of eight, so the arrays are aligned.
+HEADER = struct.Struct("=4sI32sqq")
+
+
+@dataclass
+class CachedGraph:
+    """
+    A graph from ``build_tag_group_graph``, and the digest of the ``(nid, tags)`` rows it was built from.
+
+    ``graph`` has the nodes in the order of the keys of the original graph, with their prerequisites. If it
+    was loaded with ``load_graph``, its arrays are views of the mapped file, which ``close`` releases.
+    """
+    digest: bytes
+    graph: CompactCardGraph
+    buffer: Optional[mmap.mmap] = None
+
+    @classmethod
+    def from_mapping(cls, digest: bytes, graph: dict[int, list[int]]) -> "CachedGraph":
+        keys = list(graph)
+        return cls(digest, CompactCardGraph.from_mappings(keys, graph, range(len(keys))))
+
+    def to_mapping(self) -> dict[int, list[int]]:
+        """Copy the graph back into the form returned by ``build_tag_group_graph``."""
+        keys = self.graph.cids.tolist()
+        return {key: [keys[j] for j in self.graph[i]] for i, key in enumerate(keys)}
+
+    def close(self) -> None:
+        """Unmap the file of a loaded graph, which must not be used afterwards."""
+        if self.buffer is None:
+            return
+        self.graph.release()
+        self.buffer.close()
+        self.buffer = None
+
+
+def default_cache_path(collection_path: Union[str, Path]) -> Path:
+    """Get the path of the cache file for a collection file, e.g. ``collection.beyondki.cache``."""
+    collection_path = Path(collection_path)
+    return collection_path.with_name(collection_path.stem + CACHE_SUFFIX)
+
+
+def tag_rows_digest(tag_rows: Iterable[tuple[NoteId, str]]) -> bytes:
+    """Hash the ``(nid, tags)`` rows, which are all that the graph of ``build_tag_group_graph`` depends on."""
+    rows = "\x1e".join(f"{nid}\x1f{tags}" for nid, tags in tag_rows)
+    return hashlib.blake2b(rows.encode(), digest_size=32).digest()
+
+
+def save_graph(path: Union[str, Path], cached: CachedGraph) -> None:
+    """Write ``cached`` to ``path``, replacing the previous file atomically."""
+    graph = cached.graph
+    header = HEADER.pack(MAGIC, CACHE_VERSION, cached.digest, len(graph), graph.n_edges)
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(header)
+        for values in (graph.cids, graph.offsets, graph.targets):
+            file.write(_as_int64(values).tobytes())
+    os.replace(temp_path, path)
+
+
+def load_graph(path: Union[str, Path]) -> Optional[CachedGraph]:
+    """
+    Memory-map the graph stored at ``path``. The arrays are read from the file lazily, without copying,
+    until the result is closed with ``CachedGraph.close``.
+
+    Return ``None`` if the file is missing or is not a valid cache file.
+    """
+    try:
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None  # Note that mapping an empty file raises a ValueError.
+
+    if len(buffer) < HEADER.size:
+        buffer.close()
+        return None
+    magic, version, digest, n_nodes, n_edges = HEADER.unpack_from(buffer)
+    sizes = [n_nodes, n_nodes + 1, n_edges]
+    if magic != MAGIC or version != CACHE_VERSION or len(buffer) != HEADER.size + 8 * sum(sizes):
+        buffer.close()
+        return None
+
+    values = memoryview(buffer)[HEADER.size:].cast(INT64)
+    nodes, offsets, targets = values[:n_nodes], values[n_nodes:2 * n_nodes + 1], values[2 * n_nodes + 1:]
+    return CachedGraph(digest, CompactCardGraph(nodes, offsets, targets), buffer)
+
+
+def _as_int64(values: Sequence[int]) -> array:
+    if isinstance(values, array) and values.typecode == INT64:
+        return values
+    return array(INT64, values)
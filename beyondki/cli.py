@@ -0,0 +1,168 @@
+"""
+Reorder the new cards of Anki collection files by their prerequisites.
+
+For example::
+
+    beyondki ~/Anki2/User\\ 1/collection.anki2 --deck Biology --dry-run --json order.json
+
+The collection must not be open in Anki at the same time. Several collections are processed
+concurrently, see ``batch``.
+"""
+import argparse
+import html
+import json
+import re
+import sqlite3
+import sys
+from typing import Optional
+
+from anki.errors import DBError, InvalidInput, SearchError
+
+from beyondki import batch
+from beyondki.incremental import reorder_file_incrementally
+from beyondki.ordering import ORDER_KEYS, parse_order
+from beyondki.pipeline import reorder_file
+from beyondki.profiling import Profiler
+from beyondki.sorting import PrerequisiteLoopError
+
+
+def build_search(search: Optional[str] = None, deck: Optional[str] = None) -> Optional[str]:
+    """Combine a search string and a deck name (which includes its subdecks) into one Anki search."""
+    terms = []
+    if search:
+        terms.append(f"({search})")
+    if deck:
+        # Escape the characters that have a special meaning in searches, including the wildcards.
+        escaped = "".join("\\" + c if c in '\\"*_' else c for c in deck)
+        terms.append(f'"deck:{escaped}"')
+    return " ".join(terms) or None
+
+
+def plain_text(message: str) -> str:
+    """Strip the HTML markup and Unicode isolation marks from an error message of Anki's backend."""
+    return html.unescape(re.sub(r"<[^>]*>|[\u2068\u2069]", "", message)).strip()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Run the reorder tool from the command line."""
+    parser = argparse.ArgumentParser(prog="beyondki", description=__doc__.split("\n\n", maxsplit=1)[0].strip())
+    parser.add_argument("collection", nargs="+", help="path of the collection file, e.g. collection.anki2, or "
+                                                      "several paths to process them concurrently")
+    parser.add_argument("--jobs", type=int,
+                        help="number of collections to process at once (default: the number of CPUs)")
+    parser.add_argument("--search", help="only sort the cards matching this Anki search")
+    parser.add_argument("--deck", help="only sort the cards in this deck and its subdecks")
+    parser.add_argument("--break-loops", action="store_true",
+                        help="break prerequisite loops instead of stopping with an error")
+    parser.add_argument("--order", nargs="+", metavar="KEY",
+                        help=f"secondary order of the notes, where later keys break ties: {', '.join(ORDER_KEYS)} "
+                             f"or random:SEED (default: nid)")
+    parser.add_argument("--minimal", action="store_true",
+                        help="move as few cards as possible, instead of renumbering them from 0 (with --search "
+                             "or --deck, cards are always only moved among their own positions)")
+    parser.add_argument("--spacing", type=int, default=1,
+                        help="distance between the positions of renumbered cards; leaving gaps lets later "
+                             "--minimal runs move fewer cards (default: %(default)s)")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep the prerequisite graph in a file next to the collection, and only rebuild it "
+                             "when tags change (not with --search or --deck)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-read the notes that changed since the last incremental run, whose state is "
+                             "kept in a file next to the collection, and move as few cards as possible")
+    parser.add_argument("--dry-run", action="store_true", help="compute the new order without writing it")
+    parser.add_argument("--json", metavar="PATH", help="write the new order and timings as JSON ('-' for stdout)")
+    parser.add_argument("--profile", action="store_true",
+                        help="report every stage, with call counts and graph sizes, instead of the main timings")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also measure the peak memory of each stage (slower)")
+    args = parser.parse_args(argv)
+    if args.spacing < 1:
+        parser.error("--spacing must be at least 1")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.order is not None:
+        try:
+            parse_order(args.order)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.incremental:
+        if args.search or args.deck or args.order or args.cache or args.spacing != 1:
+            parser.error("--incremental cannot be combined with --search, --deck, --order, --cache or --spacing")
+        if len(args.collection) > 1:
+            parser.error("--incremental only works with a single collection")
+    if len(args.collection) > 1:
+        if args.profile or args.profile_memory:
+            parser.error("--profile and --profile-memory only work with a single collection")
+        return _main_batch(args)
+
+    profiler = Profiler(memory=args.profile_memory)
+    try:
+        if args.incremental:
+            result = reorder_file_incrementally(args.collection[0], args.break_loops, args.dry_run, profiler)
+        else:
+            result = reorder_file(args.collection[0], build_search(args.search, args.deck), args.break_loops,
+                                  args.dry_run, profiler, args.minimal, args.spacing, args.order, args.cache)
+    except (OSError, PrerequisiteLoopError) as error:
+        print(f"beyondki: {error}", file=sys.stderr)
+        return 1
+    except (sqlite3.DatabaseError, DBError) as error:
+        # E.g., the file is not a collection. The messages do not include the path.
+        print(f"beyondki: {args.collection[0]}: {error}", file=sys.stderr)
+        return 1
+    except (SearchError, InvalidInput) as error:
+        print(f"beyondki: {plain_text(str(error))}", file=sys.stderr)
+        return 1
+
+    # Keep stdout clean if the JSON goes there.
+    report = sys.stderr if args.json == "-" else sys.stdout
+    action = "Would reposition" if result.dry_run else "Repositioned"
+    print(f"{action} {result.n_repositioned} of {len(result.ordered_cids)} cards in {result.path}", file=report)
+    if args.profile or args.profile_memory:
+        print(profiler.summary(), file=report)
+    else:
+        for stage, seconds in result.timings.items():
+            print(f"  {stage:<10}{seconds:>10.4f} s", file=report)
+
+    output = result.to_json()
+    if args.profile or args.profile_memory:
+        output["profile"] = profiler.to_json()
+    if args.json == "-":
+        json.dump(output, sys.stdout)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(output, file)
+    return 0
+
+
+def _main_batch(args: argparse.Namespace) -> int:
+    """Reorder several collections with ``batch.reorder_files``, reporting each one as it finishes."""
+    report = sys.stderr if args.json == "-" else sys.stdout
+    action = "Would reposition" if args.dry_run else "Repositioned"
+
+    def print_record(record: batch.BatchRecord) -> None:
+        if record.error is None:
+            print(f"{action} {record.n_repositioned} of {record.n_cards} cards in {record.path} "
+                  f"({record.seconds:.2f} s)", file=report)
+        else:
+            print(f"beyondki: {record.path}: {record.error}", file=sys.stderr)
+
+    records = batch.reorder_files(args.collection, args.jobs, callback=print_record,
+                                  search=build_search(args.search, args.deck), break_loops=args.break_loops,
+                                  dry_run=args.dry_run, minimal=args.minimal, spacing=args.spacing, order=args.order,
+                                  cache=args.cache)
+    n_failed = sum(record.error is not None for record in records)
+    print(f"Processed {len(records)} collections, {n_failed} failed", file=report)
+
+    output = [record.to_json() for record in records]
+    if args.json == "-":
+        json.dump(output, sys.stdout)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(output, file)
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
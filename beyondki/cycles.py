@@ -0,0 +1,106 @@
+"""Detection and breaking of prerequisite loops."""
+from collections.abc import Hashable, Iterable, Mapping, Sequence
+from typing import Optional, TypeVar
+
+Key = TypeVar("Key", bound=Hashable)
+
+
+def strongly_connected_components(neighbors: Sequence[Iterable[int]]) -> list[list[int]]:
+    """
+    Find the strongly connected components of a graph with the nodes 0, 1, ..., n - 1, where
+    ``neighbors[i]`` are the nodes that ``i`` has an edge to.
+
+    This is Tarjan's algorithm with an explicit stack instead of recursion, so it runs in O(V + E) time
+    for graphs of any depth. Components are returned in reverse topological order.
+    """
+    n_nodes = len(neighbors)
+    index = [-1] * n_nodes
+    lowlink = [0] * n_nodes
+    on_stack = [False] * n_nodes
+    stack: list[int] = []
+    components: list[list[int]] = []
+    counter = 0
+
+    for root in range(n_nodes):
+        if index[root] != -1:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, iter(neighbors[root]))]
+
+        while work:
+            node, remaining = work[-1]
+            for neighbor in remaining:
+                if index[neighbor] == -1:
+                    # Visit the neighbor, then come back to the remaining neighbors of node.
+                    index[neighbor] = lowlink[neighbor] = counter
+                    counter += 1
+                    stack.append(neighbor)
+                    on_stack[neighbor] = True
+                    work.append((neighbor, iter(neighbors[neighbor])))
+                    break
+                if on_stack[neighbor] and index[neighbor] < lowlink[node]:
+                    lowlink[node] = index[neighbor]
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+def find_loops(graph: Mapping[Key, Iterable[Key]]) -> list[list[Key]]:
+    """
+    Find the prerequisite loops in ``graph``, which maps each key to its prerequisites.
+
+    Each loop is a strongly connected component with more than one member, or a single key that is its
+    own prerequisite. Cards or notes that merely depend on a loop are not included. Members of each loop,
+    and the loops themselves, are ordered as the keys of ``graph``. Prerequisites that are not keys of
+    ``graph`` are ignored.
+    """
+    keys = list(graph.keys())
+    position = {key: i for i, key in enumerate(keys)}
+    neighbors = [[position[prereq] for prereq in graph[key] if prereq in position] for key in keys]
+
+    loops = []
+    for component in strongly_connected_components(neighbors):
+        if len(component) > 1 or component[0] in neighbors[component[0]]:
+            loops.append(sorted(component))
+    loops.sort()
+    return [[keys[i] for i in loop] for loop in loops]
+
+
+def break_loops(graph: Mapping[Key, Sequence[Key]],
+                loops: Iterable[Sequence[Key]],
+                position: Optional[Mapping[Key, int]] = None) -> dict[Key, list[Key]]:
+    """
+    Return a copy of ``graph`` without loops, given the ``loops`` found by ``find_loops``.
+
+    Within each loop, a member only keeps the prerequisites that come before it in the secondary order,
+    given by ``position`` (by default, the order of the keys of ``graph``). This makes the result
+    deterministic and keeps as much of the loop's ordering as possible. Edges outside of loops are not
+    changed.
+    """
+    if position is None:
+        position = {key: i for i, key in enumerate(graph.keys())}
+
+    result = {key: list(prereqs) for key, prereqs in graph.items()}
+    for loop in loops:
+        members = set(loop)
+        for key in loop:
+            result[key] = [prereq for prereq in graph[key]
+                           if prereq not in members or position[prereq] < position[key]]
+    return result
@@ -0,0 +1,185 @@
+"""Compact, array-backed prerequisite graphs."""
+from array import array
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from itertools import accumulate
+from typing import Optional, Union
+
+from anki.cards import CardId
+
+# Typecode for signed 64-bit integers, which is large enough for any CID.
+INT64 = "q"
+# Either an array with the INT64 typecode or a memoryview cast to it, e.g., of a memory-mapped file.
+Int64Array = Union[array, memoryview]
+
+
+class CompactCardGraph:
+    """
+    A card graph stored in compressed sparse row (CSR) form.
+
+    Each card is identified by a dense index, which is its position in the secondary order. The
+    neighbors of the card with index ``i`` are ``targets[offsets[i]:offsets[i + 1]]``, also given as
+    dense indices. Every edge costs eight bytes, instead of a boxed int inside a Python list. The arrays
+    must not be modified after the graph is created.
+
+    A graph built by ``from_mappings`` or ``from_card_graphs`` stores the prerequisites of each card,
+    i.e., it corresponds to a ``requirement_graph``. Its ``transpose`` corresponds to the
+    ``dependents_graph``.
+    """
+    __slots__ = ("cids", "offsets", "targets", "_index", "_targets_view")
+
+    def __init__(self, cids: Int64Array, offsets: Int64Array, targets: Int64Array):
+        if not len(offsets) == len(cids) + 1:
+            raise ValueError(f'Expected {len(cids) + 1} offsets for {len(cids)} cids, got {len(offsets)}')
+        if not offsets[-1] == len(targets):
+            raise ValueError(f'The last offset ({offsets[-1]}) does not match the number of targets '
+                             f'({len(targets)})')
+        self.cids = cids
+        self.offsets = offsets
+        self.targets = targets
+        self._index: Optional[dict[CardId, int]] = None
+        self._targets_view = memoryview(targets)
+
+    @classmethod
+    def from_mappings(cls,
+                      cids: Sequence[CardId],
+                      prerequisites: Union[Mapping[CardId, Sequence[CardId]], Sequence[Sequence[CardId]]],
+                      positions: Union[Mapping[CardId, int], Sequence[int]]) -> "CompactCardGraph":
+        """
+        Build the prerequisite graph of ``cids`` directly, without creating a ``CardGraph``.
+
+        The arguments are the same as for ``sorting.generate_card_graphs_from_mappings``.
+        """
+        if not isinstance(cids, Sequence):
+            raise ValueError(f'cids was a {type(cids)} instead of a Sequence')
+
+        if isinstance(prerequisites, Mapping):
+            prerequisites = [prerequisites.get(cid, ()) for cid in cids]
+        if isinstance(positions, Mapping):
+            positions = [positions[cid] for cid in cids]
+        if not len(prerequisites) == len(cids) == len(positions):
+            raise ValueError(f'prerequisites and positions must have one entry for each of the {len(cids)} cids')
+
+        sorted_cids = array(INT64)
+        index: dict[CardId, int] = {}
+        sorted_prerequisites = []
+        for i in sorted(range(len(cids)), key=positions.__getitem__):
+            cid = cids[i]
+            if cid in index:
+                continue  # Duplicate cid.
+            index[cid] = len(sorted_cids)
+            sorted_cids.append(cid)
+            sorted_prerequisites.append(prerequisites[i])
+
+        offsets = array(INT64, [0])
+        targets = array(INT64)
+        for cid, required_cids in zip(sorted_cids, sorted_prerequisites):
+            if not isinstance(required_cids, Sequence):
+                raise ValueError(f'The prerequisites of CID={cid} were a {type(required_cids)} instead of a '
+                                 f'Sequence')
+            for required_cid in required_cids:
+                try:
+                    targets.append(index[required_cid])
+                except KeyError:
+                    raise ValueError(f'The CID={required_cid} was listed as a prerequisite of CID={cid} but was '
+                                     f'not included in the list of cids.') from None
+            offsets.append(len(targets))
+
+        graph = cls(sorted_cids, offsets, targets)
+        graph._index = index
+        return graph
+
+    @classmethod
+    def from_card_graphs(cls, requirement_graph: Mapping[CardId, Sequence[CardId]]) -> "CompactCardGraph":
+        """
+        Convert a ``requirement_graph``, as returned by ``sorting.generate_card_graphs``.
+
+        The keys of ``requirement_graph`` must already be in the secondary order.
+        """
+        cids = list(requirement_graph.keys())
+        return cls.from_mappings(cids, requirement_graph, range(len(cids)))
+
+    def to_card_graphs(self):
+        """
+        Convert the graph back to a ``requirement_graph`` and a ``dependents_graph``, in the same form as
+        returned by ``sorting.generate_card_graphs``.
+        """
+        cids = self.cids
+        requirement_graph = {cids[i]: [cids[j] for j in self[i]] for i in range(len(self))}
+        dependents = self.transpose()
+        dependents_graph = {cids[i]: [cids[j] for j in dependents[i]] for i in range(len(self))}
+        return requirement_graph, dependents_graph
+
+    def release(self) -> None:
+        """
+        Release the arrays if they are memoryviews, e.g., of a memory-mapped file, so that it can be closed.
+        The graph must not be used afterwards.
+        """
+        for values in (self._targets_view, self.cids, self.offsets, self.targets):
+            if isinstance(values, memoryview):
+                values.release()
+
+    def transpose(self) -> "CompactCardGraph":
+        """
+        Return the graph with every edge reversed.
+
+        The neighbors of each card in the result are sorted by index, matching the order of the lists in a
+        ``dependents_graph``.
+        """
+        n_cards = len(self)
+        offsets = self.offsets
+
+        # Count the number of incoming edges of each card, then use the running totals as offsets.
+        counts = [0] * (n_cards + 1)
+        for target in self.targets:
+            counts[target + 1] += 1
+        reverse_offsets = array(INT64, accumulate(counts))
+
+        # Fill in the sources in increasing order, so that each list of neighbors is sorted.
+        next_free = reverse_offsets.tolist()
+        reverse_targets = array(INT64, bytes(8 * len(self.targets)))
+        for source in range(n_cards):
+            for target in self._targets_view[offsets[source]:offsets[source + 1]]:
+                k = next_free[target]
+                reverse_targets[k] = source
+                next_free[target] = k + 1
+
+        graph = CompactCardGraph(self.cids, reverse_offsets, reverse_targets)
+        graph._index = self._index
+        return graph
+
+    def filtered(self, is_kept: Callable[[int, int], bool]) -> "CompactCardGraph":
+        """Return a copy of the graph with only the edges ``(i, j)`` for which ``is_kept(i, j)`` is true."""
+        offsets = array(INT64, [0])
+        targets = array(INT64)
+        for i in range(len(self)):
+            targets.extend(j for j in self[i] if is_kept(i, j))
+            offsets.append(len(targets))
+
+        graph = CompactCardGraph(self.cids, offsets, targets)
+        graph._index = self._index
+        return graph
+
+    def degrees(self) -> array:
+        """Return the number of neighbors of each card."""
+        offsets = self.offsets
+        return array(INT64, (offsets[i + 1] - offsets[i] for i in range(len(self))))
+
+    def index_of(self, cid: CardId) -> int:
+        """Return the dense index of ``cid``."""
+        if self._index is None:
+            self._index = {cid: i for i, cid in enumerate(self.cids)}
+        return self._index[cid]
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.targets)
+
+    def __len__(self) -> int:
+        return len(self.cids)
+
+    def __getitem__(self, i: int) -> memoryview:
+        """Return the indices of the neighbors of the card with index ``i``, without copying."""
+        return self._targets_view[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[CardId]:
+        return iter(self.cids)
@@ -0,0 +1,257 @@
+"""Incremental re-sorting of a collection after notes are added, edited or deleted."""
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+from anki.cards import CardId
+from anki.collection import Collection
+from anki.notes import NoteId
+from anki.utils import ids2str
+
+from beyondki import profiling
+from beyondki.pipeline import ReorderResult, cards_by_note, check_note_loops, sort_note_graph
+from beyondki.prerequisites import extract_prerequisite_tags_bulk
+from beyondki.profiling import Profiler
+from beyondki.tags import TagIndex, note_tag_rows
+from beyondki.writeback import compute_changes, new_card_dues, reorder_new_cards
+
+# Suffix of the state file, which is stored next to the collection file.
+STATE_SUFFIX = ".beyondki.json"
+STATE_VERSION = 2
+
+# Fetch the tags of at most this many changed notes per query.
+CHUNK_SIZE = 1000
+
+
+@dataclass
+class SortState:
+    """
+    The notes and their prerequisite graph from the last sort of a collection, and the card order.
+
+    The graph has a tag group for each prerequisite tag, as in ``pipeline.build_tag_group_graph``, so a
+    change of the tags of a note only affects the groups whose tag matches its old or new tags.
+    """
+    # When the notes were read, in seconds, like their modification times.
+    snapshot_time: int = 0
+    note_mods: dict[NoteId, int] = field(default_factory=dict)
+    note_tags: dict[NoteId, str] = field(default_factory=dict)
+    # The ID of the tag group of each prerequisite tag, in lower case, and the notes that match it.
+    group_ids: dict[str, int] = field(default_factory=dict)
+    group_nids: dict[int, list[NoteId]] = field(default_factory=dict)
+    # The tag groups that each note requires.
+    note_groups: dict[NoteId, list[int]] = field(default_factory=dict)
+    ordered_cids: list[CardId] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "SortState":
+        """Load the state from ``path``. Return an empty state if the file is missing or out of date."""
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return cls()
+        if data.get("version") != STATE_VERSION:
+            return cls()
+
+        return cls(snapshot_time=data["snapshot_time"],
+                   note_mods={NoteId(int(nid)): mod for nid, mod in data["note_mods"].items()},
+                   note_tags={NoteId(int(nid)): tags for nid, tags in data["note_tags"].items()},
+                   group_ids=data["group_ids"],
+                   group_nids={int(group_id): nids for group_id, nids in data["group_nids"].items()},
+                   note_groups={NoteId(int(nid)): groups for nid, groups in data["note_groups"].items()},
+                   ordered_cids=data["ordered_cids"])
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Save the state to ``path``, replacing the previous state atomically."""
+        data = {"version": STATE_VERSION,
+                "snapshot_time": self.snapshot_time,
+                "note_mods": self.note_mods,
+                "note_tags": self.note_tags,
+                "group_ids": self.group_ids,
+                "group_nids": self.group_nids,
+                "note_groups": self.note_groups,
+                "ordered_cids": self.ordered_cids}
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    def graph(self) -> dict[int, list[int]]:
+        """Get the prerequisite graph in the form returned by ``pipeline.build_tag_group_graph``."""
+        return {**self.group_nids, **self.note_groups}
+
+
+@dataclass
+class IncrementalResult:
+    """What changed in an incremental re-sort."""
+    changed_nids: list[NoteId]
+    deleted_nids: list[NoteId]
+    # The prerequisite tags whose notes were found again.
+    resolved_tags: list[str]
+    ordered_cids: list[CardId]
+    n_repositioned: int
+
+
+def default_state_path(collection_path: Union[str, Path]) -> Path:
+    """Get the path of the state file for a collection file, e.g. ``collection.beyondki.json``."""
+    collection_path = Path(collection_path)
+    return collection_path.with_name(collection_path.stem + STATE_SUFFIX)
+
+
+def incremental_reorder(col: Collection,
+                        state_path: Optional[Union[str, Path]] = None,
+                        break_loops: bool = False,
+                        dry_run: bool = False) -> IncrementalResult:
+    """
+    Re-sort ``col`` using the state saved by the previous run, and reposition as few new cards as
+    possible (see ``writeback.compute_minimal_changes``).
+
+    Only the notes that were added, edited or deleted since the previous run (according to their
+    modification times) are read from the collection, and only the tag groups that could have been
+    affected by them are resolved again. On the first run, everything is computed from scratch. See
+    ``pipeline.check_note_loops`` for ``break_loops``. With ``dry_run``, nothing is written, and the
+    state is not saved.
+    """
+    if state_path is None:
+        state_path = default_state_path(col.path)
+    state = SortState.load(state_path)
+
+    with profiling.stage("read"):
+        # Taken before reading, so that an edit in the same second as the read is found by the next run.
+        snapshot_time = int(time.time())
+        current_mods = {NoteId(nid): mod for nid, mod in col.db.all("select id, mod from notes")}
+        cids_by_note = cards_by_note(col)
+        # Modification times are in seconds, so a note that was modified in the second of the last read
+        # may have been modified after it, without a change of its modification time.
+        changed_nids = [nid for nid, mod in current_mods.items()
+                        if state.note_mods.get(nid) != mod or mod >= state.snapshot_time]
+        deleted_nids = [nid for nid in state.note_mods if nid not in current_mods]
+
+        cards_unchanged = {cid for cids in cids_by_note.values() for cid in cids} == set(state.ordered_cids)
+        if not changed_nids and not deleted_nids and cards_unchanged:
+            # Nothing changed, so the order is still valid.
+            return IncrementalResult([], [], [], state.ordered_cids, 0)
+        changed_tags = _changed_note_tags(col, changed_nids, len(current_mods))
+
+    with profiling.stage("graph"):
+        resolved_tags = update_state(state, current_mods, changed_tags)
+        state.snapshot_time = snapshot_time
+        note_prereqs_graph = check_note_loops(state.graph(), state.note_tags.items(), break_loops)
+    with profiling.stage("sort"):
+        state.ordered_cids = sort_note_graph(note_prereqs_graph, cids_by_note)
+
+    if dry_run:
+        with profiling.stage("diff"):
+            n_repositioned = len(compute_changes(state.ordered_cids, new_card_dues(col), minimal=True))
+    else:
+        with profiling.stage("write"):
+            n_repositioned = reorder_new_cards(col, state.ordered_cids, minimal=True)
+            state.save(state_path)
+    return IncrementalResult(changed_nids, deleted_nids, resolved_tags, state.ordered_cids, n_repositioned)
+
+
+def reorder_file_incrementally(path: Union[str, Path],
+                               break_loops: bool = False,
+                               dry_run: bool = False,
+                               profiler: Optional[Profiler] = None) -> ReorderResult:
+    """
+    Open the collection at ``path`` and re-sort it with ``incremental_reorder``, keeping the state in a
+    file next to it. The result and ``profiler`` are as in ``pipeline.reorder_file``.
+    """
+    path = Path(path)
+    if not path.is_file():
+        # Opening a missing collection would create an empty one.
+        raise FileNotFoundError(f"No collection at {path}")
+
+    if profiler is None:
+        profiler = Profiler()
+    with profiler:
+        with profiler.stage("open"):
+            col = Collection(str(path))
+        try:
+            result = incremental_reorder(col, break_loops=break_loops, dry_run=dry_run)
+        finally:
+            with profiler.stage("close"):
+                col.close(save=not dry_run)
+
+    timings = {stats.name: stats.seconds for stats in profiler.stages.values() if stats.depth == 0}
+    return ReorderResult(str(path), result.ordered_cids, result.n_repositioned, dry_run, timings)
+
+
+def update_state(state: SortState,
+                 current_mods: dict[NoteId, int],
+                 changed_tags: dict[NoteId, str]) -> list[str]:
+    """
+    Update ``state`` in place for the notes in ``changed_tags`` (new or edited notes, with their current
+    tags) and the notes that are missing from ``current_mods`` (deleted notes).
+
+    The tag groups of the prerequisites of the changed notes are updated, and the notes of a group are
+    found again if it is new or its tag matches an old or new tag of a changed or deleted note. Groups
+    that no note requires any more are removed.
+
+    @return: the prerequisite tags whose notes were found again.
+    """
+    index = TagIndex(state.note_tags.items())
+
+    # Update the index, and collect the old and new tags of each changed or deleted note.
+    touched_tags: list[str] = []
+    deleted_nids = [nid for nid in state.note_tags if nid not in current_mods]
+    for nid in deleted_nids:
+        old_tags = state.note_tags.pop(nid)
+        index.discard(nid, old_tags)
+        touched_tags.append(old_tags)
+        state.note_groups.pop(nid, None)
+    for nid, tags in changed_tags.items():
+        old_tags = state.note_tags.get(nid)
+        if old_tags is not None:
+            index.discard(nid, old_tags)
+            touched_tags.append(old_tags)
+        index.add(nid, tags)
+        touched_tags.append(tags)
+        state.note_tags[nid] = tags
+    state.note_mods = dict(current_mods)
+
+    # The IDs of new groups continue below the existing ones. They depend on the order in which the tags were
+    # first required, unlike in ``build_tag_group_graph``, but that does not change the order of the notes.
+    next_group_id = min(state.group_ids.values(), default=0) - 1
+    for nid, prereq_tags in extract_prerequisite_tags_bulk(changed_tags.items()).items():
+        groups = []
+        for tag in prereq_tags:
+            key = tag.lower()
+            if key not in state.group_ids:
+                state.group_ids[key] = next_group_id
+                next_group_id -= 1
+            groups.append(state.group_ids[key])
+        state.note_groups[nid] = list(dict.fromkeys(groups))
+
+    required_groups = {group_id for groups in state.note_groups.values() for group_id in groups}
+    for tag, group_id in list(state.group_ids.items()):
+        if group_id not in required_groups:
+            del state.group_ids[tag]
+            state.group_nids.pop(group_id, None)
+
+    # Find the groups whose tag matches any of the touched tags. The nid is irrelevant here.
+    touched_index = TagIndex((NoteId(0), tags) for tags in touched_tags)
+    resolved_tags = sorted(tag for tag, group_id in state.group_ids.items()
+                           if group_id not in state.group_nids or touched_index.find_notes(tag))
+    for tag in resolved_tags:
+        state.group_nids[state.group_ids[tag]] = index.find_notes(tag)
+    return resolved_tags
+
+
+def _changed_note_tags(col: Collection, changed_nids: list[NoteId], n_notes: int) -> dict[NoteId, str]:
+    """Fetch the tags of the changed notes."""
+    if len(changed_nids) > n_notes // 2:
+        # When most notes changed, such as on the first run, a single scan is faster.
+        changed = set(changed_nids)
+        return {nid: tags for nid, tags in note_tag_rows(col) if nid in changed}
+
+    changed_tags: dict[NoteId, str] = {}
+    for start in range(0, len(changed_nids), CHUNK_SIZE):
+        chunk = changed_nids[start:start + CHUNK_SIZE]
+        for nid, tags in col.db.all(f"select id, tags from notes where id in {ids2str(chunk)}"):
+            changed_tags[NoteId(nid)] = tags
+    return changed_tags
@@ -0,0 +1,107 @@
+"""
+Secondary orders of notes, i.e., the order in which notes are introduced where their prerequisites allow
+it, computed from the columns of a ``CollectionData`` instead of a key function per card.
+
+An order is a sequence of keys, where later keys break ties of earlier ones, and remaining ties are
+broken by nid. The keys are:
+
+- ``nid``: the creation time of the note, which is the default.
+- ``due``: the smallest current due position of the new cards of the note, so that the current order
+  is kept where the prerequisites allow it. Notes without new cards come last.
+- ``deck``: the name of the deck of the first card of the note, case-insensitively, with each deck
+  followed by its subdecks.
+- ``field``: the sort field of the note, case-insensitively, with numbers first, as in Anki's browser.
+- ``random`` or ``random:SEED``: a random order that only depends on the seed (by default 0).
+
+For example, ``["deck", "random"]`` introduces the notes deck by deck, in a random order within each deck.
+Any other order can be given as a key function of the nid instead.
+"""
+import random
+import sys
+from collections.abc import Callable, Sequence
+from typing import Any, Union
+
+from anki.consts import CARD_TYPE_NEW
+from anki.notes import NoteId
+
+from beyondki.profiling import profiled
+from beyondki.reader import CollectionData
+
+ORDER_KEYS = ("nid", "due", "deck", "field", "random")
+# The keys that need the columns that CollectionData.read only reads with order_columns=True.
+COLUMN_KEYS = ("deck", "field")
+
+NoteOrder = Union[str, Sequence[str], Callable[[NoteId], Any]]
+
+
+def parse_order(order: Union[str, Sequence[str]]) -> list[str]:
+    """Split an order into its keys, and check them."""
+    keys = order.split() if isinstance(order, str) else list(order)
+    for key in keys:
+        name, _, seed = key.partition(":")
+        if name not in ORDER_KEYS or (seed and (name != "random" or not seed.lstrip("-").isdigit())):
+            raise ValueError(f'Unknown order key {key!r}, expected one of {", ".join(ORDER_KEYS)} or random:SEED')
+    return keys
+
+
+def needs_order_columns(order: NoteOrder) -> bool:
+    """Check whether ``order`` needs a ``CollectionData`` that was read with ``order_columns=True``."""
+    return not callable(order) and any(key in COLUMN_KEYS for key in parse_order(order))
+
+
+@profiled
+def note_positions(data: CollectionData, order: NoteOrder) -> dict[NoteId, int]:
+    """
+    Map the nid of each note in ``data`` to its position in ``order``, from 0.
+
+    The notes are sorted once per key, by a column of sort keys that is computed in a single pass, which
+    avoids calling a Python function for every comparison. If ``order`` is a key function, it is called
+    once per note instead.
+    """
+    nids = data.nids
+    if callable(order):
+        return {nid: position for position, nid in enumerate(sorted(nids, key=order))}
+
+    # Sort by nid first, then stably by each key from the last to the first.
+    indices = sorted(range(len(nids)), key=nids.__getitem__)
+    by_nid = indices.copy()
+    for key in reversed(parse_order(order)):
+        column = _sort_column(data, key, by_nid)
+        indices.sort(key=column.__getitem__)
+    return dict(zip(map(nids.__getitem__, indices), range(len(indices))))
+
+
+def _sort_column(data: CollectionData, key: str, by_nid: list[int]) -> Sequence:
+    """Get the sort keys of the notes for one order key, parallel to ``data.nids``."""
+    name, _, seed = key.partition(":")
+    if name == "nid":
+        return data.nids
+    if name == "random":
+        shuffled = by_nid.copy()
+        random.Random(int(seed or 0)).shuffle(shuffled)
+        column = [0] * len(shuffled)
+        for position, i in enumerate(shuffled):
+            column[i] = position
+        return column
+
+    if name in COLUMN_KEYS and data.sort_fields is None:
+        raise ValueError(f'The {name!r} order needs a CollectionData that was read with order_columns=True')
+    if name == "field":
+        # SQLite stores sort fields that look like numbers as numbers, which Anki sorts before text.
+        return [(0, value, "") if isinstance(value, (int, float)) else (1, 0, value.lower())
+                for value in data.sort_fields]
+
+    if name == "due":
+        # When a dict is built from pairs, the last value of each key wins, so put the smallest due
+        # position of each note last.
+        card_nids, card_dues = data.card_nids, data.card_dues
+        new = [i for i, card_type in enumerate(data.card_types) if card_type == CARD_TYPE_NEW]
+        new.sort(key=card_dues.__getitem__, reverse=True)
+        note_dues = dict(zip(map(card_nids.__getitem__, new), map(card_dues.__getitem__, new)))
+        return [note_dues.get(nid, sys.maxsize) for nid in data.nids]
+
+    names = data.deck_names
+    deck_ranks = {did: rank for rank, did in enumerate(sorted(names, key=lambda did: names[did].lower()))}
+    # The cards are ordered by note, so in reverse, the first card of each note comes last and wins.
+    note_dids = dict(zip(reversed(data.card_nids), reversed(data.card_dids)))
+    return [deck_ranks.get(note_dids.get(nid), len(deck_ranks)) for nid in data.nids]
@@ -0,0 +1,546 @@
+"""Prerequisite sorting of all the cards in a collection."""
+import sys
+from collections.abc import Callable, Container, Iterable, Mapping, Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from anki.cards import CardId
+from anki.collection import Collection
+from anki.notes import NoteId
+
+from beyondki import cycles, profiling, sorting
+from beyondki.cache import CachedGraph, default_cache_path, load_graph, save_graph, tag_rows_digest
+from beyondki.cycles import find_loops
+from beyondki.ordering import NoteOrder, needs_order_columns, note_positions
+from beyondki.prerequisites import PREFIX, extract_prerequisite_tags_bulk
+from beyondki.profiling import Profiler, count_graph, profiled
+from beyondki.reader import CollectionData, open_read_only
+from beyondki.sorting import PrerequisiteLoopError
+from beyondki.tags import TagIndex
+from beyondki.writeback import apply_due_changes, compute_changes, reorder_new_cards
+
+# With a ``check_cancelled`` callback, sort this many cards between the calls.
+CANCEL_CHUNK_SIZE = 10000
+
+
+def cards_by_note(col: Collection) -> dict[NoteId, list[CardId]]:
+    """Fetch the cids of every note in a single query."""
+    cids_by_note: dict[NoteId, list[CardId]] = {}
+    for nid, cid in col.db.all("select nid, id from cards order by nid, ord"):
+        cids_by_note.setdefault(NoteId(nid), []).append(CardId(cid))
+    return cids_by_note
+
+
+def build_note_prereqs_graph(tag_rows: Iterable[tuple[NoteId, str]]) -> dict[NoteId, list[NoteId]]:
+    """
+    Map the nid of each note to the nids of its prerequisites, given the ``(nid, tags)`` rows of every
+    note.
+    """
+    tag_rows = list(tag_rows)
+    with profiling.stage("parse_tags"):
+        note_tag_prerequisites = extract_prerequisite_tags_bulk(tag_rows)
+    with profiling.stage("resolve_tags"):
+        note_prereqs_graph = TagIndex(tag_rows).resolve(note_tag_prerequisites)
+        count_graph(note_prereqs_graph)
+    return note_prereqs_graph
+
+
+def build_tag_group_graph(tag_rows: Iterable[tuple[NoteId, str]]) -> dict[int, list[int]]:
+    """
+    Like ``build_note_prereqs_graph``, but with a virtual node for each prerequisite tag, which requires
+    the notes that match the tag and is required by the notes that have it as a prerequisite.
+
+    A tag that matches N notes and is the prerequisite of M notes costs N + M edges instead of N * M. The
+    virtual nodes have negative IDs (see ``is_tag_group``), and they are numbered in the order in which the
+    tags are first required, but ``sort_note_graph`` sorts the notes in the same order as without them.
+    """
+    tag_rows = list(tag_rows)
+    with profiling.stage("parse_tags"):
+        note_tag_prerequisites = extract_prerequisite_tags_bulk(tag_rows)
+
+    with profiling.stage("resolve_tags"):
+        group_ids: dict[str, int] = {}
+        note_prereqs_graph: dict[int, list[int]] = {}
+        for nid, tags in note_tag_prerequisites.items():
+            note_prereqs_graph[nid] = list(dict.fromkeys(
+                group_ids.setdefault(tag.lower(), -1 - len(group_ids)) for tag in tags))
+
+        index = TagIndex(tag_rows)
+        groups = {group_id: index.find_notes(tag) for tag, group_id in group_ids.items()}
+        graph = {**groups, **note_prereqs_graph}
+        count_graph(graph)
+        profiling.count(tag_groups=len(groups))
+    return graph
+
+
+def load_or_build_tag_group_graph(tag_rows: Sequence[tuple[NoteId, str]],
+                                  cache_path: Optional[Union[str, Path]] = None,
+                                  save: bool = True) -> dict[int, list[int]]:
+    """
+    Load the graph of ``build_tag_group_graph`` from the cache file at ``cache_path`` (see ``cache``) if it
+    was built from the same ``tag_rows``. Otherwise, build it, and write it to the cache file unless
+    ``save`` is false, e.g., for a dry run. Without a ``cache_path``, just build it.
+
+    The cached graph is copied into a dict, so this only saves building the graph, not reading it.
+    """
+    if cache_path is None:
+        return build_tag_group_graph(tag_rows)
+    digest = tag_rows_digest(tag_rows)
+    with profiling.stage("load_cache"):
+        cached = load_graph(cache_path)
+        if cached is not None:
+            try:
+                if cached.digest == digest:
+                    return cached.to_mapping()
+            finally:
+                # The file must be unmapped before it is replaced, which fails on Windows otherwise.
+                cached.close()
+    graph = build_tag_group_graph(tag_rows)
+    if save:
+        with profiling.stage("save_cache"):
+            save_graph(cache_path, CachedGraph.from_mapping(digest, graph))
+    return graph
+
+
+def is_tag_group(key: int) -> bool:
+    """Check whether ``key`` is a virtual node from ``build_tag_group_graph`` rather than a note or card."""
+    return key < 0
+
+
+def expand_tag_groups(graph: Mapping[int, Iterable[int]],
+                      groups: Optional[Container[int]] = None) -> dict[int, list[int]]:
+    """
+    Replace the virtual nodes of a graph from ``build_tag_group_graph`` with direct edges between notes,
+    or only the virtual nodes in ``groups``, keeping the others.
+    """
+    if groups is None:
+        groups = {key for key in graph if is_tag_group(key)}
+    expanded_graph = {}
+    for key, prereqs in graph.items():
+        if key in groups:
+            continue
+        if any(prereq in groups for prereq in prereqs):
+            prereqs = sorted({prereq_nid for prereq in prereqs
+                              for prereq_nid in (graph[prereq] if prereq in groups else (prereq,))})
+        expanded_graph[key] = list(prereqs)
+    return expanded_graph
+
+
+@dataclass
+class NoteLoop:
+    """A loop of notes that are prerequisites of each other."""
+    nids: list[NoteId]
+    # The prerequisite tags of each note that match other notes in the loop.
+    tags: dict[NoteId, list[str]]
+
+    def __str__(self) -> str:
+        return "[" + ", ".join(f"{nid} ({' '.join(PREFIX + tag for tag in self.tags[nid])})"
+                               for nid in self.nids) + "]"
+
+
+@profiled
+def check_note_loops(note_prereqs_graph: dict[NoteId, list[NoteId]],
+                     tag_rows: Iterable[tuple[NoteId, str]],
+                     break_loops: bool = False,
+                     positions: Optional[Mapping[NoteId, int]] = None) -> dict[NoteId, list[NoteId]]:
+    """
+    Check the note graph, which may have tag groups, for prerequisite loops before it is expanded to cards.
+
+    If there are loops, raise a ``PrerequisiteLoopError`` that lists the notes in each loop, in ``loops``,
+    and the prerequisite tags that form it, in ``note_loops``. If ``break_loops`` is true, break the loops with
+    ``cycles.break_loops`` instead, where notes are ordered by nid, or by their ``positions`` as in
+    ``sort_note_graph``, and return the new graph. Only the tag groups in loops are expanded for that.
+    """
+    loops = find_loops(note_prereqs_graph)
+    profiling.count(loops=len(loops))
+    if not loops:
+        return note_prereqs_graph
+    if break_loops:
+        loop_groups = {key for loop in loops for key in loop if is_tag_group(key)}
+        if loop_groups:
+            # Break the loops between notes, rather than between notes and tags.
+            note_prereqs_graph = expand_tag_groups(note_prereqs_graph, loop_groups)
+            loops = find_loops(note_prereqs_graph)
+        position = {nid: nid if positions is None else positions[nid] for loop in loops for nid in loop}
+        return cycles.break_loops(note_prereqs_graph, loops, position)
+
+    # Every loop through a tag group also goes through the notes that require it.
+    position = {key: i for i, key in enumerate(note_prereqs_graph)}
+    loops = sorted(([nid for nid in loop if not is_tag_group(nid)] for loop in loops),
+                   key=lambda loop: position[loop[0]])
+    members = {nid for loop in loops for nid in loop}
+    member_tags = {nid: tags for nid, tags in tag_rows if nid in members}
+    note_loops = []
+    for loop in loops:
+        loop_rows = [(nid, member_tags[nid]) for nid in loop]
+        loop_index = TagIndex(loop_rows)
+        loop_tags = {nid: [tag for tag in prereq_tags if loop_index.find_notes(tag)]
+                     for nid, prereq_tags in extract_prerequisite_tags_bulk(loop_rows).items()}
+        note_loops.append(NoteLoop(loop, loop_tags))
+
+    shown = note_loops[:PrerequisiteLoopError.MAX_LOOPS_SHOWN]
+    message = f'Found {len(loops)} loop(s) of prerequisite notes: {", ".join(map(str, shown))}'
+    if len(loops) > len(shown):
+        message += ', ...'
+    raise PrerequisiteLoopError(message, loops, note_loops)
+
+
+@profiled
+def expand_to_cards(note_prereqs_graph: Mapping[NoteId, Iterable[NoteId]],
+                    cids_by_note: Mapping[NoteId, list[CardId]]) -> dict[CardId, list[CardId]]:
+    """
+    Expand a graph of note prerequisites to a graph of card prerequisites, where every card of a note
+    requires every card of each of the note's prerequisites.
+
+    The cards of a note share a single list of prerequisites. Tag groups from ``build_tag_group_graph``
+    are kept as single virtual cards with the same ID.
+    """
+    def prerequisite_cids(prereq: int):
+        return (prereq,) if is_tag_group(prereq) else cids_by_note.get(prereq, ())
+
+    card_prereqs_graph: dict[CardId, list[CardId]] = {}
+    for key, prereqs in note_prereqs_graph.items():
+        if is_tag_group(key):
+            card_prereqs_graph[CardId(key)] = [prereq_cid for prereq in prereqs
+                                               for prereq_cid in prerequisite_cids(prereq)]
+    for nid, cids in cids_by_note.items():
+        prereq_cids = [prereq_cid for prereq in note_prereqs_graph.get(nid, ())
+                       for prereq_cid in prerequisite_cids(prereq)]
+        for cid in cids:
+            card_prereqs_graph[cid] = prereq_cids
+    count_graph(card_prereqs_graph)
+    return card_prereqs_graph
+
+
+def sort_card_graph(card_prereqs_graph: Mapping[CardId, list[CardId]]) -> list[CardId]:
+    """Order the cards by cid where the prerequisites allow it. Tag groups only pass on their prerequisites."""
+    cids = [cid for cid in card_prereqs_graph.keys() if not is_tag_group(cid)]
+    groups = {key: prereqs for key, prereqs in card_prereqs_graph.items() if is_tag_group(key)}
+    return sorting.sort_with_groups(cids, card_prereqs_graph, cids, groups)
+
+
+@profiled
+def sort_note_graph(note_prereqs_graph: Mapping[NoteId, list[NoteId]],
+                    cids_by_note: Mapping[NoteId, list[CardId]],
+                    sibling_key: Optional[Callable[[CardId], Any]] = None,
+                    break_loops: bool = False,
+                    positions: Optional[Mapping[NoteId, int]] = None,
+                    reduce: bool = False) -> list[CardId]:
+    """
+    Order the notes by nid, or by their ``positions`` (e.g., from ``ordering.note_positions``), where the
+    prerequisites allow it, then expand each note to its cards. With ``reduce``, the graph is replaced
+    with ``reduce_note_graph`` first, which gives the same order.
+
+    This satisfies the same constraints as sorting the graph from ``expand_to_cards``, but the graph has
+    one edge per pair of notes instead of one per pair of cards. The cards of a note are kept together,
+    in the order of ``cids_by_note`` (i.e., by template) or sorted by ``sibling_key``. The graph may have
+    tag groups from ``build_tag_group_graph``, which do not change the order (see
+    ``sorting.sort_with_groups``). With ``break_loops``, loops are broken as in ``check_note_loops``.
+    """
+    if break_loops:
+        # The tags are only needed to report the loops.
+        note_prereqs_graph = check_note_loops(note_prereqs_graph, (), break_loops, positions)
+    if reduce:
+        note_prereqs_graph = reduce_note_graph(note_prereqs_graph, positions)
+    nids = [nid for nid in note_prereqs_graph.keys() if not is_tag_group(nid)]
+    groups = {key: prereqs for key, prereqs in note_prereqs_graph.items() if is_tag_group(key)}
+    ordered_nids = sorting.sort_with_groups(nids, note_prereqs_graph, nids if positions is None else positions,
+                                            groups)
+    return expand_note_order(ordered_nids, cids_by_note, sibling_key)
+
+
+def reduce_note_graph(note_prereqs_graph: Mapping[NoteId, list[NoteId]],
+                      positions: Optional[Mapping[NoteId, int]] = None) -> dict[NoteId, list[NoteId]]:
+    """
+    Expand the tag groups of a graph without loops, and remove the prerequisites that are implied by
+    others with ``sorting.transitive_reduction``. The notes of the result are in the secondary order (by
+    nid, or by ``positions``), and are sorted in the same order as those of the original graph.
+    """
+    graph = expand_tag_groups(note_prereqs_graph)
+    nids = sorted(graph, key=None if positions is None else positions.__getitem__)
+    reduced_graph, _, _ = sorting.transitive_reduction({nid: graph[nid] for nid in nids}, keep_order=True)
+    return reduced_graph
+
+
+def expand_note_order(ordered_nids: Iterable[NoteId],
+                      cids_by_note: Mapping[NoteId, list[CardId]],
+                      sibling_key: Optional[Callable[[CardId], Any]] = None) -> list[CardId]:
+    """Replace each note in ``ordered_nids`` with its cards, optionally sorted by ``sibling_key``."""
+    ordered_cids: list[CardId] = []
+    for nid in ordered_nids:
+        cids = cids_by_note.get(nid, ())
+        if sibling_key is not None:
+            cids = sorted(cids, key=sibling_key)
+        ordered_cids.extend(cids)
+    return ordered_cids
+
+
+@dataclass
+class CardStreamState:
+    """The progress of a ``CardStream``: that of the sort of its notes, and the cards not returned yet."""
+    notes: sorting.GroupSortStreamState
+    # The cards of the notes taken so far that have not been returned yet.
+    pending_cids: list[CardId]
+
+    def copy(self) -> "CardStreamState":
+        return CardStreamState(self.notes.copy(), list(self.pending_cids))
+
+    def to_json(self) -> dict:
+        return {"notes": self.notes.to_json(), "pending_cids": self.pending_cids}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "CardStreamState":
+        return cls(sorting.GroupSortStreamState.from_json(data["notes"]), list(data["pending_cids"]))
+
+
+class CardStream:
+    """
+    Sort the cards of a note graph in the same order as ``sort_note_graph``, but lazily: the notes are
+    sorted with a ``sorting.GroupSortStream``, and only expanded to their cards as they are taken. Use
+    ``stream_collection`` for the cards of a collection, e.g., for the next study session::
+
+        stream = stream_collection(col)
+        first_cards = stream.take(20)
+        state = stream.state()
+        # Later, with the same graph and cards:
+        next_cards = CardStream(graph, cids_by_note, state=state).take(20)
+
+    The graph may have tag groups, but no loops (see ``check_note_loops``).
+    """
+
+    def __init__(self,
+                 note_prereqs_graph: Mapping[NoteId, list[NoteId]],
+                 cids_by_note: Mapping[NoteId, list[CardId]],
+                 sibling_key: Optional[Callable[[CardId], Any]] = None,
+                 positions: Optional[Mapping[NoteId, int]] = None,
+                 state: Optional[CardStreamState] = None):
+        nids = [nid for nid in note_prereqs_graph.keys() if not is_tag_group(nid)]
+        groups = {key: prereqs for key, prereqs in note_prereqs_graph.items() if is_tag_group(key)}
+        self._notes = sorting.GroupSortStream(nids, note_prereqs_graph, nids if positions is None else positions,
+                                              groups, None if state is None else state.notes)
+        self._pending_cids = [] if state is None else list(state.pending_cids)
+        self.cids_by_note = cids_by_note
+        self.sibling_key = sibling_key
+
+    def state(self) -> CardStreamState:
+        """Get a copy of the current progress, to resume from with ``CardStream(..., state=state)``."""
+        return CardStreamState(self._notes.state(), list(self._pending_cids))
+
+    def __iter__(self) -> "CardStream":
+        return self
+
+    def __next__(self) -> CardId:
+        cids = self.take(1)
+        if not cids:
+            raise StopIteration
+        return cids[0]
+
+    def take(self, n: int) -> list[CardId]:
+        """Get the next ``n`` cards in order, or fewer if there are no more."""
+        cids = self._pending_cids[:n]
+        del self._pending_cids[:n]
+        while len(cids) < n:
+            # Most notes have at least one card, so this rarely takes more notes than needed.
+            nids = self._notes.take(n - len(cids))
+            if not nids:
+                break
+            expanded_cids = expand_note_order(nids, self.cids_by_note, self.sibling_key)
+            n_missing = n - len(cids)
+            cids += expanded_cids[:n_missing]
+            self._pending_cids = expanded_cids[n_missing:]
+        return cids
+
+    def rest(self) -> list[CardId]:
+        """Get all the remaining cards in order."""
+        return self.take(sys.maxsize)
+
+
+def sort_collection(col: Collection,
+                    break_loops: bool = False,
+                    sibling_key: Optional[Callable[[CardId], Any]] = None,
+                    search: Optional[str] = None,
+                    order: Optional[NoteOrder] = None,
+                    cache: bool = False,
+                    reduce: bool = False) -> list[CardId]:
+    """
+    Sort all the cards in ``col``, or the cards matching the Anki ``search``, with ``sort_note_graph``,
+    using a tag group for each prerequisite tag. See ``check_note_loops`` for how prerequisite loops are
+    handled, and ``ordering`` for the secondary ``order`` (by default, by nid).
+
+    With a ``search``, only the notes with at least one matching card are read, and only their matching
+    cards. So prerequisites outside of the search are treated as already satisfied. Otherwise, if
+    ``cache`` is true, the graph is kept in a cache file next to the collection, and only rebuilt when
+    the tags of the notes change (see ``load_or_build_tag_group_graph``). With ``reduce``, the graph is
+    replaced with ``reduce_note_graph``, which gives the same order.
+    """
+    data = CollectionData.read(col.db, None if search is None else col.find_cards(search),
+                               order is not None and needs_order_columns(order))
+    cache_path = default_cache_path(col.path) if cache and search is None else None
+    return sort_collection_data(data, break_loops, sibling_key, order, cache_path, reduce=reduce)
+
+
+def sort_collection_data(data: CollectionData,
+                         break_loops: bool = False,
+                         sibling_key: Optional[Callable[[CardId], Any]] = None,
+                         order: Optional[NoteOrder] = None,
+                         cache_path: Optional[Union[str, Path]] = None,
+                         check_cancelled: Optional[Callable[[], None]] = None,
+                         save_cache: bool = True,
+                         reduce: bool = False) -> list[CardId]:
+    """
+    Sort the notes and cards that were read into ``data``, like ``sort_collection``. This does not use
+    the collection, so it can run in another thread or process. The graph is built and sorted in the
+    profiling stages "graph" and "sort". See ``load_or_build_tag_group_graph`` for ``save_cache``.
+
+    ``check_cancelled`` is called before and after the graph is built, and after every
+    ``CANCEL_CHUNK_SIZE`` sorted cards. It can raise an exception to stop the sort.
+    """
+    if check_cancelled is not None:
+        check_cancelled()
+    stream = stream_collection_data(data, break_loops, sibling_key, order, cache_path, save_cache, reduce)
+    with profiling.stage("sort"):
+        if check_cancelled is None:
+            return stream.rest()
+
+        check_cancelled()
+        ordered_cids: list[CardId] = []
+        while True:
+            cids = stream.take(CANCEL_CHUNK_SIZE)
+            if not cids:
+                return ordered_cids
+            ordered_cids += cids
+            check_cancelled()
+
+
+def stream_collection(col: Collection,
+                      break_loops: bool = False,
+                      sibling_key: Optional[Callable[[CardId], Any]] = None,
+                      search: Optional[str] = None,
+                      order: Optional[NoteOrder] = None,
+                      cache: bool = False,
+                      reduce: bool = False) -> CardStream:
+    """
+    Like ``sort_collection``, but return a ``CardStream`` that sorts the cards lazily. The graph is
+    built and checked for loops up front.
+    """
+    data = CollectionData.read(col.db, None if search is None else col.find_cards(search),
+                               order is not None and needs_order_columns(order))
+    cache_path = default_cache_path(col.path) if cache and search is None else None
+    return stream_collection_data(data, break_loops, sibling_key, order, cache_path, reduce=reduce)
+
+
+def stream_collection_data(data: CollectionData,
+                           break_loops: bool = False,
+                           sibling_key: Optional[Callable[[CardId], Any]] = None,
+                           order: Optional[NoteOrder] = None,
+                           cache_path: Optional[Union[str, Path]] = None,
+                           save_cache: bool = True,
+                           reduce: bool = False) -> CardStream:
+    """Like ``sort_collection_data``, but return a ``CardStream`` that sorts the cards lazily."""
+    with profiling.stage("graph"):
+        tag_rows = data.tag_rows()
+        positions = None if order is None else note_positions(data, order)
+        graph = load_or_build_tag_group_graph(tag_rows, cache_path, save_cache)
+        note_prereqs_graph = check_note_loops(graph, tag_rows, break_loops, positions)
+        if reduce:
+            note_prereqs_graph = reduce_note_graph(note_prereqs_graph, positions)
+        return CardStream(note_prereqs_graph, data.cards_by_note(), sibling_key, positions)
+
+
+def reorder_collection(col: Collection,
+                       break_loops: bool = False,
+                       sibling_key: Optional[Callable[[CardId], Any]] = None,
+                       search: Optional[str] = None,
+                       minimal: bool = False,
+                       order: Optional[NoteOrder] = None) -> int:
+    """
+    Sort the cards in ``col`` and reposition the new cards accordingly. If ``search`` is given, only the
+    matching cards are sorted, and they are reordered among the due positions they already have. If
+    ``minimal`` is true and there is no ``search``, as few cards as possible are moved (see
+    ``writeback.compute_minimal_changes``).
+    ``order`` is the secondary order, see ``ordering``.
+
+    @return: the number of cards that were repositioned.
+    """
+    ordered_cids = sort_collection(col, break_loops, sibling_key, search, order)
+    return reorder_new_cards(col, ordered_cids, keep_slots=search is not None, minimal=minimal)
+
+
+@dataclass
+class ReorderResult:
+    """The new order of the cards of a collection, and how long each stage took."""
+    path: str
+    ordered_cids: list[CardId]
+    n_repositioned: int
+    dry_run: bool
+    # Seconds per stage, in the order the stages ran.
+    timings: dict[str, float] = field(default_factory=dict)
+
+    def to_json(self) -> dict:
+        return {"collection": self.path,
+                "dry_run": self.dry_run,
+                "n_cards": len(self.ordered_cids),
+                "n_repositioned": self.n_repositioned,
+                "timings": self.timings,
+                "order": self.ordered_cids}
+
+
+def reorder_file(path: Union[str, Path],
+                 search: Optional[str] = None,
+                 break_loops: bool = False,
+                 dry_run: bool = False,
+                 profiler: Optional[Profiler] = None,
+                 minimal: bool = False,
+                 spacing: int = 1,
+                 order: Optional[Sequence[str]] = None,
+                 cache: bool = False) -> ReorderResult:
+    """
+    Open the collection at ``path``, sort all of its cards, and reposition the new cards.
+
+    The notes and cards are read in bulk with ``CollectionData``. If ``search`` is given, only the cards
+    that match it are read and sorted, as in ``sort_collection``, and the new ones are repositioned
+    among the due positions that they already have. Otherwise, with ``minimal``, as few cards as possible
+    are moved, see ``writeback.compute_minimal_changes``. ``spacing`` is the distance between the due
+    positions of consecutive cards that are renumbered. ``order`` is the secondary order, as a sequence
+    of keys from ``ordering`` (by default, by nid). With ``cache``, the graph is kept in a cache file, as
+    in ``sort_collection``. With ``dry_run``, the changes are computed but not written, and neither is the
+    cache file, although an up-to-date one is used.
+
+    The stages are measured with ``profiler``, which must not be active yet, or with a new ``Profiler``.
+    The result only includes the timings of the top-level stages.
+    """
+    path = Path(path)
+    if not path.is_file():
+        # Opening a missing collection would create an empty one.
+        raise FileNotFoundError(f"No collection at {path}")
+
+    if profiler is None:
+        profiler = Profiler()
+    with profiler:
+        with profiler.stage("open"):
+            # Searches need Anki's backend, but a dry run of the whole collection can read the file directly.
+            col = None if dry_run and search is None else Collection(str(path))
+            db = open_read_only(path) if col is None else col.db
+        try:
+            with profiler.stage("read"):
+                data = CollectionData.read(db, None if search is None else col.find_cards(search),
+                                           order is not None and needs_order_columns(order))
+            cache_path = default_cache_path(path) if cache and search is None else None
+            # In the stages "graph" and "sort".
+            ordered_cids = sort_collection_data(data, break_loops, order=order, cache_path=cache_path,
+                                                save_cache=not dry_run)
+            with profiler.stage("diff"):
+                changes = compute_changes(ordered_cids, data.new_card_dues(), search is not None, minimal, spacing)
+            if not dry_run:
+                with profiler.stage("write"):
+                    apply_due_changes(col, changes)
+        finally:
+            with profiler.stage("close"):
+                if col is None:
+                    db.close()
+                else:
+                    col.close(save=not dry_run)
+
+    timings = {stats.name: stats.seconds for stats in profiler.stages.values() if stats.depth == 0}
+    return ReorderResult(str(path), ordered_cids, len(changes), dry_run, timings)
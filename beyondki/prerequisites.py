@@ -1,9 +1,12 @@
 """Functions for parsing Anki note prerequisites from tags."""
-from typing import Optional, Iterable
+from collections.abc import Hashable
+from typing import Optional, Iterable, TypeVar
 
 PREFIX = "pre:"
 DELIM = " "
 
+Key = TypeVar("Key", bound=Hashable)
+
 
 def parse_prerequisite_tag(tag: str) -> Optional[str]:
     """
@@ -27,3 +30,38 @@ def extract_prerequisite_tags(s: str) -> list[str]:
 
     # Filter out the ``None`` values, i.e. non-prereq tags.
     return list(filter(lambda t: t is not None, tags))
+
+
+def extract_prerequisite_tags_bulk(rows: Iterable[tuple[Key, str]],
+                                   prefix: Optional[str] = None,
+                                   delim: Optional[str] = None) -> dict[Key, list[str]]:
+    """
+    Parse the prerequisite tags of many notes in a single pass.
+
+    ``rows`` are ``(key, tags)`` pairs, e.g., the ``(id, tags)`` rows of the notes table. Each key is
+    mapped to the same list that ``extract_prerequisite_tags`` returns for its tags. Prerequisites that
+    occur in many rows share a single string object.
+
+    ``prefix`` and ``delim`` default to ``PREFIX`` and ``DELIM``.
+    """
+    if prefix is None:
+        prefix = PREFIX
+    if delim is None:
+        delim = DELIM
+    prefix_length = len(prefix)
+
+    interned: dict[str, str] = {}
+    prerequisites: dict[Key, list[str]] = {}
+    for key, s in rows:
+        # Most notes have no prerequisites, so avoid splitting their tags.
+        if prefix not in s:
+            prerequisites[key] = []
+            continue
+
+        prereq_tags = []
+        for tag in s.strip().split(delim):
+            if tag.startswith(prefix):
+                prereq_tag = tag[prefix_length:]
+                prereq_tags.append(interned.setdefault(prereq_tag, prereq_tag))
+        prerequisites[key] = prereq_tags
+    return prerequisites
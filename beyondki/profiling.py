@@ -0,0 +1,187 @@
+"""
+Opt-in instrumentation of the stages of sorting.
+
+The library marks whole functions as stages with ``profiled``, and steps within them with ``stage``,
+and reports the sizes of what they process with ``count``. These do nothing unless a ``Profiler`` is
+active, e.g.::
+
+    with Profiler(memory=True) as profiler:
+        reorder_collection(col)
+    print(profiler.summary())
+"""
+import functools
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator, Mapping, Sequence, Sized
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable)
+
+
+@dataclass
+class StageRecord:
+    """A single run of a stage, as passed to the callbacks of a ``Profiler``."""
+    name: str
+    # The number of enclosing stages.
+    depth: int
+    seconds: float
+    counts: dict[str, int] = field(default_factory=dict)
+    # The peak of the traced memory during the stage, above the memory in use when it started.
+    peak_bytes: Optional[int] = None
+
+
+@dataclass
+class StageStats:
+    """The totals of all the runs of a stage."""
+    name: str
+    depth: int
+    calls: int = 0
+    seconds: float = 0.0
+    counts: dict[str, int] = field(default_factory=dict)
+    peak_bytes: Optional[int] = None
+
+    def add(self, record: StageRecord) -> None:
+        self.calls += 1
+        self.seconds += record.seconds
+        for key, value in record.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+        if record.peak_bytes is not None:
+            self.peak_bytes = max(self.peak_bytes or 0, record.peak_bytes)
+
+
+class Profiler:
+    """
+    Records the wall time, number of calls, counts and, optionally, peak memory of each stage that runs
+    while it is active.
+
+    ``callbacks`` are called with a ``StageRecord`` whenever a stage finishes, e.g., to log it or to
+    send it to a monitoring system. Measuring memory uses ``tracemalloc``, which slows everything down.
+    """
+
+    def __init__(self, memory: bool = False, callbacks: Sequence[Callable[[StageRecord], None]] = ()):
+        self.memory = memory
+        self.callbacks = list(callbacks)
+        # Stages in the order they were first started.
+        self.stages: dict[str, StageStats] = {}
+        self._stack: list[StageRecord] = []
+        # The absolute peak of traced memory in each running stage, parallel to _stack.
+        self._peaks: list[int] = []
+        self._started_tracing = False
+        self._token = None
+
+    def __enter__(self) -> "Profiler":
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._token = _active.set(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _active.reset(self._token)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        """Measure a stage. Use the module-level ``stage`` in library code instead."""
+        record = StageRecord(name, len(self._stack), 0.0)
+        stats = self.stages.setdefault(name, StageStats(name, record.depth))
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+        self._stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            self._stack.pop()
+            if memory:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                record.peak_bytes = peak - current
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            stats.add(record)
+            for callback in self.callbacks:
+                callback(record)
+
+    def count(self, **counts: int) -> None:
+        """Add to the counts of the innermost running stage."""
+        if self._stack:
+            record_counts = self._stack[-1].counts
+            for key, value in counts.items():
+                record_counts[key] = record_counts.get(key, 0) + value
+
+    def to_json(self) -> list[dict]:
+        """Get the totals of each stage in a form that can be saved as JSON."""
+        return [{"stage": stats.name, "depth": stats.depth, "calls": stats.calls, "seconds": stats.seconds,
+                 "counts": stats.counts, "peak_bytes": stats.peak_bytes}
+                for stats in self.stages.values()]
+
+    def summary(self) -> str:
+        """Format the totals of each stage as a table, with nested stages indented."""
+        lines = [f"{'stage':<40}{'calls':>6}{'seconds':>10}{'peak MiB':>10}  counts"]
+        for stats in self.stages.values():
+            name = "  " * stats.depth + stats.name
+            peak = "" if stats.peak_bytes is None else f"{stats.peak_bytes / 2 ** 20:.1f}"
+            counts = ", ".join(f"{key}={value}" for key, value in stats.counts.items())
+            lines.append(f"{name:<40}{stats.calls:>6}{stats.seconds:>10.4f}{peak:>10}  {counts}")
+        return "\n".join(lines)
+
+
+_active: ContextVar[Optional[Profiler]] = ContextVar("beyondki_profiler", default=None)
+
+
+def active_profiler() -> Optional[Profiler]:
+    """Get the profiler that is active in the current context, if any."""
+    return _active.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Mark a stage for the active profiler, if there is one."""
+    profiler = _active.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def profiled(function: F) -> F:
+    """Decorate a function to mark each call as a stage, named after the function."""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = _active.get()
+        if profiler is None:
+            return function(*args, **kwargs)
+        with profiler.stage(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def count(**counts: int) -> None:
+    """Add to the counts of the current stage of the active profiler, if there is one."""
+    profiler = _active.get()
+    if profiler is not None:
+        profiler.count(**counts)
+
+
+def count_graph(graph: Mapping[Any, Sized]) -> None:
+    """
+    Count the nodes and edges of a graph that maps each node to its neighbors, but only if a profiler is
+    active, because counting the edges takes linear time.
+    """
+    profiler = _active.get()
+    if profiler is not None:
+        profiler.count(nodes=len(graph), edges=sum(map(len, graph.values())))
@@ -0,0 +1,109 @@
+"""Bulk reads of the notes and cards tables of a collection, directly with SQL."""
+import sqlite3
+from array import array
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from anki.cards import CardId
+from anki.consts import CARD_TYPE_NEW
+from anki.dbproxy import DBProxy
+from anki.notes import NoteId
+from anki.utils import ids2str
+
+from beyondki.graph import INT64
+from beyondki.profiling import count, profiled
+
+# Either ``col.db`` of an open collection, or a plain connection to a collection file.
+Database = Union[DBProxy, sqlite3.Connection]
+
+
+def open_read_only(path: Union[str, Path]) -> sqlite3.Connection:
+    """
+    Open a collection file for reading with ``sqlite3``, without starting Anki's backend.
+
+    This is much faster than opening a ``Collection``, but the file should not be open in Anki at the
+    same time, because it might be in the middle of writing to it.
+    """
+    return sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+
+
+@dataclass
+class CollectionData:
+    """
+    The columns of the notes and cards tables that are needed for sorting, as parallel arrays.
+
+    ``tags`` is parallel to ``nids``. The cards are ordered by note, then by template, and the other
+    card arrays are parallel to ``cids``.
+
+    The columns that are only needed by some orders of ``ordering`` are ``None`` unless they are read:
+    ``sort_fields`` (parallel to ``nids``; numbers are stored as numbers), ``card_dids``, and the names
+    of all decks, by did, with ``\x1f`` between the levels of a deck name.
+    """
+    nids: array
+    tags: list[str]
+    cids: array
+    card_nids: array
+    card_types: array
+    card_dues: array
+    sort_fields: Optional[list[Any]] = None
+    card_dids: Optional[array] = None
+    deck_names: Optional[dict[int, str]] = None
+
+    @classmethod
+    @profiled
+    def read(cls,
+             db: Database,
+             cids: Optional[Iterable[CardId]] = None,
+             order_columns: bool = False) -> "CollectionData":
+        """
+        Read every note and card from ``db`` with two queries. If ``cids`` is given, only read those cards
+        and the notes they belong to. If ``order_columns`` is true, also read the sort fields, decks and
+        deck names.
+        """
+        query = f"select id, nid, type, due{', did' if order_columns else ''} from cards"
+        if cids is not None:
+            query += f" where id in {ids2str(cids)}"
+        card_columns = [array(INT64, column)
+                        for column in _columns(_rows(db, query + " order by nid, ord"), 5 if order_columns else 4)]
+        card_cids, card_nids, card_types, card_dues = card_columns[:4]
+
+        query = f"select id, tags{', sfld' if order_columns else ''} from notes"
+        if cids is not None:
+            query += f" where id in {ids2str(dict.fromkeys(card_nids))}"
+        note_columns = _columns(_rows(db, query), 3 if order_columns else 2)
+        count(notes=len(note_columns[0]), cards=len(card_cids))
+        data = cls(array(INT64, note_columns[0]), list(note_columns[1]), card_cids, card_nids, card_types, card_dues)
+        if order_columns:
+            data.sort_fields = list(note_columns[2])
+            data.card_dids = card_columns[4]
+            data.deck_names = dict(_rows(db, "select id, name from decks"))
+        return data
+
+    def tag_rows(self) -> list[tuple[NoteId, str]]:
+        """Get the ``(nid, tags)`` rows of the notes, as returned by ``tags.note_tag_rows``."""
+        return list(zip(self.nids, self.tags))
+
+    def cards_by_note(self) -> dict[NoteId, list[CardId]]:
+        """Map the nid of each note to its cids, as returned by ``pipeline.cards_by_note``."""
+        cids_by_note: dict[NoteId, list[CardId]] = {}
+        for nid, cid in zip(self.card_nids, self.cids):
+            cids_by_note.setdefault(nid, []).append(cid)
+        return cids_by_note
+
+    def new_card_dues(self) -> dict[CardId, int]:
+        """Map the cid of each new card to its due position, as returned by ``writeback.new_card_dues``."""
+        return {cid: due for cid, card_type, due in zip(self.cids, self.card_types, self.card_dues)
+                if card_type == CARD_TYPE_NEW}
+
+
+def _rows(db: Database, query: str) -> list:
+    if isinstance(db, sqlite3.Connection):
+        return db.execute(query).fetchall()
+    return db.all(query)
+
+
+def _columns(rows: list, n_columns: int) -> list:
+    """Transpose ``rows`` into ``n_columns`` columns, which are empty if there are no rows."""
+    return list(zip(*rows)) if rows else [()] * n_columns
@@ -1,18 +1,32 @@
-from collections.abc import Callable, Sequence
-from typing import Union
+from array import array
+from bisect import bisect_right
+from collections.abc import Callable, Iterable, Mapping, MutableSequence, Sequence
+from dataclasses import dataclass
+from heapq import heappop, heappush, heapreplace
+from typing import Optional, Union
 
 from anki.cards import CardId
 from beartype import beartype
 
+from beyondki import cycles, profiling
+from beyondki.cycles import find_loops, strongly_connected_components
+from beyondki.graph import INT64, CompactCardGraph
+from beyondki.profiling import profiled
+
 # Define types.
 # TODO: Move type definitions.
+Cid = CardId
 CardGraph = dict[CardId, Union[list[CardId], None]]
+PrerequisiteData = Union[Mapping[CardId, Sequence[CardId]], Sequence[Sequence[CardId]]]
+PositionData = Union[Mapping[CardId, int], Sequence[int]]
 
 
 # @beartype
 def sort(cids: Sequence[CardId],
-         prereq_provider: Callable[CardId, list[CardId]],
-         cid_order_provider: Callable[CardId, int]) -> list[CardId]:
+         prereq_provider: Callable[[CardId], list[CardId]],
+         cid_order_provider: Callable[[CardId], int],
+         break_loops: bool = False,
+         reduce: bool = False) -> list[CardId]:
     """
     Sort a list of Cid's using a combination of topological sorting and a secondary sorting criteria.
     The topological sort takes priority and is conducted based on the graph generated by prereq_provider.
@@ -20,13 +34,39 @@ def sort(cids: Sequence[CardId],
     @param cids: list of Cid's
     @param prereq_provider: a function that takes a Cid and returns a list of its prerequisites (as Cid's).
     @param cid_order_provider: a function that provides a secondary order criteria for the Cid's.
+    @param break_loops: whether to break prerequisite loops instead of raising a PrerequisiteLoopError.
+    @param reduce: whether to sort the ``transitive_reduction`` of the graph, which gives the same order.
     @return: a sorted list of Cid's.
     """
     requirement_graph, dependents_graph = generate_card_graphs(cids, prereq_provider, cid_order_provider)
-    return sort_graphs(requirement_graph, dependents_graph)
+    if reduce:
+        requirement_graph, dependents_graph = _reduce_graphs(requirement_graph, break_loops)
+    return sort_graphs(requirement_graph, dependents_graph, break_loops)
+
+
+def sort_from_mappings(cids: Sequence[CardId],
+                       prerequisites: PrerequisiteData,
+                       positions: PositionData,
+                       break_loops: bool = False,
+                       reduce: bool = False) -> list[CardId]:
+    """
+    Sort a list of Cid's like ``sort``, but with the prerequisites and the secondary sorting criteria
+    given in bulk instead of by callbacks.
+    @param cids: list of Cid's
+    @param prerequisites: the prerequisites of each Cid. See ``generate_card_graphs_from_mappings``.
+    @param positions: the secondary order criteria for the Cid's. See ``generate_card_graphs_from_mappings``.
+    @param break_loops: whether to break prerequisite loops instead of raising a PrerequisiteLoopError.
+    @param reduce: whether to sort the ``transitive_reduction`` of the graph, which gives the same order.
+    @return: a sorted list of Cid's.
+    """
+    requirement_graph, dependents_graph = generate_card_graphs_from_mappings(cids, prerequisites, positions)
+    if reduce:
+        requirement_graph, dependents_graph = _reduce_graphs(requirement_graph, break_loops)
+    return sort_graphs(requirement_graph, dependents_graph, break_loops)
 
 
 # @beartype
+@profiled
 def generate_card_graphs(cids: list[CardId],
                          prereq_provider: Callable[[CardId], list[CardId]],
                          new_card_position_provider: Callable[[CardId], int]):
@@ -45,84 +85,792 @@ def generate_card_graphs(cids: list[CardId],
                         2: [1, 4],  # cid=2 is a prerequisite of 1
                         3: [1, 2],  # cid=3 is a prerequisite of 1 and 2
                         4: []}      # cid=2 is not a prerequisite of any cards
+
+    This is a thin adapter around ``generate_card_graphs_from_mappings``, which should be preferred when
+    the prerequisites and positions of all cards are already available.
     """
     if not isinstance(cids, Sequence):
         raise ValueError(f'cids was a {type(cids)} instead of a Sequence')
 
-    # Sort the cid's based on values given by the new_card_position_provider function.
-    sorted_cids = sorted(cids, key=new_card_position_provider)
+    return generate_card_graphs_from_mappings(cids,
+                                              [prereq_provider(cid) for cid in cids],
+                                              [new_card_position_provider(cid) for cid in cids])
 
-    # Create a dictionary containing entries in the form {cid: [list of prerequisite cids]}
-    requirement_graph: CardGraph = {cid: prereq_provider(cid) for cid in sorted_cids}
 
-    # Initialize self.dependents_graph to a dictionary containing each cid as a key and an empty list
-    # for each value...
-    dependents_graph = {cid: [] for cid in requirement_graph.keys()}
-    # ...then, for each key 'required_cid' populate the corresponding list with the cid's that have 'required_cid'
-    # as a prerequisite.
-    for cid, required_cids in requirement_graph.items():
-        if type(required_cids) is not list:
-            raise ValueError(f'prereq_provider return a {type(required_cids)} instead of a list')
+@profiled
+def generate_card_graphs_from_mappings(cids: Sequence[CardId],
+                                       prerequisites: PrerequisiteData,
+                                       positions: PositionData):
+    """
+    Generate the requirement and dependents graphs (see ``generate_card_graphs``) in a single pass over
+    the edges.
+
+    cids: a sequence of card ids
+    prerequisites: either a mapping from cids to sequences of their prerequisites (cids that are missing
+                   from the mapping have no prerequisites), or a sequence of prerequisite sequences that
+                   is parallel to cids.
+    positions: either a mapping from cids to numbers, defining the order that cids are introduced, or a
+               sequence of numbers that is parallel to cids.
+    """
+    if not isinstance(cids, Sequence):
+        raise ValueError(f'cids was a {type(cids)} instead of a Sequence')
+
+    if isinstance(prerequisites, Mapping):
+        prerequisites = [prerequisites.get(cid, ()) for cid in cids]
+    if isinstance(positions, Mapping):
+        positions = [positions[cid] for cid in cids]
+    if not len(prerequisites) == len(cids) == len(positions):
+        raise ValueError(f'prerequisites and positions must have one entry for each of the {len(cids)} cids')
+
+    # Sort the indices of cids by position. Python's sort is stable, so cids with equal positions stay in
+    # their given order.
+    sorted_indices = sorted(range(len(cids)), key=positions.__getitem__)
+
+    # Create dictionaries containing entries in the form {cid: [list of prerequisite cids]} and
+    # {cid: [list of dependent cids]}. The dependents_graph is initialized with every key first, so
+    # that both dictionaries are ordered by position and missing prerequisites can be detected.
+    requirement_graph: CardGraph = {}
+    dependents_graph: CardGraph = {cids[index]: [] for index in sorted_indices}
+    for index in sorted_indices:
+        cid = cids[index]
+        if cid in requirement_graph:
+            continue  # Duplicate cid.
+
+        required_cids = prerequisites[index]
+        if not isinstance(required_cids, Sequence):
+            raise ValueError(f'The prerequisites of CID={cid} were a {type(required_cids)} instead of a '
+                             f'Sequence')
+        requirement_graph[cid] = list(required_cids)
 
         for required_cid in required_cids:
             try:
                 dependents_graph[required_cid].append(cid)
-            except KeyError as e:
+            except KeyError:
                 raise ValueError(f'The CID={required_cid} was listed as a prerequisite of CID={cid} but was not '
-                                 f'included in the list of cids.')
-
-    # Check that the set of keys in the graph dicts are equal to set of values in cids.
-    # (i.e., no cids are missing and there are no extra cids.)
-    assert (set(requirement_graph.keys()) == set(sorted_cids))
-    assert (set(dependents_graph.keys()) == set(sorted_cids))
+                                 f'included in the list of cids.') from None
 
+    profiling.count_graph(requirement_graph)
     return requirement_graph, dependents_graph
 
 
-def sort_graphs(requirement_graph: CardGraph, dependents_graph: CardGraph) -> list[CardId]:
-    card_queue: list[CardId] = []
+@profiled
+def sort_graphs(requirement_graph: CardGraph,
+                dependents_graph: CardGraph,
+                break_loops: bool = False) -> list[CardId]:
+    """
+    Topologically sort the graphs generated by ``generate_card_graphs``.
+
+    The keys of ``requirement_graph`` are visited in their insertion order (i.e., the secondary order).
+    Each card is added to the queue at its own position if all of its prerequisites are already in the
+    queue. Otherwise, it is added as soon as its last prerequisite is added, which pulls it forward ahead
+    of the cards that come after that prerequisite in the secondary order.
+
+    The sort runs in O(V + E) time and does not recurse, so it works for arbitrarily long chains of
+    prerequisites. Neither graph is modified.
 
-    # Create a list of the cid keys in requirement_graph so that
-    # we can reference the indices.
+    If the prerequisites contain loops, a ``PrerequisiteLoopError`` listing only the loops is raised. If
+    ``break_loops`` is true, the loops are broken with ``cycles.break_loops`` before sorting instead.
+    """
+    profiling.count_graph(requirement_graph)
+    if break_loops:
+        loops = find_loops(requirement_graph)
+        if loops:
+            requirement_graph = cycles.break_loops(requirement_graph, loops)
+            dependents_graph = _dependents_graph(requirement_graph)
+
+    # Create a list of the cid keys in requirement_graph so that we can reference them by position.
+    # On Python 3.7+, dictionaries preserve their insertion order.
     requirement_keys = list(requirement_graph.keys())
+    position = {cid: index for index, cid in enumerate(requirement_keys)}
+
+    # For each position, the number of prerequisites that are not yet in the card_queue, and the
+    # positions of the cards that depend on it.
+    unmet_counts = [len(requirement_graph[cid]) for cid in requirement_keys]
+    dependents = [[position[dependent_cid] for dependent_cid in dependents_graph[cid]]
+                  for cid in requirement_keys]
+
+    card_queue = [requirement_keys[index] for index in _sort_positions(unmet_counts, dependents)]
+
+    if not len(card_queue) == len(requirement_graph):
+        queued = set(card_queue)
+        unqueued_graph = {cid: [required_cid for required_cid in requirement_graph[cid]
+                                if required_cid not in queued]
+                          for cid in requirement_keys if cid not in queued}
+        raise PrerequisiteLoopError.from_loops(find_loops(unqueued_graph), len(unqueued_graph))
+
+    return card_queue
+
+
+@profiled
+def sort_compact_graph(graph: CompactCardGraph, break_loops: bool = False) -> list[CardId]:
+    """
+    Topologically sort a ``CompactCardGraph`` of prerequisites, in the same way as ``sort_graphs``.
+    """
+    profiling.count(nodes=len(graph), edges=graph.n_edges)
+    if break_loops:
+        graph = _break_compact_loops(graph)
+
+    positions = _sort_positions(graph.degrees(), graph.transpose())
+    _check_all_sorted(graph, positions)
+    cids = graph.cids
+    return [cids[index] for index in positions]
+
+
+@profiled
+def sort_with_groups(cids: Sequence[CardId],
+                     prerequisites: Mapping[CardId, Sequence[int]],
+                     positions: PositionData,
+                     groups: Mapping[int, Sequence[CardId]]) -> list[CardId]:
+    """
+    Sort a list of Cid's like ``sort_from_mappings``, where a prerequisite can also be a group of Cid's,
+    such as the tag groups of ``pipeline.build_tag_group_graph``.
+
+    The order is exactly the same as if every group in ``prerequisites`` were replaced by its members,
+    but a group with N members and M dependents only costs N + M edges instead of N * M. Groups are not
+    sorted themselves, so they have no positions.
+    @param cids: list of Cid's
+    @param prerequisites: the prerequisites of each Cid, as Cid's or keys of ``groups``. Cid's that are
+                          missing from the mapping have no prerequisites.
+    @param positions: the secondary order criteria for the Cid's. See ``generate_card_graphs_from_mappings``.
+    @param groups: the Cid's in each group.
+    @return: a sorted list of Cid's.
+    """
+    if not groups:
+        return sort_from_mappings(cids, prerequisites, positions)
+    stream = GroupSortStream(cids, prerequisites, positions, groups)
+    profiling.count(nodes=len(stream.keys), groups=len(groups))
+    card_queue = stream.take(len(stream.keys))
+    if not len(card_queue) == len(stream.keys):
+        stream.check_all_sorted()
+    return card_queue
+
+
+@dataclass
+class SortStreamState:
+    """
+    The progress of a ``SortStream``, from which it can be resumed, e.g., in a later session.
+
+    ``index`` is the position in the secondary order that the sort reaches next, ``n_sorted`` is the
+    number of cards returned so far, and ``unmet_counts`` is the number of prerequisites of each card
+    that have not been returned yet. ``stack`` holds the cards whose dependents are being walked, each
+    as ``[index, offset]``, where ``offset`` is that of the next dependent in the transposed graph.
+    """
+    index: int
+    n_sorted: int
+    unmet_counts: array
+    stack: list[list[int]]
+
+    def copy(self) -> "SortStreamState":
+        return SortStreamState(self.index, self.n_sorted, array(INT64, self.unmet_counts),
+                         [list(entry) for entry in self.stack])
+
+    def to_json(self) -> dict:
+        return {"index": self.index,
+                "n_sorted": self.n_sorted,
+                "unmet_counts": list(self.unmet_counts),
+                "stack": self.stack}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "SortStreamState":
+        return cls(data["index"], data["n_sorted"], array(INT64, data["unmet_counts"]),
+                   [list(entry) for entry in data["stack"]])
+
+
+class SortStream:
+    """
+    Sort a ``CompactCardGraph`` in the same order as ``sort_compact_graph``, but lazily, so that the first
+    cards are available without sorting all of them, e.g., for the next study session::
+
+        stream = SortStream(graph)
+        first_cards = stream.take(20)
+        state = stream.state()
+        # Later, with the same graph:
+        next_cards = SortStream(graph, state=state).take(20)
+
+    Only the dependents graph is built up front. The stream is also an iterator of cids. Prerequisite
+    loops are only detected once every card that can be sorted has been returned.
+    """
+
+    def __init__(self, graph: CompactCardGraph, break_loops: bool = False, state: Optional[SortStreamState] = None):
+        if break_loops:
+            graph = _break_compact_loops(graph)
+        self.graph = graph
+        self._dependents = graph.transpose()
+        if state is None:
+            state = SortStreamState(0, 0, graph.degrees(), [])
+        elif not len(state.unmet_counts) == len(graph):
+            raise ValueError(f'The state is for {len(state.unmet_counts)} cards, but the graph has {len(graph)}')
+        else:
+            state = state.copy()
+        self._state = state
+
+    def state(self) -> SortStreamState:
+        """Get a copy of the current progress, to resume from with ``SortStream(graph, state=state)``."""
+        return self._state.copy()
+
+    def __iter__(self) -> "SortStream":
+        return self
+
+    def __next__(self) -> CardId:
+        cids = self.take(1)
+        if not cids:
+            raise StopIteration
+        return cids[0]
+
+    def take(self, n: int) -> list[CardId]:
+        """
+        Get the next ``n`` cards in order, or fewer if there are no more.
+
+        @raise PrerequisiteLoopError: if there are no more cards, but some were never returned because of
+                                      prerequisite loops.
+        """
+        cids = self.graph.cids
+        return [cids[i] for i in self._take_positions(n)]
+
+    def _take_positions(self, n: int) -> list[int]:
+        """Continue ``_sort_positions`` from the saved state until it has added ``n`` more positions."""
+        state = self._state
+        unmet_counts = state.unmet_counts
+        stack = state.stack
+        offsets = self._dependents.offsets
+        targets = self._dependents.targets
+        index = state.index - 1
+        positions: list[int] = []
+        while len(positions) < n:
+            if stack:
+                # Continue the depth-first walk through the cards that the last added card enabled.
+                entry = stack[-1]
+                card, k = entry
+                end = offsets[card + 1]
+                while k < end:
+                    dependent = targets[k]
+                    k += 1
+                    unmet_counts[dependent] -= 1
+                    if unmet_counts[dependent] == 0 and dependent <= index:
+                        break
+                else:
+                    stack.pop()
+                    continue
+                entry[1] = k
+                positions.append(dependent)
+                stack.append([dependent, offsets[dependent]])
+            elif state.index < len(unmet_counts):
+                index = state.index
+                state.index += 1
+                if unmet_counts[index] == 0:
+                    positions.append(index)
+                    stack.append([index, offsets[index]])
+            else:
+                if not positions and state.n_sorted < len(unmet_counts):
+                    _check_all_sorted(self.graph, [i for i, count in enumerate(unmet_counts) if count == 0])
+                break
+        state.n_sorted += len(positions)
+        return positions
+
+
+@dataclass
+class GroupSortStreamState:
+    """
+    The progress of a ``GroupSortStream``, like ``SortStreamState``. ``n_added`` is the number of members
+    of each group that have been returned. Each entry of ``stack`` is a walk, as ``[card, last dependent
+    reached, cursors]``, where each cursor is ``[next dependent, group (or -1 for the direct dependents),
+    offset, end]`` and the cursors form a heap.
+    """
+    index: int
+    n_sorted: int
+    # Lists rather than arrays, which are slower to update one item at a time.
+    unmet_counts: list[int]
+    n_added: list[int]
+    stack: list[list]
+
+    def copy(self) -> "GroupSortStreamState":
+        return GroupSortStreamState(self.index, self.n_sorted, list(self.unmet_counts), list(self.n_added),
+                                    _copy_walks(self.stack))
+
+    def to_json(self) -> dict:
+        return {"index": self.index,
+                "n_sorted": self.n_sorted,
+                "unmet_counts": self.unmet_counts,
+                "n_added": self.n_added,
+                "stack": self.stack}
 
-    def add_and_prune(cid, iteration_index):
-        # Get the index of cid within the requirement_keys dictionary.
-        # On Python 3.7+, dictionaries preserve their insertion order.
-        cid_ndx = requirement_keys.index(cid)
-        is_upcoming_cid = cid_ndx > iteration_index
+    @classmethod
+    def from_json(cls, data: dict) -> "GroupSortStreamState":
+        return cls(data["index"], data["n_sorted"], list(data["unmet_counts"]), list(data["n_added"]),
+                   _copy_walks(data["stack"]))
 
-        # If cid still has unmet requirements,
-        # then it is not ready to be added to the card_queue.
-        cid_has_unmet_requirement = len(requirement_graph[cid]) > 0
-        if cid_has_unmet_requirement:
+
+class GroupSortStream:
+    """
+    Sort a list of Cid's in the same order as ``sort_with_groups``, but lazily, like ``SortStream``. It is
+    resumed with the same arguments and ``state=state``.
+
+    ``keys`` has the Cid's in the secondary order.
+
+    The walk of an added card in ``sort_graphs`` decrements the unmet count of each of its dependents when
+    it reaches it, in the order of their positions, and it is paused while it descends into a dependent
+    that it enabled. So a card is enabled by the last walk to reach it. Here, the walk of a card visits its
+    direct dependents and, merged in the same order, the dependents of its groups, but only those for which
+    it is the last member to reach them: once all the members of a group have been added, each dependent
+    is visited by the outermost paused walk of a member that has not reached it yet, or else by the walk of
+    the last member. So each group is only walked once, in parts.
+    """
+
+    def __init__(self,
+                 cids: Sequence[CardId],
+                 prerequisites: Mapping[CardId, Sequence[int]],
+                 positions: PositionData,
+                 groups: Mapping[int, Sequence[CardId]],
+                 state: Optional[GroupSortStreamState] = None):
+        self._graph = _GroupGraph.from_mappings(cids, prerequisites, positions, groups)
+        self._prerequisites = prerequisites
+        self._groups = groups
+        self.keys = self._graph.keys
+        if state is None:
+            state = GroupSortStreamState(0, 0, list(self._graph.unmet_counts), [0] * len(groups), [])
+        elif not (len(state.unmet_counts), len(state.n_added)) == (len(self.keys), len(groups)):
+            raise ValueError(f'The state is for {len(state.unmet_counts)} cards and {len(state.n_added)} groups, '
+                             f'but there are {len(self.keys)} and {len(groups)}')
+        else:
+            state = state.copy()
+        self._state = state
+
+        # The walks of the members of each group that is not complete yet, from the outermost.
+        self._walks: dict[int, list[list]] = {}
+        for walk in state.stack:
+            for group in self._graph.member_groups[walk[0]]:
+                if state.n_added[group] < self._graph.group_sizes[group]:
+                    self._walks.setdefault(group, []).append(walk)
+
+    def state(self) -> GroupSortStreamState:
+        """Get a copy of the current progress, to resume from."""
+        return self._state.copy()
+
+    def __iter__(self) -> "GroupSortStream":
+        return self
+
+    def __next__(self) -> CardId:
+        cids = self.take(1)
+        if not cids:
+            raise StopIteration
+        return cids[0]
+
+    def take(self, n: int) -> list[CardId]:
+        """
+        Get the next ``n`` cards in order, or fewer if there are no more.
+
+        @raise PrerequisiteLoopError: if there are no more cards, but some were never returned because of
+                                      prerequisite loops.
+        """
+        keys = self.keys
+        positions = self._take_positions(n)
+        if not positions and self._state.n_sorted < len(keys):
+            self.check_all_sorted()
+        return [keys[i] for i in positions]
+
+    def check_all_sorted(self) -> None:
+        """Raise a ``PrerequisiteLoopError`` if the stream has ended, but some cards were never returned."""
+        state = self._state
+        if state.index < len(self.keys) or state.stack or state.n_sorted == len(self.keys):
             return
+        queued = {cid for cid, count in zip(self.keys, state.unmet_counts) if count == 0}
+        unqueued_graph = {key: [cid for cid in members if cid not in queued] for key, members in self._groups.items()}
+        unqueued_graph.update({cid: [prereq for prereq in self._prerequisites.get(cid, ()) if prereq not in queued]
+                               for cid in self.keys if cid not in queued})
+        # Every loop through a group also goes through its members.
+        loops = [[key for key in loop if key not in self._groups] for loop in find_loops(unqueued_graph)]
+        raise PrerequisiteLoopError.from_loops(loops, len(self.keys) - len(queued))
 
-        # If cid is at the current index (as occurs at each iteration step,
-        # at the top of each recursion), or is a previous index
-        # (meaning it was already passed in the iteration but still had unmet requirements),
-        # then add it to the card_queue and set the list of requirements to None instead of an
-        # empty list. Upcoming cards will be added to the card_queue at later step in the iteration.
-        if not is_upcoming_cid:
-            card_queue.append(cid)
-            requirement_graph[cid] = None
+    def _start_walk(self, card: int) -> list:
+        """Add the members of the groups that ``card`` completes to the walks that reach them last."""
+        graph = self._graph
+        n_added = self._state.n_added
+        walks = self._walks
+        dependents = graph.dependents[card]
+        walk = [card, -1, [[dependents[0], -1, 0, len(dependents)]] if dependents else []]
+        for group in graph.member_groups[card]:
+            n_added[group] += 1
+            if n_added[group] < graph.group_sizes[group]:
+                walks.setdefault(group, []).append(walk)
+                continue
+            targets = graph.group_dependents[group]
+            reached = len(self.keys)
+            for outer_walk in walks.pop(group, ()):
+                start, end = bisect_right(targets, outer_walk[1]), bisect_right(targets, reached)
+                if start < end:
+                    heappush(outer_walk[2], [targets[start], group, start, end])
+                reached = min(reached, outer_walk[1])
+            end = bisect_right(targets, reached)
+            if end > 0:
+                heappush(walk[2], [targets[0], group, 0, end])
+        return walk
 
-            # When cid is added to the card_queue, it can enable a list of other cards,
-            # which are stored in dependents_graph[cid].
-            for dependents_cid in dependents_graph[cid]:
-                requirement_graph[dependents_cid].remove(cid)
-                add_and_prune(dependents_cid, iteration_index)
+    def _take_positions(self, n: int) -> list[int]:
+        """Continue the sort from the saved state until it has added ``n`` more positions."""
+        state = self._state
+        unmet_counts = state.unmet_counts
+        n_added = state.n_added
+        stack = state.stack
+        dependents = self._graph.dependents
+        member_groups = self._graph.member_groups
+        group_sizes = self._graph.group_sizes
+        group_dependents = self._graph.group_dependents
+        index = state.index - 1
+        positions: list[int] = []
+        while len(positions) < n:
+            if stack:
+                walk = stack[-1]
+                cursors = walk[2]
+                if not cursors:
+                    stack.pop()
+                    for group in member_groups[walk[0]]:
+                        if n_added[group] < group_sizes[group]:
+                            self._walks[group].pop()
+                    continue
 
-    for index, key in enumerate(requirement_graph.keys()):
-        add_and_prune(key, index)
+                if len(cursors) == 1:
+                    # Nothing to merge, so walk through the list as in _sort_positions.
+                    cursor = cursors[0]
+                    targets = dependents[walk[0]] if cursor[1] < 0 else group_dependents[cursor[1]]
+                    k, end = cursor[2], cursor[3]
+                    while k < end:
+                        dependent = targets[k]
+                        k += 1
+                        unmet_counts[dependent] -= 1
+                        if unmet_counts[dependent] == 0 and dependent <= index:
+                            break
+                    else:
+                        cursors.pop()
+                        continue
+                    if k < end:
+                        cursor[0], cursor[2] = targets[k], k
+                    else:
+                        cursors.pop()
+                    walk[1] = dependent
+                    positions.append(dependent)
+                    stack.append(self._start_walk(dependent))
+                    continue
+
+                # Reach the next dependent through each list that has it.
+                dependent = cursors[0][0]
+                while cursors and cursors[0][0] == dependent:
+                    cursor = cursors[0]
+                    cursor[2] += 1
+                    if cursor[2] < cursor[3]:
+                        cursor[0] = (dependents[walk[0]] if cursor[1] < 0 else group_dependents[cursor[1]])[cursor[2]]
+                        heapreplace(cursors, cursor)
+                    else:
+                        heappop(cursors)
+                    unmet_counts[dependent] -= 1
+                walk[1] = dependent
+                if unmet_counts[dependent] == 0 and dependent <= index:
+                    positions.append(dependent)
+                    stack.append(self._start_walk(dependent))
+            elif state.index < len(unmet_counts):
+                index = state.index
+                state.index += 1
+                if unmet_counts[index] == 0:
+                    positions.append(index)
+                    stack.append(self._start_walk(index))
+            else:
+                break
+        state.n_sorted += len(positions)
+        return positions
+
+
+@dataclass
+class ReductionStats:
+    """Statistics of a ``transitive_reduction``."""
+    n_edges: int
+    n_removed: int
+
+    @property
+    def n_remaining(self) -> int:
+        return self.n_edges - self.n_removed
 
-    if not len(card_queue) == len(requirement_graph):
-        unsatisfied_dependencies = {cid: required_cids for cid, required_cids in requirement_graph.items() if
-                                    required_cids}
-        raise PrerequisiteLoopError(f'Unsatisfied dependencies: {unsatisfied_dependencies}')
+
+@profiled
+def transitive_reduction(requirement_graph: CardGraph,
+                         keep_order: bool = False) -> tuple[CardGraph, CardGraph, ReductionStats]:
+    """
+    Remove the prerequisites that are implied by other prerequisites, e.g., if card 3 requires cards 1 and
+    2, and card 2 requires card 1, then card 3 does not need to list card 1. Duplicate prerequisites are
+    removed as well.
+
+    The reduced graphs have the same keys, in the same order, and exactly the same constraints: every
+    order of the cards that satisfies one graph satisfies the other. ``sort_graphs`` can still order them
+    differently where several cards are enabled by the same card, because the order of that depth-first
+    walk depends on the edges. With ``keep_order``, the prerequisite that adds each card in such a walk is
+    kept even if it is implied, so that ``sort_graphs`` gives the same order for both graphs. The
+    reduction takes longer than sorting itself, so it pays off when the graph is stored or sorted many
+    times, or when it has many redundant edges (a maximally dense graph has O(n^2) edges, of which only
+    O(n) remain).
+
+    The ancestors of each card are tracked as bitsets, which are released once all of the card's
+    dependents have been reduced.
+
+    @return: the reduced requirement_graph and dependents_graph, and statistics on the removed edges.
+    """
+    # Process the cards in topological order, so that the ancestors of every prerequisite are known.
+    # This raises a PrerequisiteLoopError if there are loops.
+    dependents_graph = _dependents_graph(requirement_graph)
+    order = sort_graphs(requirement_graph, dependents_graph)
+    topological_index = {cid: i for i, cid in enumerate(order)}
+    walk_parents = _walk_parents(requirement_graph, dependents_graph) if keep_order else {}
+
+    n_dependents = dict.fromkeys(order, 0)
+    for required_cids in requirement_graph.values():
+        for required_cid in set(required_cids):
+            n_dependents[required_cid] += 1
+
+    ancestors: dict[CardId, int] = {}
+    reduced: CardGraph = {}
+    n_edges = 0
+    n_removed = 0
+    for cid in order:
+        required_cids = requirement_graph[cid]
+        distinct_cids = list(dict.fromkeys(required_cids))
+        n_edges += len(required_cids)
+
+        # A prerequisite is implied if it is an ancestor of another prerequisite. Ancestors always come
+        # earlier in the topological order, so visit the prerequisites from latest to earliest.
+        cid_ancestors = 0
+        kept = set()
+        for required_cid in sorted(distinct_cids, key=topological_index.__getitem__, reverse=True):
+            bit = topological_index[required_cid]
+            if (cid_ancestors >> bit) & 1:
+                continue
+            kept.add(required_cid)
+            cid_ancestors |= ancestors[required_cid] | (1 << bit)
+        if cid in walk_parents:
+            # Its ancestors are already included, since it is required by another kept prerequisite.
+            kept.add(walk_parents[cid])
+
+        reduced[cid] = [required_cid for required_cid in distinct_cids if required_cid in kept]
+        n_removed += len(required_cids) - len(kept)
+
+        if n_dependents[cid] > 0:
+            ancestors[cid] = cid_ancestors
+        for required_cid in distinct_cids:
+            n_dependents[required_cid] -= 1
+            if n_dependents[required_cid] == 0:
+                del ancestors[required_cid]
+
+    requirement_graph = {cid: reduced[cid] for cid in requirement_graph.keys()}
+    profiling.count(edges=n_edges, edges_removed=n_removed)
+    return requirement_graph, _dependents_graph(requirement_graph), ReductionStats(n_edges, n_removed)
+
+
+def _reduce_graphs(requirement_graph: CardGraph, break_loops: bool = False) -> tuple[CardGraph, CardGraph]:
+    """Get the order-preserving ``transitive_reduction`` of ``requirement_graph``, after breaking its loops."""
+    if break_loops:
+        loops = find_loops(requirement_graph)
+        if loops:
+            requirement_graph = cycles.break_loops(requirement_graph, loops)
+    reduced_requirements, reduced_dependents, _ = transitive_reduction(requirement_graph, keep_order=True)
+    return reduced_requirements, reduced_dependents
+
+
+def _walk_parents(requirement_graph: CardGraph, dependents_graph: CardGraph) -> dict[CardId, CardId]:
+    """
+    Find the cards that ``sort_graphs`` adds during the depth-first walk from another card (see
+    ``_sort_positions``), and map each of them to the card whose dependents it was reached from. Only these
+    prerequisites decide where a card is added: the others are met earlier, and a card that is not added
+    during a walk is added at its own position, once all of its prerequisites are met.
+    """
+    requirement_keys = list(requirement_graph.keys())
+    position = {cid: index for index, cid in enumerate(requirement_keys)}
+    unmet_counts = [len(requirement_graph[cid]) for cid in requirement_keys]
+    dependents = [[position[dependent_cid] for dependent_cid in dependents_graph[cid]]
+                  for cid in requirement_keys]
+
+    # The same walk as in ``_sort_positions``, but with the card of each iterator on the stack.
+    parents: dict[CardId, CardId] = {}
+    for index in range(len(unmet_counts)):
+        if unmet_counts[index] > 0:
+            continue
+        stack = [(index, iter(dependents[index]))]
+        while stack:
+            parent, dependents_iter = stack[-1]
+            for dependent in dependents_iter:
+                unmet_counts[dependent] -= 1
+                if unmet_counts[dependent] == 0 and dependent <= index:
+                    parents[requirement_keys[dependent]] = requirement_keys[parent]
+                    stack.append((dependent, iter(dependents[dependent])))
+                    break
+            else:
+                stack.pop()
+    return parents
+
+
+def _sort_positions(unmet_counts: MutableSequence[int], dependents: Sequence[Iterable[int]]) -> list[int]:
+    """
+    Sort the positions 0, 1, ..., n - 1 of the cards in the secondary order.
+
+    ``unmet_counts[i]`` is the number of prerequisites of the card at position ``i`` and is decremented
+    in place. ``dependents[i]`` gives the positions of the cards that have it as a prerequisite. Cards
+    that are part of, or depend on, a prerequisite loop are left out of the result.
+    """
+    card_queue: list[int] = []
+    for index in range(len(unmet_counts)):
+        if unmet_counts[index] > 0:
+            continue
+        card_queue.append(index)
+
+        # When a card is added to the card_queue, it can enable a list of other cards. Walk through
+        # them depth-first, using an explicit stack of iterators in place of recursion. Enabled cards
+        # at or before the current index are added immediately. Upcoming cards will be added to the
+        # card_queue at a later step in the iteration.
+        stack = [iter(dependents[index])]
+        while stack:
+            for dependent in stack[-1]:
+                unmet_counts[dependent] -= 1
+                if unmet_counts[dependent] == 0 and dependent <= index:
+                    card_queue.append(dependent)
+                    stack.append(iter(dependents[dependent]))
+                    break
+            else:
+                stack.pop()
 
     return card_queue
 
 
+@dataclass
+class _GroupGraph:
+    """
+    The graphs of ``sort_with_groups``, by the positions of the cards in the secondary order and the
+    indices of the groups.
+
+    ``unmet_counts`` has the number of distinct prerequisite cards and non-empty groups of each card.
+    ``dependents`` has the positions of the cards that directly require each card, and
+    ``group_dependents`` those of the cards that require each group, in increasing order.
+    ``member_groups`` has the groups of each card.
+    """
+    keys: list[CardId]
+    unmet_counts: list[int]
+    dependents: list[list[int]]
+    member_groups: list[list[int]]
+    group_sizes: list[int]
+    group_dependents: list[list[int]]
+
+    @classmethod
+    def from_mappings(cls,
+                      cids: Sequence[CardId],
+                      prerequisites: Mapping[CardId, Sequence[int]],
+                      positions: PositionData,
+                      groups: Mapping[int, Sequence[CardId]]) -> "_GroupGraph":
+        if isinstance(positions, Mapping):
+            positions = [positions[cid] for cid in cids]
+        if not len(cids) == len(positions):
+            raise ValueError(f'positions must have one entry for each of the {len(cids)} cids')
+
+        # Duplicate cids keep their first position, as in generate_card_graphs_from_mappings.
+        position: dict[CardId, int] = {}
+        for index in sorted(range(len(cids)), key=positions.__getitem__):
+            position.setdefault(cids[index], len(position))
+        keys = list(position)
+
+        group_index = {key: i for i, key in enumerate(groups)}
+        member_groups: list[list[int]] = [[] for _ in keys]
+        group_sizes = []
+        for key, members in groups.items():
+            for cid in dict.fromkeys(members):
+                try:
+                    member_groups[position[cid]].append(group_index[key])
+                except KeyError:
+                    raise ValueError(f'The CID={cid} was listed as a member of the group {key} but was not '
+                                     f'included in the list of cids.') from None
+            group_sizes.append(len(set(members)))
+
+        unmet_counts = [0] * len(keys)
+        dependents: list[list[int]] = [[] for _ in keys]
+        group_dependents: list[list[int]] = [[] for _ in group_sizes]
+        for index, cid in enumerate(keys):
+            for prereq in dict.fromkeys(prerequisites.get(cid, ())):
+                group = group_index.get(prereq)
+                if group is not None:
+                    if group_sizes[group] > 0:
+                        group_dependents[group].append(index)
+                        unmet_counts[index] += 1
+                    continue
+                try:
+                    dependents[position[prereq]].append(index)
+                except KeyError:
+                    raise ValueError(f'The CID={prereq} was listed as a prerequisite of CID={cid} but was not '
+                                     f'included in the list of cids.') from None
+                unmet_counts[index] += 1
+        return cls(keys, unmet_counts, dependents, member_groups, group_sizes, group_dependents)
+
+
+def _break_compact_loops(graph: CompactCardGraph) -> CompactCardGraph:
+    """Break the loops of ``graph`` in the same way as ``cycles.break_loops``."""
+    # Map the index of each card in a loop to the index of the loop.
+    loop_ids = {}
+    for loop_id, component in enumerate(strongly_connected_components(graph)):
+        if len(component) > 1 or component[0] in graph[component[0]]:
+            loop_ids.update(dict.fromkeys(component, loop_id))
+    if not loop_ids:
+        return graph
+
+    def is_kept(i: int, j: int) -> bool:
+        # Only keep the prerequisites within a loop that come earlier in the secondary order.
+        loop_id = loop_ids.get(i)
+        return loop_id is None or loop_ids.get(j) != loop_id or j < i
+
+    return graph.filtered(is_kept)
+
+
+def _check_all_sorted(graph: CompactCardGraph, positions: Sequence[int]) -> None:
+    """Raise a ``PrerequisiteLoopError`` if the sorted ``positions`` leave out any cards of ``graph``."""
+    if len(positions) == len(graph):
+        return
+    cids = graph.cids
+    queued = set(positions)
+    unqueued_graph = {cids[i]: [cids[j] for j in graph[i] if j not in queued]
+                      for i in range(len(graph)) if i not in queued}
+    raise PrerequisiteLoopError.from_loops(find_loops(unqueued_graph), len(unqueued_graph))
+
+
+def _copy_walks(stack: list[list]) -> list[list]:
+    """Copy the walks of a ``GroupSortStreamState``."""
+    return [[card, reached, [list(cursor) for cursor in cursors]] for card, reached, cursors in stack]
+
+
+def _dependents_graph(requirement_graph: CardGraph) -> CardGraph:
+    """Build the dependents_graph that corresponds to ``requirement_graph``."""
+    dependents_graph = {cid: [] for cid in requirement_graph.keys()}
+    for cid, required_cids in requirement_graph.items():
+        for required_cid in required_cids:
+            dependents_graph[required_cid].append(cid)
+    return dependents_graph
+
+
 class PrerequisiteLoopError(Exception):
-    pass
+    """
+    Raised when prerequisites form loops, so that the cards in them can never be studied.
+
+    ``loops`` lists the cards (or notes) in each loop. Cards that merely depend on a loop are not listed.
+    If the error comes from ``pipeline.check_note_loops``, ``note_loops`` has a ``pipeline.NoteLoop`` for
+    each of them, with the prerequisite tags that form it. Otherwise, it is empty.
+    """
+    # Limit the size of the message for large loops.
+    MAX_LOOPS_SHOWN = 10
+    MAX_MEMBERS_SHOWN = 20
+
+    def __init__(self, message: str, loops: Optional[list[list]] = None, note_loops: Optional[list] = None):
+        super().__init__(message)
+        self.loops = loops if loops is not None else []
+        self.note_loops = note_loops if note_loops is not None else []
+
+    @classmethod
+    def from_loops(cls, loops: list[list], n_blocked: Optional[int] = None) -> "PrerequisiteLoopError":
+        """Create an error with a message that lists (the start of) each loop."""
+        shown = [loop if len(loop) <= cls.MAX_MEMBERS_SHOWN else loop[:cls.MAX_MEMBERS_SHOWN] + ["..."]
+                 for loop in loops[:cls.MAX_LOOPS_SHOWN]]
+        message = f'Found {len(loops)} prerequisite loop(s)'
+        if n_blocked is not None:
+            message += f', which block {n_blocked} cards in total'
+        message += f': {", ".join(str(loop) for loop in shown)}'
+        if len(loops) > cls.MAX_LOOPS_SHOWN:
+            message += ', ...'
+        return cls(message, loops)
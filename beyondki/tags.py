@@ -0,0 +1,136 @@
+"""In-memory index for resolving tag searches against all notes at once."""
+import re
+from collections.abc import Iterable, Mapping
+
+from anki.collection import Collection
+from anki.notes import NoteId
+
+HIERARCHY_SEPARATOR = "::"
+
+
+def note_tag_rows(col: Collection) -> list[tuple[NoteId, str]]:
+    """Fetch the ID and the space-separated tags of every note in a single query."""
+    return [(NoteId(nid), tags) for nid, tags in col.db.all("select id, tags from notes")]
+
+
+class TagIndex:
+    """
+    Inverted index from tags to the IDs of the notes that have them.
+
+    ``find_notes(tag)`` returns the same notes as ``col.find_notes(f"tag:{tag}")``, without querying the
+    collection: matching is case-insensitive, a tag also matches all of its children in the ``::``
+    hierarchy, and ``*`` (any number of characters) and ``_`` (a single character) are wildcards. As in
+    Anki, ``tag:*`` matches every note and ``tag:none`` matches the notes without tags.
+    """
+
+    def __init__(self, rows: Iterable[tuple[NoteId, str]]):
+        """
+        Build the index from ``(nid, tags)`` rows, where ``tags`` is a string of space-separated tags, as
+        stored in the notes table.
+        """
+        # Maps each lower-case tag to the notes that have exactly that tag.
+        self._nids_by_tag: dict[str, set[NoteId]] = {}
+        # Maps each lower-case tag to the notes that have that tag or any of its children.
+        self._nids_by_ancestor: dict[str, set[NoteId]] = {}
+        self._all_nids: set[NoteId] = set()
+        self._untagged_nids: set[NoteId] = set()
+        # Results of previous searches.
+        self._cache: dict[str, list[NoteId]] = {}
+
+        for nid, tags in rows:
+            self.add(nid, tags)
+
+    def add(self, nid: NoteId, tags: str) -> None:
+        """Add a note with the space-separated ``tags`` to the index."""
+        self._cache.clear()
+        self._all_nids.add(nid)
+        if not tags.strip():
+            self._untagged_nids.add(nid)
+        for tag in tags.lower().split():
+            self._nids_by_tag.setdefault(tag, set()).add(nid)
+            for ancestor in _ancestors(tag):
+                self._nids_by_ancestor.setdefault(ancestor, set()).add(nid)
+
+    def discard(self, nid: NoteId, tags: str) -> None:
+        """Remove a note from the index. ``tags`` must be the tags that the note was added with."""
+        self._cache.clear()
+        self._all_nids.discard(nid)
+        self._untagged_nids.discard(nid)
+        for tag in tags.lower().split():
+            _discard_from(self._nids_by_tag, tag, nid)
+            for ancestor in _ancestors(tag):
+                _discard_from(self._nids_by_ancestor, ancestor, nid)
+
+    @classmethod
+    def from_collection(cls, col: Collection) -> "TagIndex":
+        """Build the index from the tags of every note in ``col``."""
+        return cls(note_tag_rows(col))
+
+    def find_notes(self, tag: str) -> list[NoteId]:
+        """Get the sorted IDs of the notes matching ``tag``."""
+        return list(self._find_notes(tag))
+
+    def _find_notes(self, tag: str) -> list[NoteId]:
+        """Like ``find_notes``, but return a cached list that must not be modified."""
+        key = tag.lower()
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        if key == "*":
+            nids = self._all_nids
+        elif key == "none":
+            nids = self._untagged_nids
+        elif "*" in key or "_" in key:
+            pattern = _tag_pattern(key)
+            nids = set()
+            for indexed_tag, tag_nids in self._nids_by_tag.items():
+                if pattern.fullmatch(indexed_tag):
+                    nids.update(tag_nids)
+        else:
+            nids = self._nids_by_ancestor.get(key, ())
+
+        result = sorted(nids)
+        self._cache[key] = result
+        return result
+
+    def resolve(self, note_prereq_tags: Mapping[NoteId, Iterable[str]]) -> dict[NoteId, list[NoteId]]:
+        """
+        Map each nid to the sorted IDs of the notes matching any of its prerequisite tags.
+
+        ``note_prereq_tags`` maps nids to prerequisite tags, e.g., as parsed by
+        ``prerequisites.extract_prerequisite_tags``.
+        """
+        note_prereqs_graph = {}
+        for nid, tags in note_prereq_tags.items():
+            tags = list(tags)
+            if len(tags) == 1:
+                note_prereqs_graph[nid] = list(self._find_notes(tags[0]))
+            else:
+                note_prereqs_graph[nid] = sorted(set().union(*map(self._find_notes, tags)))
+        return note_prereqs_graph
+
+    def tags(self) -> list[str]:
+        """Get all indexed tags, in lower case."""
+        return list(self._nids_by_tag.keys())
+
+
+def _ancestors(tag: str) -> list[str]:
+    """Get ``tag`` and all of its parents in the ``::`` hierarchy."""
+    parts = tag.split(HIERARCHY_SEPARATOR)
+    return [HIERARCHY_SEPARATOR.join(parts[:depth]) for depth in range(1, len(parts) + 1)]
+
+
+def _discard_from(nids_by_tag: dict[str, set[NoteId]], tag: str, nid: NoteId) -> None:
+    nids = nids_by_tag.get(tag)
+    if nids is not None:
+        nids.discard(nid)
+        if not nids:
+            del nids_by_tag[tag]
+
+
+def _tag_pattern(tag: str) -> re.Pattern:
+    """Convert a tag search with wildcards to a regular expression that also matches child tags."""
+    pattern = "".join(r"\S*" if c == "*" else r"\S" if c == "_" else re.escape(c) for c in tag)
+    return re.compile(f"{pattern}(?:{HIERARCHY_SEPARATOR}\\S*)?")
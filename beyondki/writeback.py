@@ -0,0 +1,178 @@
+"""Writing a new card order back to the collection in bulk."""
+from bisect import bisect_right
+from collections.abc import Iterable, Mapping, Sequence
+from typing import Optional
+
+from anki.cards import CardId
+from anki.collection import Collection
+from anki.consts import CARD_TYPE_NEW
+from anki.utils import ids2str, int_time
+
+from beyondki.profiling import count, profiled
+
+
+def new_card_dues(col: Collection, cids: Optional[Iterable[CardId]] = None) -> dict[CardId, int]:
+    """Fetch the due position of every new card, or only of the new cards in ``cids``, in a single query."""
+    query = "select id, due from cards where type = ?"
+    if cids is not None:
+        query += f" and id in {ids2str(cids)}"
+    return {CardId(cid): due for cid, due in col.db.all(query, CARD_TYPE_NEW)}
+
+
+@profiled
+def compute_due_changes(ordered_cids: Sequence[CardId],
+                        current_dues: Mapping[CardId, int],
+                        spacing: int = 1) -> list[tuple[CardId, int]]:
+    """
+    Compute the due positions that have to change so that the new cards follow ``ordered_cids``.
+
+    Each new card is given its index in ``ordered_cids`` (times ``spacing``) as its due position. Cards
+    that are not in ``current_dues`` (i.e., cards that are not new) are left alone, and so are cards
+    whose due position is already correct. A ``spacing`` larger than one leaves gaps, so that
+    ``compute_minimal_changes`` can later insert cards without moving others.
+
+    @return: a list of ``(cid, due)`` pairs, in the order of ``ordered_cids``.
+    """
+    changes = []
+    for index, cid in enumerate(ordered_cids):
+        due = index * spacing
+        current_due = current_dues.get(cid)
+        if current_due is not None and current_due != due:
+            changes.append((cid, due))
+    return changes
+
+
+@profiled
+def compute_slot_changes(ordered_cids: Sequence[CardId],
+                         current_dues: Mapping[CardId, int]) -> list[tuple[CardId, int]]:
+    """
+    Like ``compute_due_changes``, but only reorder the new cards in ``ordered_cids`` among the due
+    positions that they already have, e.g., when only part of the collection was sorted. The positions
+    of all other new cards are kept.
+
+    @return: a list of ``(cid, due)`` pairs, in the order of ``ordered_cids``.
+    """
+    new_cids = [cid for cid in ordered_cids if cid in current_dues]
+    slots = sorted(current_dues[cid] for cid in new_cids)
+    return [(cid, due) for cid, due in zip(new_cids, slots) if current_dues[cid] != due]
+
+
+@profiled
+def compute_minimal_changes(ordered_cids: Sequence[CardId],
+                            current_dues: Mapping[CardId, int],
+                            spacing: int = 1) -> list[tuple[CardId, int]]:
+    """
+    Compute the smallest set of due position changes that puts the new cards in ``ordered_cids`` in that
+    order, so that a small change of the order only causes a small number of writes (and syncs).
+
+    The cards that keep their positions must be in increasing order, with enough room between each pair
+    for the cards that go between them, and before the first one, since positions are never negative.
+    That is, ``due - i`` must not decrease, where ``i`` is the index among the new cards, so the longest
+    such subsequence is kept. The other cards are spread evenly over the gaps, which leaves room for
+    later changes, and the cards after the last kept card follow it, ``spacing`` positions apart.
+
+    @return: a list of ``(cid, due)`` pairs, in the order of ``ordered_cids``.
+    """
+    new_cids = [cid for cid in ordered_cids if cid in current_dues]
+    dues = [current_dues[cid] for cid in new_cids]
+    candidates = [i for i, due in enumerate(dues) if due >= i]
+    kept = {candidates[k] for k in _longest_non_decreasing_subsequence([dues[i] - i for i in candidates])}
+
+    changes = []
+    moved: list[int] = []
+    previous_due = -1
+    for i, due in enumerate(dues):
+        if i not in kept:
+            moved.append(i)
+            continue
+        step = due - previous_due
+        changes.extend((new_cids[j], previous_due + k * step // (len(moved) + 1))
+                       for k, j in enumerate(moved, start=1))
+        moved = []
+        previous_due = due
+    changes.extend((new_cids[j], previous_due + k * spacing) for k, j in enumerate(moved, start=1))
+
+    return [(cid, due) for cid, due in changes if current_dues[cid] != due]
+
+
+def compute_changes(ordered_cids: Sequence[CardId],
+                    current_dues: Mapping[CardId, int],
+                    keep_slots: bool = False,
+                    minimal: bool = False,
+                    spacing: int = 1) -> list[tuple[CardId, int]]:
+    """
+    Compute the due position changes with ``compute_slot_changes`` if ``keep_slots`` is true, else with
+    ``compute_minimal_changes`` if ``minimal`` is true, else with ``compute_due_changes``.
+
+    ``keep_slots`` takes precedence, so that cards outside of ``ordered_cids`` keep their positions. It
+    already moves as few cards as possible within those slots, because there is one slot per card, so
+    the order leaves only one way to assign them.
+    """
+    if keep_slots:
+        return compute_slot_changes(ordered_cids, current_dues)
+    if minimal:
+        return compute_minimal_changes(ordered_cids, current_dues, spacing)
+    return compute_due_changes(ordered_cids, current_dues, spacing)
+
+
+@profiled
+def apply_due_changes(col: Collection, changes: Sequence[tuple[CardId, int]]) -> None:
+    """
+    Write ``(cid, due)`` pairs to the cards table with a single batched update, and commit it.
+
+    The modification time and update sequence number of each changed card are bumped so that the
+    changes are synced.
+    """
+    count(changes=len(changes))
+    if not changes:
+        return
+    mod = int_time()
+    usn = col.usn()
+    col.db.executemany("update cards set due = ?, mod = ?, usn = ? where id = ?",
+                       [(due, mod, usn, cid) for cid, due in changes])
+    col.save()
+
+
+def reorder_new_cards(col: Collection,
+                      ordered_cids: Sequence[CardId],
+                      keep_slots: bool = False,
+                      minimal: bool = False) -> int:
+    """
+    Reposition the new cards in ``col`` to follow ``ordered_cids``, in one transaction.
+
+    If ``keep_slots`` is true, the cards are only reordered among the due positions that they already have
+    (see ``compute_slot_changes``), e.g., if ``ordered_cids`` are the cards matching a search. Otherwise,
+    if ``minimal`` is true, as few cards as possible are moved (see ``compute_minimal_changes``).
+
+    @return: the number of cards that were repositioned.
+    """
+    current_dues = new_card_dues(col, ordered_cids if keep_slots else None)
+    changes = compute_changes(ordered_cids, current_dues, keep_slots, minimal)
+    apply_due_changes(col, changes)
+    return len(changes)
+
+
+def _longest_non_decreasing_subsequence(values: Sequence[int]) -> list[int]:
+    """Get the indices of a longest non-decreasing subsequence of ``values``, in O(n log n) time."""
+    # tail_indices[k] is the index of the smallest value that ends a subsequence of length k + 1, and
+    # previous[i] is the index before i in the longest subsequence that ends at i.
+    tail_indices: list[int] = []
+    tail_values: list[int] = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        k = bisect_right(tail_values, value)
+        if k > 0:
+            previous[i] = tail_indices[k - 1]
+        if k == len(tail_values):
+            tail_indices.append(i)
+            tail_values.append(value)
+        else:
+            tail_indices[k] = i
+            tail_values[k] = value
+
+    indices = []
+    i = tail_indices[-1] if tail_indices else -1
+    while i != -1:
+        indices.append(i)
+        i = previous[i]
+    return indices[::-1]
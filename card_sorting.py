@@ -48,17 +48,11 @@ def reverse_cid_order(cid):
 def main() -> None:
     """Run the program."""
 
-    import sys
-    # sys.setrecursionlimit(1000)
-
-    # Works OK up to 1500 with 'dense_prereqs' and up to >1200
-    # with 'sparse_prereqs' and up to 100_000 with no_prereqs.
+    # See benchmarks/bench_sorting.py for timings of larger graphs.
     n_cards = 3
     cids = list(range(1, n_cards+1))
 
-    sorter = beyondki.sorting.CardSorter(cids, prereq_loop, cid_order)
-    card_queue = sorter.sort_graphs()
-
+    card_queue = beyondki.sorting.sort(cids, sparse_prereqs, cid_order)
     print()
     print(card_queue)
 
@@ -1,25 +1,28 @@
 """Demo of prerequisite tag extraction."""
 import random
 import shutil
+import sys
+import tempfile
 import pprint as pp
 from collections.abc import Sequence, Iterator
 from itertools import chain
 from pathlib import Path
 from typing import Union
 
-import anki.consts
 from anki.collection import Collection
 from anki.notes import NoteId
 from anki.cards import CardId, Card
 from beartype import beartype
 
-import sorting
 from beyondki.prerequisites import extract_prerequisite_tags
+from beyondki.pipeline import sort_collection
+from beyondki.writeback import reorder_new_cards
 
 
 def get_prereq_tags_from_note(col: Collection, nid: NoteId) -> list[str]:
     """Get the tags as a single string."""
-    tags_str = col.get_note(nid).string_tags()
+    # Read the tags column directly instead of loading the full note.
+    tags_str = col.db.scalar("select tags from notes where id = ?", nid)
 
     return extract_prerequisite_tags(tags_str)
 
@@ -129,33 +132,21 @@ class MockCollection:
         pass
 
 
-def reorder_cards(col: Union[MockCollection, Collection], ordered_cids: Sequence[CardId]) -> None:
-    for i, cid in enumerate(ordered_cids):
-        card = col.get_card(cid)
-        if card.type == anki.consts.CARD_TYPE_NEW:
-            card.due = i
-            col.update_card(card)
+def reorder_cards(col: Collection, ordered_cids: Sequence[CardId]) -> None:
+    n_changed = reorder_new_cards(col, ordered_cids)
+    print(f"Repositioned {n_changed} new cards.")
 
 
 def main() -> None:
-    """Run the demo."""
-    src_file = "collection.anki2"
-    # Hard-coded path to my test collection. TODO: read from options file or command line.
-    collection_file = Path(Path.home(), 'AppData', 'Roaming', 'Anki2', 'Test 2', 'collection.anki2')
+    """Run the demo on a copy of the collection given on the command line (by default, collection.anki2)."""
+    src_file = sys.argv[1] if len(sys.argv) > 1 else "collection.anki2"
+    # Work on a copy, so that the original collection is never modified.
+    collection_file = Path(tempfile.mkdtemp(), 'collection.anki2')
     shutil.copyfile(src_file, collection_file)
 
     col = Collection(str(collection_file))
 
-    all_nids: Iterator[NoteId] = col.find_notes("")
-    all_cids: Iterator[CardId] = col.find_cards("")
-    print(f"all_cids={all_cids}")
-
-    note_tag_prerequisites: dict[NoteId, list[str]] = {nid: get_prereq_tags_from_note(col, nid) for nid in all_nids}
-    note_prereqs_graph = {nid: get_notes_matching_tags(col, tags) for (nid, tags) in note_tag_prerequisites.items()}
-    card_prereqs_graph = {cid: nids_to_cids(col, note_prereqs_graph[nid])
-                          for nid in note_tag_prerequisites.keys() for cid in nids_to_cids(col, nid)}
-
-    ordered_cids = sorting.sort(all_cids, lambda cid: card_prereqs_graph[cid], lambda cid: cid)
+    ordered_cids = sort_collection(col)
     print(f"ordered_cids: {ordered_cids}")
 
     reorder_cards(col, ordered_cids)
@@ -165,7 +156,8 @@ def main() -> None:
         # card.due = i
         print(f"card={card.description()}")
 
-    col.save()
+    col.close()
+    print(f"Saved the reordered copy to {collection_file}")
     return
 
     # # Create a mock collection for easier testing.
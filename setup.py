@@ -11,4 +11,7 @@ setuptools.setup(
     author_email="",
     license="GNU General Public License version 3",
     packages=["beyondki"],
+    entry_points={
+        "console_scripts": ["beyondki=beyondki.cli:main"],
+    },
 )
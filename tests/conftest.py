@@ -0,0 +1,49 @@
+"""Fixtures for the tests that need an Anki collection."""
+import pytest
+from anki.collection import Collection
+
+
+def _add_note(col, tags, did=1):
+    note = col.new_note(col.models.by_name("Basic"))
+    note["Front"] = " ".join(tags)
+    note.tags = tags
+    col.add_note(note, did)
+    return note
+
+
+@pytest.fixture
+def add_note():
+    """Get a function that adds a Basic note with a list of tags to a collection, in deck ``did``."""
+    return _add_note
+
+
+@pytest.fixture
+def make_collection(tmp_path):
+    """
+    Get a function that creates a collection in ``tmp_path``, with a Basic note for each of the given lists
+    of tags, in order, and returns it open. The collections that are still open are closed after the test.
+    """
+    collections = []
+
+    def make(*tag_lists, name="collection.anki2"):
+        col = Collection(str(tmp_path / name))
+        collections.append(col)
+        for tags in tag_lists:
+            _add_note(col, tags)
+        return col
+
+    yield make
+    for col in collections:
+        if col.db is not None:
+            col.close()
+
+
+@pytest.fixture
+def make_collection_file(make_collection):
+    """Like ``make_collection``, but close the collection and return the path of its file."""
+    def make(*tag_lists, name="collection.anki2"):
+        col = make_collection(*tag_lists, name=name)
+        col.close()
+        return col.path
+
+    return make
@@ -4,7 +4,8 @@ from typing import List
 import pytest
 from beartype import beartype
 
-from beyondki.sorting import generate_card_graphs, PrerequisiteLoopError, Cid, CardGraph, sort_graphs
+from beyondki.sorting import generate_card_graphs, PrerequisiteLoopError, Cid, CardGraph, sort_graphs, \
+    generate_card_graphs_from_mappings, sort, sort_from_mappings, transitive_reduction
 
 
 def cid_order(cid: Cid) -> int:
@@ -111,3 +112,149 @@ def test_error_if_prereqs_not_a_list():
     with pytest.raises(ValueError):
         # noinspection PyTypeChecker
         generate_card_graphs([1, 2], return_not_a_list, cid_order)
+
+
+def test_sort_graphs_pulls_prereqs_forward():
+    cids = [1, 2, 3, 4]
+    prereqs = prereqs_fnc_from_dict({1: [4], 2: [], 3: [], 4: []})
+
+    requirement_graph, dependents_graph = generate_card_graphs(cids, prereqs, cid_order)
+    assert sort_graphs(requirement_graph, dependents_graph) == [2, 3, 4, 1]
+
+
+def test_sort_graphs_enables_dependents_depth_first():
+    cids = [1, 2, 3, 4]
+    prereqs = prereqs_fnc_from_dict({1: [4], 2: [4], 3: [1], 4: []})
+
+    requirement_graph, dependents_graph = generate_card_graphs(cids, prereqs, cid_order)
+    assert sort_graphs(requirement_graph, dependents_graph) == [4, 1, 3, 2]
+
+
+def test_sort_graphs_does_not_modify_graphs():
+    cids = [1, 2]
+    prereqs = prereqs_fnc_from_dict({1: [2], 2: []})
+
+    requirement_graph, dependents_graph = generate_card_graphs(cids, prereqs, cid_order)
+    sort_graphs(requirement_graph, dependents_graph)
+    assert_equal_with_order(requirement_graph, {1: [2], 2: []})
+    assert_equal_with_order(dependents_graph, {1: [], 2: [1]})
+
+
+def test_sort_graphs_long_chain():
+    # Each card requires the card with the next lower cid, but cards are ordered by descending cid,
+    # so the entire chain is enabled when the last card is reached.
+    n_cards = 50_000
+    cids = list(range(1, n_cards + 1))
+
+    def single_prereqs(cid):
+        return [] if cid == 1 else [cid - 1]
+
+    requirement_graph, dependents_graph = generate_card_graphs(cids, single_prereqs, reverse_cid_order)
+    assert sort_graphs(requirement_graph, dependents_graph) == cids
+
+
+def test_graphs_from_mappings_match_callbacks():
+    cids = [3, 1, 4, 2]
+    prereq_dict = {1: [], 2: [1], 3: [1, 2], 4: [2]}
+
+    expected = generate_card_graphs(cids, prereqs_fnc_from_dict(prereq_dict), reverse_cid_order)
+    requirement_graph, dependents_graph = generate_card_graphs_from_mappings(cids, prereq_dict,
+                                                                            {cid: -cid for cid in cids})
+    assert_equal_with_order(requirement_graph, expected[0])
+    assert_equal_with_order(dependents_graph, expected[1])
+
+
+def test_graphs_from_parallel_sequences():
+    cids = [2, 1]
+    requirement_graph, dependents_graph = generate_card_graphs_from_mappings(cids, [[1], []], cids)
+    assert_equal_with_order(requirement_graph, {1: [], 2: [1]})
+    assert_equal_with_order(dependents_graph, {1: [2], 2: []})
+
+
+def test_graphs_from_mappings_missing_cids_have_no_prereqs():
+    requirement_graph, _ = generate_card_graphs_from_mappings([1, 2], {2: [1]}, {1: 0, 2: 1})
+    assert_equal_with_order(requirement_graph, {1: [], 2: [1]})
+
+
+def test_graphs_from_mappings_length_mismatch():
+    with pytest.raises(ValueError):
+        generate_card_graphs_from_mappings([1, 2], [[], []], [0])
+
+
+def test_sort_from_mappings():
+    assert sort_from_mappings([1, 2, 3], {1: [3]}, [1, 2, 3]) == [2, 3, 1]
+
+
+def test_prereq_loop_error_lists_only_loops():
+    cids = [1, 2, 3, 4]
+    prereqs = prereqs_fnc_from_dict({1: [2], 2: [1], 3: [1], 4: []})
+
+    requirement_graph, dependents_graph = generate_card_graphs(cids, prereqs, cid_order)
+    with pytest.raises(PrerequisiteLoopError) as error:
+        sort_graphs(requirement_graph, dependents_graph)
+    assert error.value.loops == [[1, 2]]
+    assert error.value.note_loops == []
+
+
+def test_break_loops():
+    cids = [1, 2, 3, 4]
+    prereqs = prereqs_fnc_from_dict({1: [2], 2: [1], 3: [1], 4: []})
+
+    requirement_graph, dependents_graph = generate_card_graphs(cids, prereqs, reverse_cid_order)
+    # Within the loop, 2 comes first in the secondary order, so it loses its prerequisite, and 1 keeps it.
+    assert sort_graphs(requirement_graph, dependents_graph, break_loops=True) == [4, 2, 1, 3]
+    assert sort_from_mappings(cids, [prereqs(cid) for cid in cids], [-cid for cid in cids],
+                              break_loops=True) == [4, 2, 1, 3]
+
+
+def test_transitive_reduction_of_dense_graph():
+    cids = [1, 2, 3, 4, 5]
+    prereqs = prereqs_fnc_from_dict({cid: list(range(1, cid)) for cid in cids})
+
+    requirement_graph, dependents_graph = generate_card_graphs(cids, prereqs, reverse_cid_order)
+    reduced_requirements, reduced_dependents, stats = transitive_reduction(requirement_graph)
+    assert_equal_with_order(reduced_requirements, {5: [4], 4: [3], 3: [2], 2: [1], 1: []})
+    assert_equal_with_order(reduced_dependents, {5: [], 4: [5], 3: [4], 2: [3], 1: [2]})
+    assert (stats.n_edges, stats.n_removed, stats.n_remaining) == (10, 6, 4)
+    assert sort_graphs(reduced_requirements, reduced_dependents) == [1, 2, 3, 4, 5]
+
+
+def test_transitive_reduction_keeps_independent_prereqs():
+    requirement_graph = {1: [], 2: [], 3: [1, 2, 1], 4: [3, 1]}
+    reduced_requirements, _, stats = transitive_reduction(requirement_graph)
+    assert reduced_requirements == {1: [], 2: [], 3: [1, 2], 4: [3]}
+    assert (stats.n_edges, stats.n_removed) == (5, 2)
+    assert requirement_graph == {1: [], 2: [], 3: [1, 2, 1], 4: [3, 1]}  # Not modified
+
+
+def test_transitive_reduction_keeping_order():
+    # Card 3 is added during the walk from card 4, after card 2, but would follow card 1 without its edge to 4.
+    requirement_graph = {1: [4], 2: [4], 3: [1, 4], 4: []}
+    reduced_requirements, reduced_dependents, _ = transitive_reduction(requirement_graph)
+    assert reduced_requirements[3] == [1]
+    assert sort_graphs(reduced_requirements, reduced_dependents) == [4, 1, 3, 2]
+
+    reduced_requirements, reduced_dependents, stats = transitive_reduction(requirement_graph, keep_order=True)
+    assert reduced_requirements[3] == [1, 4] and stats.n_removed == 0
+    assert sort_graphs(reduced_requirements, reduced_dependents) == [4, 1, 2, 3]
+    assert sort_from_mappings([1, 2, 3, 4], requirement_graph, [1, 2, 3, 4], reduce=True) == [4, 1, 2, 3]
+
+
+def test_sort_with_reduction_keeps_order():
+    cids = list(range(1, 31))
+    prerequisites = {cid: [p for p in range(1, cid) if (cid * p) % 7 < 3] for cid in cids}
+    positions = {cid: (cid * 11) % 31 for cid in cids}
+    assert sort_from_mappings(cids, prerequisites, positions, reduce=True) == \
+        sort_from_mappings(cids, prerequisites, positions)
+    assert sort(cids, prerequisites.__getitem__, positions.__getitem__, reduce=True) == \
+        sort_from_mappings(cids, prerequisites, positions)
+
+    # Loops are broken before the reduction.
+    prerequisites[1] = [30]
+    assert sort_from_mappings(cids, prerequisites, positions, break_loops=True, reduce=True) == \
+        sort_from_mappings(cids, prerequisites, positions, break_loops=True)
+
+
+def test_transitive_reduction_of_loop_raises_error():
+    with pytest.raises(PrerequisiteLoopError):
+        transitive_reduction({1: [2], 2: [1]})
@@ -0,0 +1,98 @@
+"""Unit tests for ``background`` module."""
+import threading
+from array import array
+from concurrent.futures import CancelledError
+
+import pytest
+
+from beyondki import pipeline
+from beyondki.background import CollectionChangedError, compute_reorder, start_reorder
+from beyondki.graph import INT64
+from beyondki.reader import CollectionData
+from beyondki.writeback import new_card_dues
+
+
+@pytest.fixture
+def col(make_collection):
+    # The first note requires the second one.
+    return make_collection(["b", "pre:a"], ["a"])
+
+
+@pytest.fixture
+def data():
+    return CollectionData(array(INT64, [1, 2]), [" pre:a ", " a "], array(INT64, [10, 20]),
+                          array(INT64, [1, 2]), array(INT64, [0, 0]), array(INT64, [0, 1]))
+
+
+def test_compute_reorder(data):
+    assert compute_reorder(data) == [(20, 0), (10, 1)]
+
+
+def test_compute_reorder_stops_at_next_stage_when_cancelled(data, monkeypatch):
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(CancelledError):
+        compute_reorder(data, cancel_event=cancel_event)
+
+    # Cancelled while the graph is built: it is not sorted.
+    cancel_event = threading.Event()
+    build_tag_group_graph = pipeline.build_tag_group_graph
+
+    def build_and_cancel(tag_rows):
+        cancel_event.set()
+        return build_tag_group_graph(tag_rows)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("sorted after cancel")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pipeline, "build_tag_group_graph", build_and_cancel)
+        patch.setattr(pipeline.CardStream, "take", fail)
+        with pytest.raises(CancelledError):
+            compute_reorder(data, cancel_event=cancel_event)
+
+    # Cancelled while the cards are sorted: the rest are not.
+    cancel_event = threading.Event()
+    take = pipeline.CardStream.take
+    taken = []
+
+    def take_and_cancel(stream, n):
+        cancel_event.set()
+        taken.append(take(stream, n))
+        return taken[-1]
+
+    monkeypatch.setattr(pipeline, "CANCEL_CHUNK_SIZE", 1)
+    monkeypatch.setattr(pipeline.CardStream, "take", take_and_cancel)
+    with pytest.raises(CancelledError):
+        compute_reorder(data, cancel_event=cancel_event)
+    assert taken == [[20]]
+
+
+def test_reorder_in_background(col):
+    first_cid, second_cid = sorted(new_card_dues(col))
+    job = start_reorder(col)
+    assert job.finish(col, timeout=10) > 0
+    dues = new_card_dues(col)
+    assert dues[second_cid] < dues[first_cid]
+
+
+def test_changed_collection_is_not_written(col):
+    dues = new_card_dues(col)
+    job = start_reorder(col)
+    note = col.get_note(col.find_notes("")[0])
+    note.tags.append("c")
+    col.update_note(note)
+    assert job.is_stale(col)
+    with pytest.raises(CollectionChangedError):
+        job.finish(col, timeout=10)
+    assert new_card_dues(col) == dues
+
+
+def test_cancelled_job_is_not_written(col):
+    dues = new_card_dues(col)
+    job = start_reorder(col)
+    job.cancel()
+    assert job.cancel_event.is_set()
+    with pytest.raises(CancelledError):
+        job.finish(col)
+    assert new_card_dues(col) == dues
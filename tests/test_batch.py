@@ -0,0 +1,55 @@
+"""Unit tests for ``batch`` module."""
+import multiprocessing
+import os
+
+import pytest
+
+from beyondki import batch
+from beyondki.batch import reorder_files
+from beyondki.cli import main
+from beyondki.pipeline import reorder_file
+
+
+def chain(n_notes):
+    """Get the tags of ``n_notes`` notes that each require the next one."""
+    return [[f"n{i}"] + ([f"pre:n{i + 1}"] if i + 1 < n_notes else []) for i in range(n_notes)]
+
+
+def test_failures_do_not_stop_the_batch(tmp_path, make_collection_file):
+    paths = [make_collection_file(*chain(3), name="a.anki2"), str(tmp_path / "missing.anki2"),
+             make_collection_file(*chain(2), name="b.anki2")]
+    finished = []
+    records = reorder_files(paths, max_workers=2, callback=finished.append, dry_run=True)
+
+    assert [record.path for record in records] == paths
+    assert sorted(record.path for record in finished) == sorted(paths)
+    assert [record.n_cards for record in records] == [3, 0, 2]
+    assert records[0].error is None and records[0].n_repositioned > 0 and "sort" in records[0].timings
+    assert records[1].error.startswith("FileNotFoundError") and "Traceback" in records[1].traceback
+
+
+def reorder_or_crash(path, **options):
+    if path.endswith("crash.anki2"):
+        os._exit(1)
+    return reorder_file(path, **options)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="the workers only see the patched function if they are forked")
+def test_crashed_worker_only_fails_its_collection(make_collection_file, monkeypatch):
+    monkeypatch.setattr(batch, "reorder_file", reorder_or_crash)
+    paths = [make_collection_file(*chain(2), name=f"{i}.anki2") for i in range(5)]
+    paths.insert(2, make_collection_file(*chain(2), name="crash.anki2"))
+    records = reorder_files(paths, max_workers=2, dry_run=True)
+
+    assert [record.path for record in records] == paths
+    assert [record.error is None for record in records] == [True, True, False, True, True, True]
+    assert records[2].error.startswith("BrokenProcessPool")
+    assert all(record.n_cards == 2 for record in records if record.error is None)
+
+
+def test_cli_with_several_collections(tmp_path, make_collection_file, capsys):
+    paths = [make_collection_file(*chain(2), name="a.anki2"), make_collection_file(*chain(2), name="b.anki2")]
+    assert main([*paths, "--jobs", "2", "--dry-run"]) == 0
+    assert "Processed 2 collections, 0 failed" in capsys.readouterr().out
+    assert main([*paths, str(tmp_path / "missing.anki2"), "--jobs", "2"]) == 1
@@ -0,0 +1,78 @@
+"""Unit tests for ``cache`` module."""
+import pytest
+
+from beyondki import pipeline
+from beyondki.cache import CachedGraph, default_cache_path, load_graph, save_graph, tag_rows_digest
+from beyondki.pipeline import build_tag_group_graph, load_or_build_tag_group_graph, reorder_file
+
+TAG_ROWS = [(1, " a pre:b "), (2, " b "), (3, " c pre:a pre:b ")]
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "collection.beyondki.cache"
+    graph = build_tag_group_graph(TAG_ROWS)
+    save_graph(path, CachedGraph.from_mapping(tag_rows_digest(TAG_ROWS), graph))
+
+    loaded = load_graph(path)
+    assert loaded.digest == tag_rows_digest(TAG_ROWS)
+    assert loaded.to_mapping() == graph
+    assert list(loaded.to_mapping()) == list(graph)
+    loaded.close()
+    assert loaded.buffer is None
+
+
+def test_digest_depends_on_tags():
+    assert tag_rows_digest(TAG_ROWS) == tag_rows_digest(list(TAG_ROWS))
+    assert tag_rows_digest(TAG_ROWS) != tag_rows_digest(TAG_ROWS[:2])
+    assert tag_rows_digest(TAG_ROWS) != tag_rows_digest([*TAG_ROWS[:2], (3, " c pre:a ")])
+
+
+def test_load_missing_file(tmp_path):
+    assert load_graph(tmp_path / "missing.cache") is None
+
+
+def test_load_invalid_file(tmp_path):
+    path = tmp_path / "invalid.cache"
+    path.write_bytes(b"not a cache file")
+    assert load_graph(path) is None
+
+    path.write_bytes(b"")
+    assert load_graph(path) is None
+
+
+def test_load_or_build(tmp_path, monkeypatch):
+    path = tmp_path / "collection.beyondki.cache"
+    graph = load_or_build_tag_group_graph(TAG_ROWS, path)
+    assert graph == build_tag_group_graph(TAG_ROWS)
+    assert load_graph(path).to_mapping() == graph
+
+    def fail(tag_rows):
+        raise AssertionError("rebuilt an up-to-date graph")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pipeline, "build_tag_group_graph", fail)
+        assert load_or_build_tag_group_graph(TAG_ROWS, path) == graph
+
+    # The tags changed, so the graph is rebuilt, but only saved if asked to.
+    tag_rows = [*TAG_ROWS[:2], (3, " c pre:a ")]
+    graph = load_or_build_tag_group_graph(tag_rows, path, save=False)
+    assert graph == build_tag_group_graph(tag_rows)
+    assert load_graph(path).digest == tag_rows_digest(TAG_ROWS)
+
+    loaded = []
+    with monkeypatch.context() as patch:
+        patch.setattr(pipeline, "load_graph", lambda path: loaded.append(load_graph(path)) or loaded[-1])
+        assert load_or_build_tag_group_graph(tag_rows, path) == graph
+    assert load_graph(path).digest == tag_rows_digest(tag_rows)
+    # The outdated file was unmapped before it was replaced.
+    assert loaded[0].buffer is None
+
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_reorder_file_with_cache(make_collection_file, dry_run):
+    path = make_collection_file(["b", "pre:a"], ["a"])
+    result = reorder_file(path, dry_run=dry_run, cache=True)
+    # A dry run writes nothing, not even the cache.
+    assert default_cache_path(path).is_file() != dry_run
+    assert reorder_file(path, dry_run=dry_run, cache=True).ordered_cids == result.ordered_cids
+    assert reorder_file(path, dry_run=True).ordered_cids == result.ordered_cids
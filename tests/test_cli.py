@@ -0,0 +1,39 @@
+"""Unit tests for ``cli`` module."""
+import pytest
+
+from beyondki.cli import build_search, main, plain_text
+
+
+def test_build_search():
+    assert build_search() is None
+    assert build_search("tag:chapter_1") == "(tag:chapter_1)"
+    assert build_search("is:new", "Biology::Cells") == '(is:new) "deck:Biology::Cells"'
+    assert build_search(deck='My "best"_deck*') == '"deck:My \\"best\\"\\_deck\\*"'
+
+
+def test_missing_collection_is_not_created(tmp_path, capsys):
+    path = tmp_path / "collection.anki2"
+    assert main([str(path), "--dry-run"]) == 1
+    assert not path.exists()
+    assert "No collection" in capsys.readouterr().err
+
+
+def test_invalid_search_is_reported(make_collection_file, capsys):
+    path = make_collection_file()
+    assert main([path, "--search", "deck:("]) == 1
+    error = capsys.readouterr().err
+    assert error.startswith("beyondki: Invalid search") and "<" not in error
+
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_invalid_collection_is_reported(tmp_path, capsys, dry_run):
+    # A dry run reads the file with sqlite3, otherwise it is opened by Anki.
+    path = tmp_path / "collection.anki2"
+    path.write_bytes(b"not a collection" * 1024)
+    assert main([str(path), *(["--dry-run"] if dry_run else [])]) == 1
+    error = capsys.readouterr().err
+    assert error.startswith(f"beyondki: {path}: ") and "not a database" in error
+
+
+def test_plain_text():
+    assert plain_text("<p>Invalid: ⁨<code>(...)</code>⁩ &amp; more</p>") == "Invalid: (...) & more"
@@ -0,0 +1,33 @@
+"""Unit tests for ``cycles`` module."""
+from beyondki.cycles import break_loops, find_loops, strongly_connected_components
+
+
+def test_strongly_connected_components():
+    components = strongly_connected_components([[1], [2], [0], [2], []])
+    assert sorted(sorted(component) for component in components) == [[0, 1, 2], [3], [4]]
+
+
+def test_deep_graph():
+    n_nodes = 100_000
+    components = strongly_connected_components([[i + 1] for i in range(n_nodes - 1)] + [[0]])
+    assert len(components) == 1
+
+
+def test_find_loops_excludes_dependents():
+    # 1 and 2 form a loop; 3 depends on the loop but is not part of it; 4 requires itself.
+    graph = {1: [2], 2: [1], 3: [1], 4: [4], 5: []}
+    assert find_loops(graph) == [[1, 2], [4]]
+
+
+def test_find_loops_without_loops():
+    assert find_loops({1: [], 2: [1], 3: [1, 2]}) == []
+
+
+def test_break_loops_keeps_earlier_prereqs():
+    graph = {1: [3], 2: [1], 3: [2], 4: [3]}
+    assert break_loops(graph, find_loops(graph)) == {1: [], 2: [1], 3: [2], 4: [3]}
+
+
+def test_break_loops_with_positions():
+    graph = {1: [2], 2: [1]}
+    assert break_loops(graph, [[1, 2]], {1: 1, 2: 0}) == {1: [2], 2: []}
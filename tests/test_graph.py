@@ -0,0 +1,134 @@
+"""Unit tests for ``graph`` module."""
+import json
+
+import pytest
+
+from beyondki.graph import CompactCardGraph
+from beyondki.sorting import generate_card_graphs_from_mappings, sort_compact_graph, sort_from_mappings, \
+    sort_graphs, sort_with_groups, GroupSortStream, GroupSortStreamState, PrerequisiteLoopError, SortStreamState, \
+    SortStream
+
+
+def test_from_mappings_is_in_secondary_order():
+    graph = CompactCardGraph.from_mappings([3, 1, 2], {3: [1, 2], 2: [1]}, {1: 0, 2: 1, 3: 2})
+    assert list(graph.cids) == [1, 2, 3]
+    assert list(graph.offsets) == [0, 0, 1, 3]
+    assert list(graph.targets) == [0, 0, 1]
+    assert graph.n_edges == 3
+    assert graph.index_of(3) == 2
+
+
+def test_round_trip_with_card_graphs():
+    prereqs = {1: [], 2: [1], 3: [1, 2], 4: [2]}
+    positions = {1: 3, 2: 1, 3: 0, 4: 2}
+    requirement_graph, dependents_graph = generate_card_graphs_from_mappings([1, 2, 3, 4], prereqs, positions)
+
+    graph = CompactCardGraph.from_card_graphs(requirement_graph)
+    assert graph.to_card_graphs() == (requirement_graph, dependents_graph)
+    assert list(graph.to_card_graphs()[1].keys()) == list(dependents_graph.keys())
+
+
+def test_transpose():
+    graph = CompactCardGraph.from_mappings([1, 2, 3], {2: [1], 3: [1, 2]}, [1, 2, 3])
+    dependents = graph.transpose()
+    assert [list(dependents[i]) for i in range(3)] == [[1, 2], [2], []]
+    assert list(dependents.degrees()) == [2, 1, 0]
+
+
+def test_nonexistent_prereq():
+    with pytest.raises(ValueError):
+        CompactCardGraph.from_mappings([1], {1: [2]}, [1])
+
+
+def test_sort_compact_graph_matches_sort_graphs():
+    cids = list(range(1, 21))
+    prereqs = {cid: [p for p in range(1, cid) if (cid * p) % 7 == 1] for cid in cids}
+    positions = {cid: (cid * 13) % 21 for cid in cids}
+
+    expected = sort_graphs(*generate_card_graphs_from_mappings(cids, prereqs, positions))
+    assert sort_compact_graph(CompactCardGraph.from_mappings(cids, prereqs, positions)) == expected
+
+
+def test_sort_compact_graph_loop_raises_error():
+    graph = CompactCardGraph.from_mappings([1, 2], {1: [2], 2: [1]}, [1, 2])
+    with pytest.raises(PrerequisiteLoopError):
+        sort_compact_graph(graph)
+
+
+def test_sort_compact_graph_break_loops():
+    cids = [1, 2, 3, 4]
+    prereqs = {1: [2], 2: [1], 3: [1], 4: [4]}
+    graph = CompactCardGraph.from_mappings(cids, prereqs, [-cid for cid in cids])
+    expected = sort_graphs(*generate_card_graphs_from_mappings(cids, prereqs, [-cid for cid in cids]),
+                           break_loops=True)
+    assert sort_compact_graph(graph, break_loops=True) == expected
+
+
+def test_sort_compact_graph_loop_error_lists_only_loops():
+    graph = CompactCardGraph.from_mappings([1, 2, 3], {1: [2], 2: [1], 3: [2]}, [1, 2, 3])
+    with pytest.raises(PrerequisiteLoopError) as error:
+        sort_compact_graph(graph)
+    assert error.value.loops == [[1, 2]]
+
+
+def test_sort_stream_takes_and_resumes():
+    cids = list(range(1, 41))
+    prereqs = {cid: [p for p in range(1, cid) if (cid * p) % 11 == 1] for cid in cids}
+    graph = CompactCardGraph.from_mappings(cids, prereqs, {cid: (cid * 17) % 41 for cid in cids})
+    expected = sort_compact_graph(graph)
+
+    stream = SortStream(graph)
+    ordered_cids = stream.take(5)
+    while len(ordered_cids) < len(cids):
+        state = SortStreamState.from_json(stream.state().to_json())
+        stream = SortStream(graph, state=state)
+        ordered_cids += stream.take(3)
+    assert ordered_cids == expected
+    assert stream.take(3) == []
+    assert list(SortStream(graph)) == expected
+
+
+def test_sort_stream_returns_cards_before_loop_error():
+    graph = CompactCardGraph.from_mappings([1, 2, 3], {2: [3], 3: [2]}, [1, 2, 3])
+    stream = SortStream(graph)
+    assert stream.take(5) == [1]
+    with pytest.raises(PrerequisiteLoopError):
+        stream.take(5)
+    assert list(SortStream(graph, break_loops=True)) == sort_compact_graph(graph, break_loops=True)
+
+
+def test_sort_stream_state_must_match_graph():
+    state = SortStream(CompactCardGraph.from_mappings([1, 2], {}, [1, 2])).state()
+    with pytest.raises(ValueError):
+        SortStream(CompactCardGraph.from_mappings([1], {}, [1]), state=state)
+
+
+def test_group_sort_stream_takes_and_resumes():
+    cids = list(range(1, 41))
+    # The members of the groups come before the cards that require them.
+    groups = {-1 - g: [cid for cid in range(1, 21) if cid % (g + 2) == 1] for g in range(4)}
+    prereqs = {cid: [p for p in range(1, cid) if (cid * p) % 13 == 1] +
+               [g for g in groups if cid > 20 and (cid + g) % 3 == 0] for cid in cids}
+    positions = {cid: (cid * 17) % 41 for cid in cids}
+    expanded = {cid: sorted({m for p in ps for m in (groups[p] if p < 0 else [p])}) for cid, ps in prereqs.items()}
+    expected = sort_from_mappings(cids, expanded, positions)
+    assert sort_with_groups(cids, prereqs, positions, groups) == expected
+
+    stream = GroupSortStream(cids, prereqs, positions, groups)
+    ordered_cids = stream.take(5)
+    while len(ordered_cids) < len(cids):
+        state = GroupSortStreamState.from_json(json.loads(json.dumps(stream.state().to_json())))
+        stream = GroupSortStream(cids, prereqs, positions, groups, state=state)
+        ordered_cids += stream.take(1)
+    assert ordered_cids == expected
+    assert stream.take(3) == []
+
+
+def test_group_sort_stream_loops():
+    stream = GroupSortStream([1, 2, 3], {2: [-1], 3: [2]}, [1, 2, 3], {-1: [1, 3]})
+    assert stream.take(5) == [1]
+    with pytest.raises(PrerequisiteLoopError) as error:
+        stream.take(5)
+    assert error.value.loops == [[2, 3]]
+    with pytest.raises(ValueError):
+        GroupSortStream([1, 2], {}, [1, 2], {-1: [1]}, state=stream.state())
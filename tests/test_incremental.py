@@ -0,0 +1,132 @@
+"""Unit tests for ``incremental`` module."""
+import pytest
+
+from beyondki.cli import main
+from beyondki.incremental import SortState, default_state_path, incremental_reorder, update_state
+from beyondki.pipeline import build_tag_group_graph, sort_collection
+from beyondki.writeback import new_card_dues
+
+TAGS = {1: " chapter_1 ", 2: " chapter_2 pre:chapter_1 ", 3: " pre:chapter_2 ", 4: " other "}
+
+
+def make_state():
+    state = SortState()
+    update_state(state, {1: 100, 2: 100, 3: 100, 4: 100}, TAGS)
+    return state
+
+
+def test_first_update_builds_tag_group_graph():
+    state = make_state()
+    assert state.graph() == build_tag_group_graph(TAGS.items())
+    assert state.graph() == {-1: [1], -2: [2], 1: [], 2: [-1], 3: [-2], 4: []}
+
+
+def test_only_affected_groups_are_resolved():
+    state = make_state()
+    # Note 4 is retagged into chapter 1, which only affects the group of chapter 1.
+    resolved_tags = update_state(state, {1: 100, 2: 100, 3: 100, 4: 101}, {4: " chapter_1 "})
+    assert resolved_tags == ["chapter_1"]
+    assert state.group_nids == {-1: [1, 4], -2: [2]}
+
+    # Note 4 now requires a new tag.
+    resolved_tags = update_state(state, {1: 100, 2: 100, 3: 100, 4: 102}, {4: " chapter_1 pre:chapter_2 "})
+    assert resolved_tags == ["chapter_1"]
+    assert state.note_groups[4] == [-2]
+
+
+def test_deleted_notes_are_removed():
+    state = make_state()
+    resolved_tags = update_state(state, {2: 100, 3: 100, 4: 100}, {})
+    assert resolved_tags == ["chapter_1"]
+    assert state.graph() == {-1: [], -2: [2], 2: [-1], 3: [-2], 4: []}
+    assert 1 not in state.note_tags
+
+    # No note requires chapter 1 any more.
+    update_state(state, {3: 100, 4: 100}, {})
+    assert state.graph() == {-2: [], 3: [-2], 4: []}
+    assert state.group_ids == {"chapter_2": -2}
+
+
+def test_save_and_load(tmp_path):
+    state = make_state()
+    state.snapshot_time = 1234
+    state.ordered_cids = [10, 20, 30]
+    path = tmp_path / "collection.beyondki.json"
+    state.save(path)
+    assert SortState.load(path) == state
+
+
+def test_load_missing_file(tmp_path):
+    assert SortState.load(tmp_path / "missing.json") == SortState()
+
+
+@pytest.fixture
+def col(make_collection):
+    # The first note requires the second one.
+    return make_collection(["b", "pre:a"], ["a"])
+
+
+def test_incremental_reorder_moves_few_cards(col, add_note):
+    result = incremental_reorder(col)
+    assert result.n_repositioned > 0
+    dues = new_card_dues(col)
+    assert dues[result.ordered_cids[0]] < dues[result.ordered_cids[1]]
+
+    # A new note without prerequisites already comes last.
+    note = add_note(col, ["c"])
+    result = incremental_reorder(col)
+    assert result.changed_nids[-1] == note.id
+    assert result.ordered_cids[-1] == note.card_ids()[0]
+    assert result.n_repositioned == 0
+    assert {cid: due for cid, due in new_card_dues(col).items() if cid in dues} == dues
+
+
+def test_incremental_and_full_sorts_agree(make_collection, add_note):
+    col = make_collection()
+    first = add_note(col, ["x"])
+    add_note(col, ["pre:b"])
+    last = add_note(col, ["a", "b"])
+    assert incremental_reorder(col).ordered_cids == sort_collection(col)
+
+    # The tag group of pre:a is created after that of pre:b, although the first note requires it.
+    first.tags = ["pre:a"]
+    col.update_note(first)
+    assert incremental_reorder(col).ordered_cids == sort_collection(col)
+
+    add_note(col, ["c", "pre:a"])
+    col.remove_notes([last.id])
+    assert incremental_reorder(col).ordered_cids == sort_collection(col)
+    add_note(col, ["a", "pre:b"])
+    assert incremental_reorder(col).ordered_cids == sort_collection(col)
+
+
+def test_edit_in_same_second_as_snapshot_is_found(col):
+    incremental_reorder(col)
+    path = default_state_path(col.path)
+    state = SortState.load(path)
+    # Change the tags without changing the modification time, as an edit in the second of the last read.
+    nid, mod = col.db.first("select id, mod from notes where tags like '%pre:a%'")
+    col.db.execute("update notes set tags = ' b ' where id = ?", nid)
+    state.snapshot_time = mod
+    state.save(path)
+
+    result = incremental_reorder(col)
+    assert nid in result.changed_nids
+    assert SortState.load(path).note_groups[nid] == []
+
+    # Notes that were modified before the last read are not read again.
+    state = SortState.load(path)
+    state.snapshot_time = mod + 1
+    state.save(path)
+    assert incremental_reorder(col).changed_nids == []
+
+
+def test_cli_incremental(col, capsys):
+    path = col.path
+    col.close()
+    assert main([path, "--incremental"]) == 0
+    assert default_state_path(path).is_file()
+    assert "Repositioned" in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        main([path, "--incremental", "--deck", "Default"])
+    col.reopen()
@@ -0,0 +1,67 @@
+"""Unit tests for ``ordering`` module."""
+from array import array
+
+import pytest
+
+from beyondki.graph import INT64
+from beyondki.ordering import needs_order_columns, note_positions, parse_order
+from beyondki.reader import CollectionData
+
+
+@pytest.fixture
+def data():
+    # Notes 1 and 3 are in deck 20 ("a"), note 2 is in deck 10 ("B"). Card 31 is not new.
+    return CollectionData(nids=array(INT64, [3, 1, 2]),
+                          tags=["", "", ""],
+                          cids=array(INT64, [10, 20, 21, 30, 31]),
+                          card_nids=array(INT64, [1, 2, 2, 3, 3]),
+                          card_types=array(INT64, [0, 0, 0, 0, 2]),
+                          card_dues=array(INT64, [7, 9, 2, 5, 0]),
+                          sort_fields=["b", 10, "A"],
+                          card_dids=array(INT64, [20, 10, 20, 20, 20]),
+                          deck_names={10: "B", 20: "a"})
+
+
+def order_of(positions):
+    return sorted(positions, key=positions.__getitem__)
+
+
+def test_single_keys(data):
+    assert order_of(note_positions(data, ["nid"])) == [1, 2, 3]
+    assert order_of(note_positions(data, ["due"])) == [2, 3, 1]
+    assert order_of(note_positions(data, ["deck"])) == [1, 3, 2]
+
+
+def test_field_order_puts_numbers_first(data):
+    # Note 1 has the number 10, note 3 "b" and note 2 "A".
+    assert order_of(note_positions(data, "field")) == [1, 2, 3]
+
+
+def test_composite_keys_break_ties_in_order(data):
+    assert order_of(note_positions(data, ["deck", "due"])) == [3, 1, 2]
+    assert order_of(note_positions(data, "deck random:1")) in ([1, 3, 2], [3, 1, 2])
+
+
+def test_random_order_depends_only_on_seed(data):
+    assert note_positions(data, ["random:5"]) == note_positions(data, ["random:5"])
+    assert sorted(note_positions(data, ["random"]).values()) == [0, 1, 2]
+
+
+def test_callable_fallback(data):
+    assert order_of(note_positions(data, lambda nid: -nid)) == [3, 2, 1]
+
+
+def test_parse_order():
+    assert parse_order("deck random:3") == ["deck", "random:3"]
+    with pytest.raises(ValueError):
+        parse_order(["color"])
+    with pytest.raises(ValueError):
+        parse_order(["nid:3"])
+    assert needs_order_columns(["due", "field"])
+    assert not needs_order_columns(["due", "random"])
+
+
+def test_columns_must_be_read(data):
+    data.deck_names = data.card_dids = data.sort_fields = None
+    with pytest.raises(ValueError):
+        note_positions(data, ["deck"])
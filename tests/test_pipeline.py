@@ -0,0 +1,205 @@
+"""Unit tests for ``pipeline`` module."""
+import random
+
+import pytest
+
+from beyondki.pipeline import CardStream, CardStreamState, build_note_prereqs_graph, build_tag_group_graph, \
+    check_note_loops, expand_tag_groups, expand_to_cards, reduce_note_graph, reorder_collection, reorder_file, \
+    sort_card_graph, sort_collection, sort_note_graph, stream_collection
+from beyondki.prerequisites import PREFIX
+from beyondki.writeback import new_card_dues
+from beyondki.sorting import PrerequisiteLoopError, sort_from_mappings
+
+TAG_ROWS = [
+    (1, " chapter_1 pre:chapter_3 "),
+    (2, " chapter_2 pre:chapter_1 other "),
+    (3, " chapter_3 pre:chapter_2 pre:other "),
+    (4, " chapter_4 pre:chapter_3 "),
+]
+
+
+def test_build_note_prereqs_graph():
+    assert build_note_prereqs_graph(TAG_ROWS) == {1: [3], 2: [1], 3: [2], 4: [3]}
+
+
+def test_build_tag_group_graph():
+    graph = build_tag_group_graph(TAG_ROWS)
+    assert graph == {-1: [3], -2: [1], -3: [2], -4: [2], 1: [-1], 2: [-2], 3: [-3, -4], 4: [-1]}
+    assert list(graph)[:4] == [-1, -2, -3, -4]
+    assert expand_tag_groups(graph) == build_note_prereqs_graph(TAG_ROWS)
+
+
+def test_tag_group_graph_has_one_edge_per_member_and_dependent():
+    tag_rows = [(nid, " chapter_1 ") for nid in range(1, 51)] + \
+               [(nid, " chapter_2 pre:chapter_1 ") for nid in range(51, 101)]
+    assert sum(map(len, build_note_prereqs_graph(tag_rows).values())) == 50 * 50
+    assert sum(map(len, build_tag_group_graph(tag_rows).values())) == 50 + 50
+
+
+def test_sort_tag_group_graph_emits_only_cards():
+    tag_rows = [(1, " pre:b "), (2, " a "), (3, " b pre:a "), (4, " pre:missing ")]
+    cids_by_note = {1: [10, 11], 2: [20], 3: [30], 4: [40]}
+    graph = build_tag_group_graph(tag_rows)
+    assert sort_note_graph(graph, cids_by_note) == [20, 30, 10, 11, 40]
+    assert sort_card_graph(expand_to_cards(graph, cids_by_note)) == [20, 30, 10, 11, 40]
+
+
+def test_sort_tag_group_graph_by_positions():
+    tag_rows = [(1, " pre:b "), (2, " a "), (3, " b pre:a "), (4, " pre:missing ")]
+    cids_by_note = {1: [10, 11], 2: [20], 3: [30], 4: [40]}
+    positions = {1: 3, 2: 2, 3: 1, 4: 0}
+    assert sort_note_graph(build_tag_group_graph(tag_rows), cids_by_note, positions=positions) == [40, 20, 30, 10, 11]
+
+
+def test_tag_groups_do_not_change_the_order():
+    # The tag of the group of the first note comes second in the secondary order.
+    tag_rows = [(1, " pre:b "), (2, " pre:a "), (3, " a b ")]
+    cids_by_note = {1: [11], 2: [12], 3: [13]}
+    graph = build_tag_group_graph(tag_rows)
+    assert sort_note_graph(graph, cids_by_note) == sort_note_graph(expand_tag_groups(graph), cids_by_note) == \
+        [13, 11, 12]
+
+
+def assert_sorted_like_expanded_graph(tag_rows, positions=None):
+    graph = check_note_loops(build_tag_group_graph(tag_rows), tag_rows, break_loops=True, positions=positions)
+    cids_by_note = {nid: [10 * nid] for nid, _ in tag_rows}
+    nids = list(cids_by_note)
+    expected = sort_from_mappings(nids, expand_tag_groups(graph), nids if positions is None else positions)
+    assert sort_note_graph(graph, cids_by_note, positions=positions) == [10 * nid for nid in expected]
+    assert sort_note_graph(graph, cids_by_note, positions=positions, reduce=True) == [10 * nid for nid in expected]
+
+
+def test_tag_group_completed_during_walk_of_member():
+    # Note 10 requires group t4, whose members are added in the walk of note 4, which is a member of
+    # group t1* as well, so that the walk of note 4 is paused before it reaches note 10 through it.
+    tag_rows = [(1, " pre:t1 pre:t0 pre:t1* "), (2, " t2 pre:t1* "), (3, " pre:t3 pre:t4 pre:t6 pre:t1* "),
+                (4, " t4 t5 t3 pre:t1* "), (5, " t2 "), (6, " t1 t7 t3 pre:t3 pre:t1 "), (7, " pre:t2 pre:t6 pre:t7 "),
+                (8, " t0 t7 t5 pre:t4 pre:t2 "), (9, " t7 t6 t5 "), (10, " t6 t0 t4 pre:t4 "), (11, " t6 t3 t1 ")]
+    assert_sorted_like_expanded_graph(tag_rows)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_tag_groups_sort_like_expanded_graph(seed):
+    rng = random.Random(seed)
+    tags = [f"t{i}" for i in range(8)]
+    for _ in range(200):
+        n_notes = rng.randint(1, 60)
+        tag_rows = []
+        for nid in range(1, n_notes + 1):
+            prereq_tags = rng.sample(tags, rng.randint(0, 3)) + ["t1*"] * (rng.random() < 0.2)
+            tag_rows.append((nid, " ".join(["", *rng.sample(tags, rng.randint(0, 3)),
+                                            *(PREFIX + tag for tag in prereq_tags), ""])))
+        positions = dict(zip(range(1, n_notes + 1), rng.sample(range(n_notes), n_notes)))
+        assert_sorted_like_expanded_graph(tag_rows, positions if rng.random() < 0.7 else None)
+
+
+def test_reduce_note_graph():
+    graph = build_tag_group_graph([(3, " pre:a pre:b "), (1, " a "), (2, " b pre:a ")])
+    assert reduce_note_graph(graph) == {1: [], 2: [1], 3: [2]}
+    assert list(reduce_note_graph(graph, positions={1: 2, 2: 1, 3: 0})) == [3, 2, 1]
+
+
+def test_expand_to_cards():
+    cids_by_note = {1: [10, 11], 2: [20]}
+    assert expand_to_cards({1: [], 2: [1]}, cids_by_note) == {10: [], 11: [], 20: [10, 11]}
+
+
+def test_check_note_loops_reports_notes_and_tags():
+    with pytest.raises(PrerequisiteLoopError) as error:
+        check_note_loops(build_note_prereqs_graph(TAG_ROWS), TAG_ROWS)
+
+    assert error.value.loops == [[1, 2, 3]]
+    [loop] = error.value.note_loops
+    assert loop.nids == [1, 2, 3]
+    assert loop.tags == {1: ["chapter_3"], 2: ["chapter_1"], 3: ["chapter_2", "other"]}
+    assert "pre:chapter_3" in str(error.value)
+
+
+def test_check_note_loops_with_tag_groups():
+    with pytest.raises(PrerequisiteLoopError) as error:
+        check_note_loops(build_tag_group_graph(TAG_ROWS), TAG_ROWS)
+    # The tag groups in the loop are left out.
+    assert error.value.loops == [[1, 2, 3]]
+    assert [loop.nids for loop in error.value.note_loops] == [[1, 2, 3]]
+
+    graph = check_note_loops(build_tag_group_graph(TAG_ROWS), TAG_ROWS, break_loops=True)
+    assert graph == {1: [], 2: [1], 3: [2], 4: [3]}
+
+
+def test_break_loops_only_expands_tag_groups_in_loops():
+    # The tag group of chapter_4 is not in the loop, so it is kept.
+    tag_rows = TAG_ROWS + [(5, " pre:chapter_4 ")]
+    graph = check_note_loops(build_tag_group_graph(tag_rows), tag_rows, break_loops=True)
+    assert graph == {-5: [4], 1: [], 2: [1], 3: [2], 4: [3], 5: [-5]}
+
+    # Within the loop, each note keeps the prerequisites that come before it in the secondary order.
+    positions = {1: 2, 2: 1, 3: 0, 4: 3, 5: 4}
+    graph = check_note_loops(build_tag_group_graph(tag_rows), tag_rows, break_loops=True, positions=positions)
+    assert graph == {-5: [4], 1: [3], 2: [], 3: [], 4: [3], 5: [-5]}
+
+
+def test_check_note_loops_break_loops():
+    graph = check_note_loops(build_note_prereqs_graph(TAG_ROWS), TAG_ROWS, break_loops=True)
+    assert graph == {1: [], 2: [1], 3: [2], 4: [3]}
+
+
+def test_sort_note_graph_keeps_siblings_together():
+    note_prereqs_graph = {1: [3], 2: [], 3: []}
+    cids_by_note = {1: [10, 40], 2: [20], 3: [30, 31]}
+    assert sort_note_graph(note_prereqs_graph, cids_by_note) == [20, 30, 31, 10, 40]
+    assert sort_note_graph(note_prereqs_graph, cids_by_note, sibling_key=lambda cid: -cid) == \
+        [20, 31, 30, 40, 10]
+
+
+def test_sort_note_graph_satisfies_card_constraints():
+    note_prereqs_graph = {nid: [p for p in range(1, nid) if (nid + p) % 3 == 0] for nid in range(1, 30)}
+    cids_by_note = {nid: [100 * nid + k for k in range(nid % 4 + 1)] for nid in note_prereqs_graph}
+    card_prereqs_graph = expand_to_cards(note_prereqs_graph, cids_by_note)
+
+    ordered_cids = sort_note_graph(note_prereqs_graph, cids_by_note)
+    assert sorted(ordered_cids) == sorted(sort_card_graph(card_prereqs_graph))
+    position = {cid: i for i, cid in enumerate(ordered_cids)}
+    for cid, prereq_cids in card_prereqs_graph.items():
+        assert all(position[prereq_cid] < position[cid] for prereq_cid in prereq_cids)
+
+
+def test_card_stream_takes_and_resumes():
+    tag_rows = [(1, " pre:b "), (2, " a "), (3, " b pre:a "), (4, " pre:missing "), (5, " a ")]
+    cids_by_note = {1: [10, 11], 2: [20, 21, 22], 3: [30], 4: [40], 5: [50, 51]}
+    graph = build_tag_group_graph(tag_rows)
+    expected = sort_note_graph(graph, cids_by_note)
+
+    stream = CardStream(graph, cids_by_note)
+    # The second take stops between the cards of a note.
+    cids = stream.take(1) + stream.take(2)
+    state = CardStreamState.from_json(stream.state().to_json())
+    cids += [next(stream), *stream.rest()]
+    assert cids == expected
+    assert stream.take(1) == []
+
+    resumed = CardStream(graph, cids_by_note, state=state)
+    assert expected[:3] + resumed.rest() == expected
+
+
+def test_sort_cards_matching_search(make_collection, add_note):
+    col = make_collection()
+    scoped_did = col.decks.id("Scoped")
+    # The last note is outside of the search, and is a prerequisite of the second one.
+    cids = []
+    for tags, did in ((["c", "pre:b"], scoped_did), (["b", "pre:a"], scoped_did), (["a"], 1)):
+        cids.extend(add_note(col, tags, did).card_ids())
+    dues = new_card_dues(col)
+    assert sort_collection(col, search="deck:Scoped") == [cids[1], cids[0]]
+    assert stream_collection(col, search="deck:Scoped").take(1) == [cids[1]]
+    assert stream_collection(col).rest() == sort_collection(col) == sort_collection(col, reduce=True)
+    assert reorder_collection(col, search="deck:Scoped") == 2
+    new_dues = new_card_dues(col)
+    assert (new_dues[cids[1]], new_dues[cids[0]]) == (dues[cids[0]], dues[cids[1]])
+    assert new_dues[cids[2]] == dues[cids[2]]
+
+
+def test_reorder_file_reports_top_level_stages(make_collection_file):
+    path = make_collection_file(["a"])
+    # The graph and sort stages of ``sort_collection_data`` are top-level stages of ``reorder_file``.
+    assert list(reorder_file(path).timings) == ["open", "read", "graph", "sort", "diff", "write", "close"]
+    assert list(reorder_file(path, dry_run=True).timings) == ["open", "read", "graph", "sort", "diff", "close"]
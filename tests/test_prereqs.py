@@ -12,3 +12,23 @@ def test_extract_prerequisite_tags():
     assert pre.extract_prerequisite_tags("pre:a b") == ["a"]
     assert pre.extract_prerequisite_tags("pre:a pre:b") == ["a", "b"]
     assert pre.extract_prerequisite_tags(" pre:a ") == ["a"]
+
+
+def test_extract_prerequisite_tags_bulk():
+    """Does the bulk parser agree with ``extract_prerequisite_tags``?"""
+    rows = [(1, ""), (2, " a b "), (3, " pre:a b "), (4, "pre:a pre:b"), (5, " pre:a ")]
+    assert pre.extract_prerequisite_tags_bulk(rows) == \
+        {key: pre.extract_prerequisite_tags(tags) for key, tags in rows}
+
+
+def test_extract_prerequisite_tags_bulk_interns_tags():
+    """Do repeated prerequisites share a single string?"""
+    rows = [(1, " x pre:" + "chapter_1"), (2, " pre:" + "chapter_1 ")]
+    prerequisites = pre.extract_prerequisite_tags_bulk(rows)
+    assert prerequisites[1][0] is prerequisites[2][0]
+
+
+def test_extract_prerequisite_tags_bulk_custom_prefix_and_delim():
+    """Are custom prefixes and delimiters supported?"""
+    rows = [(1, "req=a,b,req=c")]
+    assert pre.extract_prerequisite_tags_bulk(rows, prefix="req=", delim=",") == {1: ["a", "c"]}
@@ -0,0 +1,53 @@
+"""Unit tests for ``profiling`` module."""
+import json
+
+from beyondki import profiling
+from beyondki.pipeline import build_tag_group_graph, sort_note_graph
+from beyondki.profiling import Profiler, active_profiler
+
+
+def test_hooks_do_nothing_without_a_profiler():
+    assert active_profiler() is None
+    with profiling.stage("stage"):
+        profiling.count(nodes=1)
+        profiling.count_graph({1: [2]})
+
+
+def test_nested_stages_and_callbacks():
+    records = []
+    with Profiler(callbacks=[records.append]) as profiler:
+        assert active_profiler() is profiler
+        for _ in range(2):
+            with profiling.stage("outer"):
+                profiling.count(nodes=3)
+                with profiling.stage("inner"):
+                    profiling.count_graph({1: [2, 3], 2: []})
+    assert active_profiler() is None
+
+    assert [(record.name, record.depth) for record in records] == [("inner", 1), ("outer", 0)] * 2
+    outer, inner = profiler.stages.values()
+    assert (outer.name, outer.calls, outer.counts) == ("outer", 2, {"nodes": 6})
+    assert (inner.name, inner.depth, inner.counts) == ("inner", 1, {"nodes": 4, "edges": 4})
+    assert outer.seconds >= inner.seconds
+    assert outer.peak_bytes is None
+
+
+def test_peak_memory():
+    with Profiler(memory=True) as profiler:
+        with profiling.stage("outer"):
+            with profiling.stage("allocate"):
+                data = bytearray(1_000_000)
+            del data
+    outer, allocate = profiler.stages.values()
+    assert allocate.peak_bytes >= 1_000_000
+    assert outer.peak_bytes >= allocate.peak_bytes
+
+
+def test_library_stages():
+    tag_rows = [(1, " a "), (2, " pre:a ")]
+    with Profiler() as profiler:
+        sort_note_graph(build_tag_group_graph(tag_rows), {1: [10], 2: [20]})
+    assert list(profiler.stages) == ["parse_tags", "resolve_tags", "sort_note_graph", "sort_with_groups"]
+    assert profiler.stages["sort_with_groups"].counts == {"nodes": 2, "groups": 1}
+    assert "resolve_tags" in profiler.summary()
+    assert json.loads(json.dumps(profiler.to_json()))[0]["stage"] == "parse_tags"
@@ -0,0 +1,59 @@
+"""Unit tests for ``reader`` module."""
+import sqlite3
+
+import pytest
+
+from beyondki.reader import CollectionData, open_read_only
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "collection.anki2"
+    connection = sqlite3.connect(path)
+    connection.execute("create table notes (id integer primary key, tags text, sfld integer)")
+    connection.execute("create table cards (id integer primary key, nid integer, ord integer, type integer, "
+                       "due integer, did integer)")
+    connection.execute("create table decks (id integer primary key, name text)")
+    connection.executemany("insert into notes values (?, ?, ?)", [(1, " a ", "b"), (2, " pre:a ", "12"), (3, "", "a")])
+    # Card 22 is not new.
+    connection.executemany("insert into cards values (?, ?, ?, ?, ?, ?)",
+                           [(21, 2, 1, 0, 5, 1), (20, 2, 0, 0, 4, 2), (10, 1, 0, 0, 3, 1), (22, 2, 2, 2, 100, 1)])
+    connection.executemany("insert into decks values (?, ?)", [(1, "Default"), (2, "A\x1fB")])
+    connection.commit()
+    connection.close()
+    connection = open_read_only(path)
+    yield connection
+    connection.close()
+
+
+def test_read(db):
+    data = CollectionData.read(db)
+    assert data.tag_rows() == [(1, " a "), (2, " pre:a "), (3, "")]
+    assert list(data.cids) == [10, 20, 21, 22]
+    assert data.cards_by_note() == {1: [10], 2: [20, 21, 22]}
+    assert data.new_card_dues() == {10: 3, 20: 4, 21: 5}
+    assert data.sort_fields is None and data.card_dids is None and data.deck_names is None
+
+
+def test_read_order_columns(db):
+    data = CollectionData.read(db, order_columns=True)
+    assert data.sort_fields == ["b", 12, "a"]
+    assert list(data.card_dids) == [1, 2, 1, 1]
+    assert data.deck_names == {1: "Default", 2: "A\x1fB"}
+
+
+def test_read_cards(db):
+    data = CollectionData.read(db, [21, 22])
+    assert data.tag_rows() == [(2, " pre:a ")]
+    assert data.cards_by_note() == {2: [21, 22]}
+
+
+def test_read_no_cards(db):
+    data = CollectionData.read(db, [])
+    assert data.tag_rows() == []
+    assert data.cards_by_note() == {}
+
+
+def test_read_only(db):
+    with pytest.raises(sqlite3.OperationalError):
+        db.execute("delete from notes")
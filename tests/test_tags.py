@@ -0,0 +1,66 @@
+"""Unit tests for ``tags`` module."""
+from beyondki.tags import TagIndex
+
+ROWS = [
+    (1, " chapter_1 "),
+    (2, " chapter_2 pre:chapter_1 "),
+    (3, " Chapter_3 pre:chapter_1 pre:chapter_2 "),
+    (4, " math::algebra math::algebra::groups "),
+    (5, " math::geometry pre:math::algebra "),
+    (6, ""),
+]
+
+
+def test_find_exact_tag():
+    index = TagIndex(ROWS)
+    assert index.find_notes("chapter_2") == [2]
+    assert index.find_notes("missing") == []
+
+
+def test_find_is_case_insensitive():
+    index = TagIndex(ROWS)
+    assert index.find_notes("CHAPTER_3") == [3]
+
+
+def test_find_includes_child_tags():
+    index = TagIndex(ROWS)
+    assert index.find_notes("math") == [4, 5]
+    assert index.find_notes("math::algebra") == [4]
+    assert index.find_notes("math::alg") == []
+
+
+def test_find_with_wildcards():
+    index = TagIndex(ROWS)
+    assert index.find_notes("chapter*") == [1, 2, 3]
+    assert index.find_notes("chapter_*") == [1, 2, 3]
+    assert index.find_notes("ma*::geo*") == [5]
+    assert index.find_notes("pre:*") == [2, 3, 5]
+
+
+def test_underscore_matches_single_character():
+    index = TagIndex([(1, "chapter_1"), (2, "chapterX1"), (3, "chapter11x")])
+    assert index.find_notes("chapter_1") == [1, 2]
+
+
+def test_resolve():
+    index = TagIndex(ROWS)
+    note_prereq_tags = {1: [], 2: ["chapter_1"], 3: ["chapter_1", "chapter_2"], 5: ["math::algebra"]}
+    assert index.resolve(note_prereq_tags) == {1: [], 2: [1], 3: [1, 2], 5: [4]}
+
+
+def test_special_searches():
+    index = TagIndex(ROWS)
+    assert index.find_notes("*") == [1, 2, 3, 4, 5, 6]
+    assert index.find_notes("none") == [6]
+
+
+def test_add_and_discard():
+    index = TagIndex(ROWS)
+    assert index.find_notes("chapter_1") == [1]
+    index.discard(1, " chapter_1 ")
+    assert index.find_notes("chapter_1") == []
+    assert index.find_notes("none") == [6]
+    index.add(1, " chapter_1 math::extra ")
+    assert index.find_notes("chapter_1") == [1]
+    assert index.find_notes("math") == [1, 4, 5]
+    assert 1 not in index.find_notes("none")
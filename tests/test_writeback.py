@@ -0,0 +1,57 @@
+"""Unit tests for ``writeback`` module."""
+from beyondki.writeback import _longest_non_decreasing_subsequence, compute_changes, compute_due_changes, \
+    compute_minimal_changes, compute_slot_changes
+
+
+def test_only_changed_positions_are_returned():
+    current_dues = {10: 0, 20: 5, 30: 2}
+    assert compute_due_changes([10, 30, 20], current_dues) == [(30, 1), (20, 2)]
+
+
+def test_cards_that_are_not_new_are_skipped():
+    # Card 20 is not new, but it still takes up a position.
+    current_dues = {10: 7, 30: 7}
+    assert compute_due_changes([10, 20, 30], current_dues) == [(10, 0), (30, 2)]
+
+
+def test_no_changes():
+    assert compute_due_changes([1, 2], {1: 0, 2: 1}) == []
+
+
+def test_slot_changes_reuse_existing_positions():
+    # Card 40 is outside of the sorted cards, so its position 3 is kept.
+    current_dues = {10: 5, 20: 1, 30: 9, 40: 3}
+    assert compute_slot_changes([30, 10, 20], current_dues) == [(30, 1), (20, 9)]
+
+
+def test_spacing_leaves_gaps():
+    assert compute_due_changes([10, 20, 30], {10: 0, 20: 1, 30: 2}, spacing=3) == [(20, 3), (30, 6)]
+
+
+def test_longest_non_decreasing_subsequence():
+    assert _longest_non_decreasing_subsequence([]) == []
+    assert _longest_non_decreasing_subsequence([3, 1, 2, 2, 0, 5]) == [1, 2, 3, 5]
+
+
+def test_minimal_changes_move_one_card_into_a_gap():
+    current_dues = {10: 0, 20: 10, 30: 20, 40: 30}
+    assert compute_minimal_changes([10, 40, 20, 30], current_dues) == [(40, 5)]
+
+
+def test_minimal_changes_shift_cards_without_room():
+    # Card 40 has to go before card 10, but there is no free position before it, so the others move.
+    current_dues = {10: 0, 20: 1, 30: 2, 40: 3}
+    assert compute_minimal_changes([40, 10, 20, 30], current_dues) == [(10, 4), (20, 5), (30, 6)]
+
+
+def test_minimal_changes_skip_cards_that_are_not_new():
+    current_dues = {10: 4, 30: 2, 40: 6}
+    assert compute_minimal_changes([30, 20, 10, 40], current_dues) == []
+    assert compute_minimal_changes([40, 20, 10, 30], current_dues) == [(40, 0), (10, 1)]
+
+
+def test_keep_slots_takes_precedence_over_minimal():
+    # The cards outside of the scope keep position 1, so card 10 must not be moved there.
+    current_dues = {10: 0, 20: 2, 30: 3}
+    changes = compute_changes([30, 10, 20], current_dues, keep_slots=True, minimal=True)
+    assert changes == compute_slot_changes([30, 10, 20], current_dues) == [(30, 0), (10, 2), (20, 3)]